@@ -0,0 +1,257 @@
+import os
+import subprocess
+
+import numpy as np
+import pytest
+from astropy.table import Table
+
+from traceratops.core.chromatin_trace_table import ChromatinTraceTable
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+INPUT_DIR = os.path.join(TESTS_DIR, "data", "trace_filter", "IN")
+TRACE_FILE = os.path.join(INPUT_DIR, "trace_3D_barcode_KDtree_ROI-5.ecsv")
+
+
+@pytest.fixture
+def trace():
+    trace = ChromatinTraceTable()
+    trace.load(TRACE_FILE)
+    return trace
+
+
+def group_by_trace(data, column, reduction):
+    """Reference per-trace reduction with astropy group_by."""
+    groups = data.group_by("Trace_ID").groups
+    keys = np.asarray(groups.keys["Trace_ID"])
+    values = np.array([reduction(np.asarray(group[column])) for group in groups])
+    return keys, values
+
+
+def test_trace_index_cache(trace):
+    trace_index = trace.trace_index
+    assert trace.trace_index is trace_index, "index should be cached"
+
+    # in-place sorts keep the Trace_ID column and must be signalled
+    trace.data.sort(["x"])
+    assert trace.trace_index is trace_index
+    trace.invalidate_trace_index()
+    assert trace.trace_index is not trace_index, "index should be rebuilt"
+    keys, counts = group_by_trace(trace.data, "x", len)
+    _, means = group_by_trace(trace.data, "x", lambda x: np.mean(x, dtype=float))
+    np.testing.assert_array_equal(trace.trace_index.keys, keys)
+    np.testing.assert_array_equal(trace.trace_index.count(), counts)
+    np.testing.assert_allclose(trace.trace_index.mean(trace.data["x"]), means)
+
+    # removing rows or replacing the table rebuilds the index
+    trace_index = trace.trace_index
+    trace.data.remove_rows([0, 1])
+    assert trace.trace_index is not trace_index
+    assert trace.trace_index.offsets[-1] == len(trace.data)
+
+    trace_index = trace.trace_index
+    trace.data = trace.data[::-1]
+    assert trace.trace_index is not trace_index
+    _, counts = group_by_trace(trace.data, "x", len)
+    np.testing.assert_array_equal(trace.trace_index.count(), counts)
+
+
+def test_trace_index_reductions(trace):
+    data = trace.data
+    trace_index = trace.trace_index
+    keys, _ = group_by_trace(data, "x", len)
+    np.testing.assert_array_equal(trace_index.keys, keys)
+
+    reductions = {
+        "count": (lambda v: trace_index.count(), "x", len),
+        "sum": (trace_index.sum, "x", lambda x: np.sum(x, dtype=float)),
+        "mean": (trace_index.mean, "y", lambda x: np.mean(x, dtype=float)),
+        "min": (trace_index.min, "z", np.min),
+        "max": (trace_index.max, "z", np.max),
+        "n_unique": (trace_index.n_unique, "Barcode #", lambda x: len(np.unique(x))),
+    }
+    for name, (method, column, reference) in reductions.items():
+        _, expected = group_by_trace(data, column, reference)
+        np.testing.assert_allclose(
+            method(data[column]), expected, rtol=1e-6, err_msg=name
+        )
+
+    mask = np.asarray(data["Barcode #"]) == 21
+    expected = [
+        np.any(group["Barcode #"] == 21) for group in data.group_by("Trace_ID").groups
+    ]
+    np.testing.assert_array_equal(trace_index.any(mask), expected)
+
+
+def test_trace_index_repeats(trace):
+    data = trace.data
+    trace_ids = np.asarray(data["Trace_ID"])
+    barcodes = np.asarray(data["Barcode #"])
+    expected = [
+        np.count_nonzero((trace_ids == trace_id) & (barcodes == barcode))
+        for trace_id, barcode in zip(trace_ids, barcodes)
+    ]
+    np.testing.assert_array_equal(trace.trace_index.repeats(barcodes), expected)
+
+    def n_repeated(barcodes):
+        _, counts = np.unique(barcodes, return_counts=True)
+        return np.count_nonzero(counts > 1)
+
+    _, expected = group_by_trace(data, "Barcode #", n_repeated)
+    np.testing.assert_array_equal(trace.trace_index.n_repeated(barcodes), expected)
+
+
+def test_trace_index_radius_of_gyration(trace):
+    def radius_of_gyration(group):
+        xyz = np.stack([np.asarray(group[c], dtype=float) for c in "xyz"], axis=1)
+        return np.sqrt(np.mean(np.sum((xyz - xyz.mean(axis=0)) ** 2, axis=1)))
+
+    data = trace.data
+    expected = [radius_of_gyration(g) for g in data.group_by("Trace_ID").groups]
+    np.testing.assert_allclose(
+        trace.trace_index.radius_of_gyration(data["x"], data["y"], data["z"]),
+        expected,
+    )
+
+
+def test_trace_index_iterate(trace):
+    data = trace.data
+    groups = data.group_by("Trace_ID").groups
+    traces = trace.trace_index.iterate(data["Spot_ID"], data["x"])
+    for (key, (spot_ids, x)), group in zip(traces, groups):
+        assert key == group["Trace_ID"][0]
+        np.testing.assert_array_equal(spot_ids, group["Spot_ID"])
+        np.testing.assert_array_equal(x, group["x"])
+
+
+@pytest.mark.parametrize(
+    "file_name", ["trace_3D_barcode_KDtree_ROI-5.ecsv", "two_traces_seven_spots.ecsv"]
+)
+def test_encoded_ids_save_identical_ecsv(tmp_path, file_name):
+    outputs = []
+    for encode_ids in (False, True):
+        trace = ChromatinTraceTable()
+        trace.load(os.path.join(INPUT_DIR, file_name), encode_ids=encode_ids)
+        outputs.append(tmp_path / f"encoded_{encode_ids}.ecsv")
+        trace.save(str(outputs[-1]))
+
+    assert outputs[0].read_bytes() == outputs[1].read_bytes()
+    if file_name == "trace_3D_barcode_KDtree_ROI-5.ecsv":
+        assert outputs[1].read_bytes() == open(TRACE_FILE, "rb").read()
+
+
+def test_encoded_ids_save_identical_4dn(tmp_path):
+    fofct_dir = os.path.join(TESTS_DIR, "data", "trace_fofct", "IN")
+    fofct_file = tmp_path / "two_traces_seven_spots.4dn"
+    result = subprocess.run(
+        [
+            "trace_export_to_fofct",
+            "--ecsv_file",
+            os.path.join(fofct_dir, "two_traces_seven_spots.ecsv"),
+            "--bed_file",
+            os.path.join(fofct_dir, "barcodes.bed"),
+            "--json_file",
+            os.path.join(fofct_dir, "parameters.json"),
+            "--output_file",
+            str(fofct_file),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+
+    outputs = []
+    for encode_ids in (False, True):
+        trace = ChromatinTraceTable()
+        trace.load(str(fofct_file), encode_ids=encode_ids)
+        outputs.append(tmp_path / f"encoded_{encode_ids}.4dn")
+        trace.save(str(outputs[-1]))
+
+    assert outputs[0].read_bytes() == outputs[1].read_bytes()
+
+
+def test_append_encoded_tables():
+    files = [TRACE_FILE, os.path.join(INPUT_DIR, "two_traces_seven_spots.ecsv")]
+    traces = []
+    for file_name in files:
+        trace = ChromatinTraceTable()
+        trace.load(file_name, encode_ids=True)
+        traces.append(trace)
+    expected = [Table.read(file_name, format="ascii.ecsv") for file_name in files]
+
+    traces[0].append(traces[1])
+
+    assert traces[0].id_dictionaries, "IDs should stay encoded after append"
+    appended = traces[0].decoded_data()
+    for name in ("Spot_ID", "Trace_ID", "Chrom", "label"):
+        np.testing.assert_array_equal(
+            appended[name], np.concatenate([table[name] for table in expected])
+        )
+    np.testing.assert_array_equal(
+        traces[1].id_strings("Trace_ID"), expected[1]["Trace_ID"]
+    )
+
+
+def labeled_trace(labels, encode=True):
+    """Seven-spot trace table with the given label strings."""
+    trace = ChromatinTraceTable()
+    trace.load(os.path.join(INPUT_DIR, "two_traces_seven_spots.ecsv"))
+    trace.data.replace_column("label", np.array(labels))
+    if encode:
+        trace.encode_labels()
+    return trace
+
+
+MULTI_LABELS = ["a", "a,b", "b,c", "c", "", "b", "a,c"]
+
+
+@pytest.mark.parametrize("encode", [False, True])
+def test_keep_remove_multi_labels(encode):
+    kept = labeled_trace(MULTI_LABELS, encode)
+    kept.trace_keep_label("b")
+    assert list(kept.label_strings()) == ["a,b", "b,c", "b"]
+
+    removed = labeled_trace(MULTI_LABELS, encode)
+    removed.trace_remove_label("a")
+    assert list(removed.label_strings()) == ["b,c", "c", "", "b"]
+
+    assert (labeled_trace(MULTI_LABELS, encode).label_dictionary is not None) == encode
+
+
+def test_add_label_strings():
+    trace = labeled_trace(MULTI_LABELS, encode=False)
+    trace.add_label("a", np.ones(len(MULTI_LABELS), dtype=bool))
+    trace.add_label("d", np.arange(len(MULTI_LABELS)) == 0)
+    expected = ["a,d", "a,b", "b,c,a", "c,a", "a", "b,a", "a,c"]
+    assert list(trace.label_strings()) == expected
+
+
+def test_add_label_bitsets():
+    trace = labeled_trace(MULTI_LABELS)
+    assert trace.label_dictionary == ["a", "b", "c"]
+    trace.add_label("a", np.ones(len(MULTI_LABELS), dtype=bool))
+    trace.add_label("d", np.arange(len(MULTI_LABELS)) == 0)
+
+    assert trace.label_dictionary == ["a", "b", "c", "d"]
+    # spots that already had the label keep their string; new combinations
+    # list their labels in dictionary order, not in the order they were added
+    expected = ["a,d", "a,b", "a,b,c", "a,c", "a", "a,b", "a,c"]
+    assert list(trace.label_strings()) == expected
+    assert list(trace.has_label("d")) == [True] + [False] * 6
+
+
+def test_labels_fallback_to_strings():
+    many_labels = [
+        ",".join(f"label_{i}" for i in range(start, start + 10))
+        for start in range(0, 70, 10)
+    ]
+    trace = labeled_trace(many_labels)
+    assert trace.label_dictionary is None, "more than 64 labels should stay strings"
+    assert list(trace.has_label("label_65")) == [False] * 6 + [True]
+
+    # the 65th label added to a bitset dictionary switches back to strings
+    trace = labeled_trace(many_labels[:6] + ["label_60,label_61,label_62,label_63"])
+    assert len(trace.label_dictionary) == 64
+    trace.add_label("label_64", np.arange(7) == 6)
+    assert trace.label_dictionary is None
+    assert trace.label_strings()[6] == "label_60,label_61,label_62,label_63,label_64"
+    assert list(trace.label_strings()[:6]) == many_labels[:6]
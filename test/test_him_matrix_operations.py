@@ -0,0 +1,205 @@
+import numpy as np
+import pytest
+
+from traceratops.core.him_matrix_operations import (
+    MatrixView,
+    check_matrix_shape,
+    coordinates_2_distances,
+    distances_2_coordinates,
+    distances_2_coordinates_nan,
+    load_sc_matrix,
+)
+
+N_BARCODES = 7
+N_CELLS = 10
+
+
+@pytest.fixture
+def sc_matrix():
+    rng = np.random.default_rng(0)
+    matrix = rng.random((N_BARCODES, N_BARCODES, N_CELLS))
+    matrix[rng.random(matrix.shape) < 0.2] = np.nan
+    return matrix
+
+
+def matrix_keys(shape):
+    """Keys of every kind handled by MatrixView.__getitem__ for a view of <shape>."""
+    n_barcodes, _, n_cells = shape
+    barcode_mask = np.arange(n_barcodes) % 2 == 0
+    cell_mask = np.arange(n_cells) % 3 != 1
+    rows, cols = np.triu_indices(n_barcodes, 1)
+    return [
+        # slices
+        np.s_[:, :, :],
+        np.s_[1:4],
+        np.s_[::-1, 2:, ::2],
+        # integers, including negative ones
+        np.s_[0],
+        np.s_[-1],
+        np.s_[2, -3],
+        np.s_[-1, -2, -3],
+        np.s_[1, :, 0],
+        # Ellipsis
+        np.s_[...],
+        np.s_[..., 0],
+        np.s_[2, ...],
+        np.s_[1, ..., 1:3],
+        # boolean masks
+        np.s_[barcode_mask],
+        np.s_[:, barcode_mask],
+        np.s_[..., cell_mask],
+        np.s_[barcode_mask, 1],
+        # index lists, with repeats and negative indices
+        np.s_[[3, 0, 3]],
+        np.s_[:, [-1, 1]],
+        np.s_[..., [2, 0, -1]],
+        np.s_[[0, 2], 1:, [1]],
+        # paired index arrays, e.g. an upper triangle
+        np.s_[rows, cols],
+        np.s_[rows, cols, 1:3],
+        np.s_[rows, cols, 0],
+        np.s_[[1, 2], [3, -1], [0, 4]],
+        # broadcast index arrays
+        np.s_[np.arange(3)[:, None], np.arange(3)[None, :]],
+        np.s_[rows[:, None], cols[:, None], np.array([0, 2])[None, :]],
+        np.s_[[[0], [1]], [[2, 3]], ::3],
+    ]
+
+
+SELECTIONS = {
+    "all": (None, None),
+    "barcodes": (np.array([4, 1, 6, 0, 2, 5]), None),
+    "cells": (None, np.arange(N_CELLS) % 4 != 0),
+    "barcodes and cells": (
+        np.array([6, 5, 4, 3, 2, 1, 0]),
+        np.array([9, 0, 3, 7, 5, 2]),
+    ),
+}
+
+
+def reference_matrix(matrix, barcodes, cells):
+    """Selected matrix built eagerly with np.ix_."""
+    barcodes = np.arange(matrix.shape[0]) if barcodes is None else barcodes
+    selected = matrix[np.ix_(barcodes, barcodes)]
+    return selected if cells is None else selected[..., cells]
+
+
+@pytest.mark.parametrize("selection", SELECTIONS.values(), ids=SELECTIONS.keys())
+def test_matrix_view_getitem(sc_matrix, selection):
+    barcodes, cells = selection
+    view = MatrixView(sc_matrix, barcodes=barcodes, cells=cells)
+    expected = reference_matrix(sc_matrix, barcodes, cells)
+    assert view.shape == expected.shape
+    assert len(view) == expected.shape[0]
+
+    for key in matrix_keys(view.shape):
+        np.testing.assert_array_equal(view[key], expected[key], err_msg=repr(key))
+    np.testing.assert_array_equal(np.asarray(view), expected)
+
+
+@pytest.mark.parametrize("selection", SELECTIONS.values(), ids=SELECTIONS.keys())
+def test_matrix_view_select(sc_matrix, selection):
+    barcodes, cells = selection
+    view = MatrixView(sc_matrix, barcodes=barcodes, cells=cells)
+    expected = reference_matrix(sc_matrix, barcodes, cells)
+
+    sub_barcodes = np.array([4, 0, 3, 1, 5])
+    sub_cells = np.arange(view.shape[2]) != 1
+    sub_view = view.select(barcodes=sub_barcodes, cells=sub_cells)
+    np.testing.assert_array_equal(
+        np.asarray(sub_view), reference_matrix(expected, sub_barcodes, sub_cells)
+    )
+    for key in matrix_keys(sub_view.shape):
+        np.testing.assert_array_equal(
+            sub_view[key],
+            reference_matrix(expected, sub_barcodes, sub_cells)[key],
+            err_msg=repr(key),
+        )
+
+
+def test_load_sc_matrix_view(tmp_path, sc_matrix):
+    file_name = str(tmp_path / "sc_matrix.npy")
+    np.save(file_name, sc_matrix)
+    barcodes, cells = SELECTIONS["barcodes and cells"]
+
+    matrix = load_sc_matrix(file_name, unique_barcodes=list(range(N_BARCODES)))
+    assert isinstance(matrix, np.memmap)
+    np.testing.assert_array_equal(matrix, sc_matrix)
+
+    view = load_sc_matrix(file_name, barcodes=barcodes, cells=cells)
+    assert isinstance(view, MatrixView)
+    np.testing.assert_array_equal(
+        np.asarray(view), reference_matrix(sc_matrix, barcodes, cells)
+    )
+
+
+def test_load_sc_matrix_2d(tmp_path, sc_matrix):
+    file_name = str(tmp_path / "ensemble_matrix.npy")
+    np.save(file_name, sc_matrix[..., 0])
+
+    matrix = load_sc_matrix(file_name, unique_barcodes=list(range(N_BARCODES)), ndim=2)
+    np.testing.assert_array_equal(matrix, sc_matrix[..., 0])
+
+    with pytest.raises(ValueError, match="3D matrix"):
+        load_sc_matrix(file_name)
+
+
+def test_load_sc_matrix_wrong_shape(tmp_path, sc_matrix):
+    file_name = str(tmp_path / "sc_matrix.npy")
+    np.save(file_name, sc_matrix)
+    with pytest.raises(ValueError, match="2D matrix"):
+        load_sc_matrix(file_name, ndim=2)
+    with pytest.raises(ValueError, match="6 unique barcodes"):
+        load_sc_matrix(file_name, unique_barcodes=list(range(N_BARCODES - 1)))
+
+    non_square = str(tmp_path / "non_square.npy")
+    np.save(non_square, sc_matrix[:, :-1])
+    with pytest.raises(ValueError, match="expected a 3D matrix"):
+        load_sc_matrix(non_square)
+    with pytest.raises(ValueError, match="expected a 2D matrix"):
+        check_matrix_shape(sc_matrix[:, :-1, 0], ndim=2)
+
+
+@pytest.fixture
+def distances():
+    rng = np.random.default_rng(0)
+    coordinates = rng.normal(size=(4, 12, 3))
+    return coordinates_2_distances(coordinates)
+
+
+def test_distances_2_coordinates_round_trip(distances):
+    coordinates = distances_2_coordinates(distances[0])
+    assert coordinates.shape == (12, 3)
+    np.testing.assert_allclose(
+        coordinates_2_distances(coordinates), distances[0], atol=1e-6
+    )
+
+    # stacks of matrices
+    coordinates = distances_2_coordinates(distances)
+    assert coordinates.shape == (4, 12, 3)
+    np.testing.assert_allclose(
+        coordinates_2_distances(coordinates), distances, atol=1e-6
+    )
+
+
+def test_distances_2_coordinates_nan(distances):
+    masked = distances.copy()
+    masked[0, 2, 5] = masked[0, 5, 2] = np.nan
+    # observed in one triangle only
+    masked[1, 3, 7] = np.nan
+    # barcode without any distance
+    masked[2, 4, :] = masked[2, :, 4] = np.nan
+
+    coordinates = distances_2_coordinates_nan(masked, tolerance=1e-8, max_iter=1000)
+    reconstructed = coordinates_2_distances(coordinates)
+    np.testing.assert_allclose(reconstructed[0, 2, 5], distances[0, 2, 5], atol=1e-6)
+    np.testing.assert_allclose(reconstructed[1], distances[1], atol=1e-6)
+    np.testing.assert_allclose(reconstructed[3], distances[3], atol=1e-6)
+
+    assert np.isnan(coordinates[2, 4]).all()
+    observed = np.arange(12) != 4
+    np.testing.assert_allclose(
+        reconstructed[2][np.ix_(observed, observed)],
+        distances[2][np.ix_(observed, observed)],
+        atol=1e-6,
+    )
@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+from traceratops import localization_cp_files
+from traceratops.localization_cp_files import copy_and_rename_files, plan_copies
+
+
+@pytest.fixture
+def source_files(tmp_path):
+    files = []
+    for folder in ["001", "002", "003"]:
+        data_folder = tmp_path / "ROI" / folder / "data"
+        data_folder.mkdir(parents=True)
+        file_path = data_folder / "localizations.dat"
+        file_path.write_text(f"localizations of {folder}\n")
+        files.append(str(file_path))
+    return files
+
+
+def test_plan_copies(tmp_path, source_files):
+    copies = plan_copies(source_files, "out")
+    assert [dest for _, dest in copies] == [
+        os.path.join("out", f"localizations_{folder}.dat")
+        for folder in ["001", "002", "003"]
+    ]
+
+
+def test_plan_copies_duplicate_destinations(tmp_path, source_files):
+    duplicate = os.path.join(os.path.dirname(source_files[0]), "localizations.2.dat")
+    with open(duplicate, "w") as f:
+        f.write("second localizations of 001\n")
+    destination = tmp_path / "out"
+
+    with pytest.raises(ValueError, match="localizations_001.dat"):
+        copy_and_rename_files(source_files + [duplicate], str(destination))
+    assert os.listdir(destination) == []
+
+
+@pytest.mark.parametrize("mode", ["copy", "hardlink", "symlink"])
+def test_copy_and_rename_files(tmp_path, capsys, source_files, mode):
+    destination = str(tmp_path / "out")
+    copy_and_rename_files(source_files, destination, mode=mode, n_workers=2)
+    output = capsys.readouterr().out
+    action = "Copied" if mode == "copy" else "Linked"
+    assert output.count(f"{action}: ") == len(source_files)
+
+    for source, dest in plan_copies(source_files, destination):
+        with open(source) as f_src, open(dest) as f_dst:
+            assert f_src.read() == f_dst.read()
+        if mode == "hardlink":
+            assert os.path.samefile(source, dest) and not os.path.islink(dest)
+        elif mode == "symlink":
+            assert os.readlink(dest) == os.path.abspath(source)
+        else:
+            assert not os.path.samefile(source, dest)
+
+    # files already staged are skipped on a rerun
+    copy_and_rename_files(source_files, destination, mode=mode, n_workers=2)
+    output = capsys.readouterr().out
+    assert output.count("Skipped: ") == len(source_files)
+
+    # a modified source is copied again, links already point to it
+    with open(source_files[0], "a") as f:
+        f.write("more localizations\n")
+    copy_and_rename_files(source_files, destination, mode=mode, n_workers=2)
+    output = capsys.readouterr().out
+    expected_skips = len(source_files) if mode != "copy" else len(source_files) - 1
+    assert output.count("Skipped: ") == expected_skips
+
+
+def test_copy_and_rename_files_fallback(tmp_path, capsys, monkeypatch, source_files):
+    def link(source, destination):
+        raise OSError("Invalid cross-device link")
+
+    monkeypatch.setattr(localization_cp_files.os, "link", link)
+    destination = str(tmp_path / "out")
+    copy_and_rename_files(source_files, destination, mode="hardlink")
+    output = capsys.readouterr().out
+    assert output.count("copying instead") == len(source_files)
+    assert output.count("Copied: ") == len(source_files)
+
+    for source, dest in plan_copies(source_files, destination):
+        assert not os.path.samefile(source, dest)
+        with open(source) as f_src, open(dest) as f_dst:
+            assert f_src.read() == f_dst.read()
+
+    # the fallback copies are skipped on a rerun, and copied again if changed
+    copy_and_rename_files(source_files, destination, mode="hardlink")
+    output = capsys.readouterr().out
+    assert output.count("Skipped: ") == len(source_files)
+
+    with open(source_files[0], "a") as f:
+        f.write("more localizations\n")
+    copy_and_rename_files(source_files, destination, mode="hardlink")
+    output = capsys.readouterr().out
+    assert output.count("Skipped: ") == len(source_files) - 1
+    assert output.count("Copied: ") == 1
+
+
+def test_copy_over_hardlink(tmp_path, capsys, source_files):
+    destination = str(tmp_path / "out")
+    copy_and_rename_files(source_files, destination, mode="hardlink")
+    capsys.readouterr()
+
+    # hard links are replaced by copies, so that editing them spares the sources
+    copy_and_rename_files(source_files, destination, mode="copy")
+    output = capsys.readouterr().out
+    assert output.count("Copied: ") == len(source_files)
+    for source, dest in plan_copies(source_files, destination):
+        assert not os.path.samefile(source, dest)
+        with open(dest, "a") as f:
+            f.write("edited\n")
+        with open(source) as f:
+            assert "edited" not in f.read()
+
+
+def test_copy_and_rename_files_reflink(tmp_path, capsys, source_files):
+    # clones on copy-on-write filesystems, copies elsewhere
+    destination = str(tmp_path / "out")
+    copy_and_rename_files(source_files, destination, mode="reflink")
+    output = capsys.readouterr().out
+    assert output.count("Cloned: ") + output.count("Copied: ") == len(source_files)
+    for source, dest in plan_copies(source_files, destination):
+        with open(source) as f_src, open(dest) as f_dst:
+            assert f_src.read() == f_dst.read()
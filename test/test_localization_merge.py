@@ -0,0 +1,114 @@
+import os
+import subprocess
+
+import numpy as np
+import pytest
+from astropy.table import MaskedColumn, Table, vstack
+
+from traceratops.localization_merge import concatenate_tables, read_localizations
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+INPUT_FILE = os.path.join(TESTS_DIR, "data", "trace_filter", "IN", "intensity.ecsv")
+
+
+@pytest.fixture
+def loc_tables(tmp_path):
+    """Writes the localizations of INPUT_FILE split into two ECSV files."""
+    table = Table.read(INPUT_FILE, format="ascii.ecsv")
+    tables = [table[:4], table[4:]]
+    for i, loc_table in enumerate(tables):
+        loc_table.write(tmp_path / f"loc_{i}.ecsv", format="ascii.ecsv")
+    return tables
+
+
+def merge(tmp_path, options=""):
+    return subprocess.run(
+        f"cd {tmp_path} && ls loc_*.ecsv | localization_merge {options}",
+        capture_output=True,
+        text=True,
+        shell=True,  # Allows shell commands like `|`
+    )
+
+
+def assert_tables_equal(table, expected):
+    assert table.colnames == expected.colnames
+    for name in expected.colnames:
+        np.testing.assert_array_equal(table[name], expected[name], err_msg=name)
+
+
+def test_merge_ecsv(tmp_path, loc_tables):
+    result = merge(tmp_path, "-o merged.ecsv --n_workers 2")
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+
+    merged = Table.read(tmp_path / "merged.ecsv", format="ascii.ecsv")
+    assert_tables_equal(merged, vstack(loc_tables))
+    assert "appended_loc_files=2" in merged.meta["comments"]
+
+
+def test_merge_fits(tmp_path, loc_tables):
+    result = merge(tmp_path, "-O merged --format fits")
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+
+    merged = Table.read(tmp_path / "merged" / "merged_localizations.fits")
+    merged.convert_bytestring_to_unicode()
+    assert_tables_equal(merged, vstack(loc_tables))
+
+
+def test_merge_parquet(tmp_path, loc_tables):
+    pytest.importorskip("pyarrow")
+    result = merge(tmp_path, "-o merged.parquet --format parquet")
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+
+    merged = Table.read(tmp_path / "merged.parquet")
+    assert_tables_equal(merged, vstack(loc_tables))
+
+
+def test_merge_output_extension(tmp_path, loc_tables):
+    result = merge(tmp_path, "-o merged.ecsv --format fits")
+    assert result.returncode != 0
+    assert "does not match --format fits" in result.stdout
+    assert not os.path.exists(tmp_path / "merged.ecsv")
+    assert not os.path.exists(tmp_path / "merged.fits")
+
+    result = merge(tmp_path, "-o merged --format fits")
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+    assert os.path.exists(tmp_path / "merged.fits")
+
+
+def test_merge_mismatched_columns(tmp_path, loc_tables):
+    loc_tables[1].remove_column("mag")
+    loc_tables[1].write(tmp_path / "loc_1.ecsv", format="ascii.ecsv", overwrite=True)
+
+    result = merge(tmp_path, "-o merged.ecsv")
+    assert result.returncode != 0
+    assert "ValueError" in result.stderr
+    assert not os.path.exists(tmp_path / "merged.ecsv")
+
+    with pytest.raises(ValueError, match="differ from the first table"):
+        concatenate_tables(loc_tables)
+
+
+def test_read_localizations(tmp_path, loc_tables):
+    loc_tables[0].write(tmp_path / "loc_0.fits")
+    for file_name in ["loc_0.ecsv", "loc_0.fits"]:
+        table = read_localizations(str(tmp_path / file_name))
+        assert_tables_equal(table, loc_tables[0])
+
+
+def test_concatenate_tables_promotion(loc_tables):
+    table_1, table_2 = loc_tables
+    table_1["flux"].unit = "adu"
+    # masked values in the second table only, wider dtype in the first one
+    table_2["peak"] = MaskedColumn(table_2["peak"], mask=np.arange(len(table_2)) == 2)
+    table_1["zcentroid"] = table_1["zcentroid"].astype(np.float64)
+
+    merged = concatenate_tables([table_1, table_2])
+    expected = vstack([table_1, table_2])
+    assert_tables_equal(merged, expected)
+
+    assert isinstance(merged["peak"], MaskedColumn)
+    np.testing.assert_array_equal(merged["peak"].mask, expected["peak"].mask)
+    assert merged["peak"].mask.sum() == 1
+    assert not isinstance(merged["flux"], MaskedColumn)
+    assert merged["zcentroid"].dtype == np.float64
+    assert merged["flux"].unit == "adu"
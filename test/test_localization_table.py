@@ -0,0 +1,130 @@
+import warnings
+
+import matplotlib.pyplot as plt
+import numpy as np
+from astropy.table import Table
+
+from traceratops.core.localization_table import (
+    LocalizationTable,
+    localizations_per_barcode,
+    match_keys,
+    segment_median,
+    summarize_rois,
+)
+
+LABELS = ["xcentroid", "ycentroid", "zcentroid"]
+
+
+def localization_tables():
+    """Two tables of the same localizations, in different barcode orders."""
+    rng = np.random.default_rng(0)
+    n_rows = 12
+    table_1 = Table()
+    table_1["Buid"] = [f"buid-{i:03d}" for i in range(n_rows)]
+    table_1["Barcode #"] = np.repeat([1, 2, 3], n_rows // 3)
+    shifts = {}
+    for label in LABELS:
+        table_1[label] = rng.uniform(0, 100, n_rows)
+        shifts[label] = rng.normal(size=n_rows)
+
+    # table 2 is ordered by decreasing barcode, misses a localization of
+    # table 1 and holds one that is not in table 1
+    order = np.argsort(-table_1["Barcode #"], kind="stable")
+    order = order[order != 4]
+    table_2 = table_1[order]
+    for label in LABELS:
+        table_2[label] = table_1[label][order] + shifts[label][order]
+    table_2.add_row(["buid-999", 1, 0.0, 0.0, 0.0])
+    table_2["xcentroid"][table_2["Buid"] == "buid-007"] = np.nan
+    return table_1, table_2, shifts
+
+
+def test_match_keys():
+    keys_1 = np.array(["c", "a", "e", "b", "a"])
+    keys_2 = np.array(["b", "d", "a", "c", "a"])
+    rows_1, rows_2 = match_keys(keys_1, keys_2)
+    np.testing.assert_array_equal(rows_1, [0, 1, 3, 4])
+    # first occurrence of duplicated keys of table 2
+    np.testing.assert_array_equal(rows_2, [3, 2, 0, 2])
+    np.testing.assert_array_equal(keys_1[rows_1], keys_2[rows_2])
+
+
+def test_compares_localizations_different_orders(tmp_path):
+    table_1, table_2, shifts = localization_tables()
+    assert list(table_1["Barcode #"]) != list(table_2["Barcode #"][: len(table_1)])
+
+    diffs = LocalizationTable().compares_localizations(
+        table_1, table_2, [str(tmp_path / "compare"), ".png"]
+    )
+    plt.close("all")
+    assert (tmp_path / "compare.png").exists()
+
+    # rows of table 1 found in table 2, in the order of table 1
+    found = np.arange(len(table_1)) != 4
+    for label in LABELS:
+        expected = shifts[label][found]
+        if label == "xcentroid":
+            expected = expected[table_1["Buid"][found] != "buid-007"]
+        np.testing.assert_allclose(diffs[label], expected)
+
+
+def random_localizations(n_rows=300):
+    rng = np.random.default_rng(1)
+    table = Table()
+    table["ROI #"] = rng.choice([1, 2, 5], n_rows)
+    table["Barcode #"] = rng.integers(1, 9, n_rows)
+    table["flux"] = rng.uniform(0, 1000, n_rows)
+    table["peak"] = rng.uniform(0, 100, n_rows).astype(np.float32)
+    table["flux"][rng.random(n_rows) < 0.1] = np.nan
+    return table
+
+
+def test_segment_median():
+    rng = np.random.default_rng(2)
+    n_segments = 6
+    codes = rng.choice([0, 1, 2, 4, 5], 200)
+    values = rng.normal(size=200)
+    values[rng.random(200) < 0.2] = np.nan
+    # segment 3 has no rows and segment 5 only NaNs
+    values[codes == 5] = np.nan
+
+    medians = segment_median(codes, values, n_segments)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        expected = [np.nanmedian(values[codes == code]) for code in range(n_segments)]
+    np.testing.assert_array_equal(medians, expected)
+    assert np.isnan(medians[[3, 5]]).all()
+
+
+def test_summarize_rois():
+    table = random_localizations()
+    summary = summarize_rois(table, columns=("flux", "peak", "missing"))
+    assert summary.colnames == [
+        "ROI #",
+        "Barcode #",
+        "n_localizations",
+        "median_flux",
+        "median_peak",
+    ]
+
+    rois, barcodes = np.asarray(table["ROI #"]), np.asarray(table["Barcode #"])
+    pairs = sorted(set(zip(rois, barcodes)))
+    assert list(zip(summary["ROI #"], summary["Barcode #"])) == pairs
+    for row, (roi, barcode) in zip(summary, pairs):
+        rows = (rois == roi) & (barcodes == barcode)
+        assert row["n_localizations"] == rows.sum()
+        for column in ["flux", "peak"]:
+            np.testing.assert_allclose(
+                row[f"median_{column}"], np.nanmedian(table[column][rows])
+            )
+    assert summary["n_localizations"].sum() == len(table)
+
+
+def test_localizations_per_barcode():
+    table = random_localizations()
+    barcodes, counts = localizations_per_barcode(table)
+    expected_barcodes, expected_counts = np.unique(
+        table["Barcode #"], return_counts=True
+    )
+    np.testing.assert_array_equal(barcodes, expected_barcodes)
+    np.testing.assert_array_equal(counts, expected_counts)
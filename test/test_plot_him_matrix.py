@@ -160,6 +160,18 @@ def test_missing_arguments(bad_args):
     ), "Script should exit normally (code 0) when missing arguments"
 
 
+def test_barcodes_mismatch():
+    """Test that a barcode list not matching the matrix is rejected"""
+    result = subprocess.run(
+        ["plot_him_matrix", "-M", INPUT_NPY, "-B", FAKE_BARCODES_PATH, "-O", INPUT_DIR],
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode != 0, "Script should fail when barcodes do not match"
+    assert "unique barcodes were provided" in result.stderr
+
+
 formats = ["png", "svg", "pdf"]
 
 
@@ -454,3 +466,54 @@ def test_matplotlib_v3_5_1_error():
     assert os.path.exists(generated_nan_path)
     check_script_run_normally(result, generated_matrix_path, expected_matrix_path)
     delete_paths([generated_png_path, generated_matrix_path, generated_nan_path])
+
+
+def test_thresholds_sweep():
+    # Sweep mode should produce the same matrices as one run per threshold
+    names = {
+        "0.5": "Fig_bc_4_cells_4_proximity_T0.5_0.25-0.75",
+        "1": "Fig_bc_4_cells_4_proximity_T1.0_0.25-1.00",
+    }
+    generated_nan_path = os.path.join(INPUT_DIR, "Fig_bc_4_cells_4_nan%_0.25-0.75.png")
+    generated_stack_path = os.path.join(
+        INPUT_DIR, "Fig_bc_4_cells_4_proximity_sweep.npz"
+    )
+    generated_paths = [generated_nan_path, generated_stack_path]
+    for name in names.values():
+        generated_paths += [
+            os.path.join(INPUT_DIR, name + ".npy"),
+            os.path.join(INPUT_DIR, name + ".png"),
+        ]
+    delete_paths(generated_paths)
+
+    # Run script with CLI
+    result = subprocess.run(
+        [
+            "plot_him_matrix",
+            "-M",
+            FAKE_MATRIX_PATH,
+            "-B",
+            FAKE_BARCODES_PATH,
+            "-O",
+            INPUT_DIR,
+            "--thresholds",
+            *names.keys(),
+            "--keep_nan",
+            "--stack",
+        ],
+        capture_output=True,
+        text=True,
+    )
+
+    for path in generated_paths:
+        assert os.path.exists(path), f"Output file {path} isn't created"
+    for name in names.values():
+        check_script_run_normally(
+            result,
+            os.path.join(INPUT_DIR, name + ".npy"),
+            os.path.join(OUTPUT_DIR, name + ".npy"),
+        )
+    stack = np.load(generated_stack_path)
+    np.testing.assert_array_equal(stack["thresholds"], [0.5, 1.0])
+    assert stack["matrices"].shape == (2, 4, 4)
+    delete_paths(generated_paths)
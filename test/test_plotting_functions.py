@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+from scipy.stats import mannwhitneyu, ranksums
+
+from traceratops.core.plotting_functions import (
+    Wilcoxon_matrix,
+    permutation_ranksums_rows,
+    ranksums_rows,
+)
+
+
+def padded_samples(rng, n_rows, n_values, tied=False):
+    """Random samples of varying sizes per row, padded with NaNs."""
+    if tied:
+        samples = rng.integers(0, 5, (n_rows, n_values)).astype(float)
+    else:
+        samples = rng.normal(size=(n_rows, n_values))
+    sizes = rng.integers(3, n_values + 1, n_rows)
+    samples[np.arange(n_values) >= sizes[:, None]] = np.nan
+    return samples
+
+
+def valid(row):
+    return row[~np.isnan(row)]
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def test_ranksums_rows_untied(rng):
+    x = padded_samples(rng, 20, 15)
+    y = padded_samples(rng, 20, 12) + 0.5
+
+    z, p = ranksums_rows(x, y)
+    for row in range(len(x)):
+        expected = ranksums(valid(x[row]), valid(y[row]))
+        np.testing.assert_allclose(z[row], expected.statistic)
+        np.testing.assert_allclose(p[row], expected.pvalue)
+
+
+def test_ranksums_rows_tied(rng):
+    x = padded_samples(rng, 20, 15, tied=True)
+    y = padded_samples(rng, 20, 12, tied=True) + 1
+
+    _, p = ranksums_rows(x, y)
+    z_uncorrected, p_uncorrected = ranksums_rows(x, y, tie_correction=False)
+    for row in range(len(x)):
+        expected = mannwhitneyu(
+            valid(x[row]), valid(y[row]), method="asymptotic", use_continuity=False
+        )
+        np.testing.assert_allclose(p[row], expected.pvalue)
+
+        # scipy.stats.ranksums does not correct for ties
+        expected = ranksums(valid(x[row]), valid(y[row]))
+        np.testing.assert_allclose(z_uncorrected[row], expected.statistic)
+        np.testing.assert_allclose(p_uncorrected[row], expected.pvalue)
+
+
+def test_ranksums_rows_empty_sample(rng):
+    x = padded_samples(rng, 3, 5)
+    y = padded_samples(rng, 3, 5)
+    y[1] = np.nan
+    _, p = ranksums_rows(x, y)
+    assert np.isnan(p[1])
+    assert not np.isnan(p[[0, 2]]).any()
+    assert np.isnan(permutation_ranksums_rows(x, y, n_permutations=10, rng=0)[1])
+
+
+def test_permutation_ranksums_rows_reproducible(rng):
+    x = padded_samples(rng, 6, 8, tied=True)
+    y = padded_samples(rng, 6, 7, tied=True) + 1
+
+    p = permutation_ranksums_rows(x, y, n_permutations=999, rng=42)
+    np.testing.assert_array_equal(
+        p, permutation_ranksums_rows(x, y, n_permutations=999, rng=42)
+    )
+    np.testing.assert_array_equal(
+        p,
+        permutation_ranksums_rows(
+            x, y, n_permutations=999, rng=np.random.default_rng(42)
+        ),
+    )
+    # the batches do not change the random relabellings
+    np.testing.assert_array_equal(
+        p, permutation_ranksums_rows(x, y, n_permutations=999, rng=42, max_elements=1)
+    )
+    assert np.all((p > 0) & (p <= 1))
+
+
+def test_permutation_ranksums_rows_exact(rng):
+    x = padded_samples(rng, 5, 6)
+    y = padded_samples(rng, 5, 6) + 1
+
+    p = permutation_ranksums_rows(x, y, n_permutations=9999, rng=0)
+    for row in range(len(x)):
+        expected = mannwhitneyu(valid(x[row]), valid(y[row]), method="exact")
+        np.testing.assert_allclose(p[row], expected.pvalue, atol=0.02)
+
+
+@pytest.mark.parametrize("mode", ["ranksums", "permutation"])
+def test_wilcoxon_matrix(rng, mode):
+    n_bins = 5
+    m1 = rng.integers(0, 4, (n_bins, n_bins, 12)).astype(float)
+    m2 = rng.integers(1, 5, (n_bins, n_bins, 9)).astype(float)
+    m1[rng.random(m1.shape) < 0.2] = np.nan
+
+    result = Wilcoxon_matrix(
+        m1, m2, list(range(n_bins)), mode=mode, n_permutations=99, rng=0
+    )
+    np.testing.assert_array_equal(result, result.T)
+    np.testing.assert_array_equal(np.diag(result), 0)
+
+    rows, cols = np.triu_indices(n_bins, k=1)
+    if mode == "permutation":
+        expected = permutation_ranksums_rows(
+            m1[rows, cols], m2[rows, cols], n_permutations=99, rng=0
+        )
+    else:
+        _, expected = ranksums_rows(m1[rows, cols], m2[rows, cols])
+    np.testing.assert_array_equal(result[rows, cols], expected)
@@ -0,0 +1,40 @@
+import os
+import shutil
+import subprocess
+
+import numpy as np
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+INPUT_DIR = os.path.join(TESTS_DIR, "data", "plot_him_matrix", "IN")
+INPUT_NPY = INPUT_DIR + os.sep + "n_cells_250_pwd_sc_matrix.npy"
+
+
+def test_single_cell():
+    output_folder = os.path.join(INPUT_DIR, "ensemble_structure")
+    # Run script with CLI
+    result = subprocess.run(
+        f"cd {INPUT_DIR} && pwd_matrix_2_pdb --input {INPUT_NPY} --single_cell"
+        " --pdb --chunk_size 100 --n_workers 2",
+        capture_output=True,
+        text=True,
+        shell=True,
+    )
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+    coordinates = np.load(
+        output_folder + os.sep + "n_cells_250_pwd_sc_matrix_sc_coordinates.npy"
+    )
+    sc_matrix = np.moveaxis(np.load(INPUT_NPY), -1, 0)
+    assert coordinates.shape == (250, 26, 3)
+
+    # reconstructed distances match the measured ones
+    distances = np.linalg.norm(
+        coordinates[:, :, None, :] - coordinates[:, None, :, :], axis=-1
+    )
+    measured = ~np.isnan(sc_matrix) & ~np.isnan(distances)
+    assert np.median(np.abs(distances[measured] - sc_matrix[measured])) < 1e-2
+
+    # one PDB file per reconstructed cell
+    n_cells = np.sum(np.any(~np.isnan(coordinates[:, :, 0]), axis=1))
+    pdb_folder = output_folder + os.sep + "n_cells_250_pwd_sc_matrix_sc_PDBs"
+    assert len(os.listdir(pdb_folder)) == n_cells
+    shutil.rmtree(output_folder)
@@ -0,0 +1,34 @@
+import os
+
+import matplotlib.pyplot as plt
+import pytest
+
+from traceratops.core.chromatin_trace_table import ChromatinTraceTable
+from traceratops.trace_analyzer import plot_neighbor_distances
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+TRACE_FILE = os.path.join(
+    TESTS_DIR, "data", "trace_filter", "IN", "trace_3D_barcode_KDtree_ROI-5.ecsv"
+)
+
+
+@pytest.mark.parametrize(
+    "file_name, lag_file",
+    [
+        ("neighbors.png", "neighbors_lags.png"),
+        # dots in folder names and names without extension
+        (
+            os.path.join("run.v2", "neighbors"),
+            os.path.join("run.v2", "neighbors_lags.png"),
+        ),
+        ("neighbors", "neighbors_lags.png"),
+    ],
+)
+def test_plot_neighbor_distances_lags(tmp_path, file_name, lag_file):
+    trace = ChromatinTraceTable()
+    trace.load(TRACE_FILE)
+    os.makedirs(tmp_path / "run.v2", exist_ok=True)
+
+    plot_neighbor_distances(trace, str(tmp_path / file_name), max_lag=3)
+    plt.close("all")
+    assert os.path.exists(tmp_path / lag_file)
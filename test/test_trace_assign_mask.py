@@ -0,0 +1,104 @@
+import filecmp
+import os
+import subprocess
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+INPUT_DIR = os.path.join(TESTS_DIR, "data", "trace_assign_mask", "IN")
+OUTPUT_DIR = os.path.join(TESTS_DIR, "data", "trace_assign_mask", "OUT")
+INPUT_TRACE = os.path.join(INPUT_DIR, "two_traces_seven_spots.ecsv")
+
+
+def run_assign_mask(out_file, args, expected=None):
+    gen_file = os.path.join(INPUT_DIR, out_file)
+    expected_file = os.path.join(OUTPUT_DIR, expected or out_file)
+    if os.path.exists(gen_file):
+        os.remove(gen_file)
+    result = subprocess.run(
+        ["trace_assign_mask", "--input", INPUT_TRACE] + args,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+    assert os.path.exists(gen_file), f"Output file {gen_file} isn't created"
+    assert filecmp.cmp(
+        gen_file, expected_file, shallow=False
+    ), f"Difference detected between {gen_file} and {expected_file}"
+    os.remove(gen_file)
+    return result
+
+
+def test_mask_2d_out_of_bounds():
+    """Spots at x=203 fall outside the (203, 80) mask and must not be labeled."""
+    result = run_assign_mask(
+        "two_traces_seven_spots_nucleus.ecsv",
+        [
+            "--mask_file",
+            os.path.join(INPUT_DIR, "mask_2d.npy"),
+            "--pixel_size",
+            "1",
+            "--label",
+            "nucleus",
+        ],
+    )
+    assert "2 trace rows fall outside the mask image" in result.stdout
+
+
+def test_labeled_masks_one_pass():
+    """A 3D and a 2D integer-labeled mask are applied in one pass: the first mask
+    with a non-zero label fills Mask_id and both labels are appended."""
+    run_assign_mask(
+        "two_traces_seven_spots_compartment_nucleus.ecsv",
+        [
+            "--mask_file",
+            os.path.join(INPUT_DIR, "mask_3d_labeled.npy"),
+            os.path.join(INPUT_DIR, "mask_2d_labeled.npy"),
+            "--pixel_size",
+            "10",
+            "--pixel_size_z",
+            "1",
+            "--label",
+            "compartment",
+            "nucleus",
+            "--labeled_mask",
+        ],
+    )
+
+
+def test_trace_fraction_mode():
+    """Trace aaaaaaaa has 2/4 spots in the mask and trace bbbbbbbb 2/3: only the
+    second one reaches --min_fraction and all of its spots are labeled."""
+    run_assign_mask(
+        "two_traces_seven_spots_nucleus.ecsv",
+        [
+            "--mask_file",
+            os.path.join(INPUT_DIR, "mask_2d.npy"),
+            "--pixel_size",
+            "1",
+            "--label",
+            "nucleus",
+            "--trace_mode",
+            "fraction",
+            "--min_fraction",
+            "0.6",
+        ],
+        expected="two_traces_seven_spots_nucleus_fraction.ecsv",
+    )
+
+
+def test_trace_com_mode():
+    """The centers of mass of both traces are inside the mask, so all the spots
+    are labeled, including those at x=203 outside the mask image."""
+    run_assign_mask(
+        "two_traces_seven_spots_nucleus.ecsv",
+        [
+            "--mask_file",
+            os.path.join(INPUT_DIR, "mask_2d.npy"),
+            "--pixel_size",
+            "1",
+            "--label",
+            "nucleus",
+            "--trace_mode",
+            "com",
+        ],
+        expected="two_traces_seven_spots_nucleus_com.ecsv",
+    )
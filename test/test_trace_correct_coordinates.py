@@ -0,0 +1,83 @@
+import subprocess
+
+import numpy as np
+import pytest
+from astropy.table import Table
+
+from traceratops.trace_correct_coordinates import optimize_offsets
+
+N_TRACES = 40
+N_BARCODES = 8
+
+
+@pytest.fixture
+def shifted_traces():
+    """
+    Traces whose spots sit at the trace center plus a fixed offset per barcode,
+    with a few barcodes missing from each trace.
+    """
+    rng = np.random.default_rng(0)
+    offsets = {coor: rng.normal(scale=0.3, size=N_BARCODES) for coor in "xyz"}
+    rows = {"Trace_ID": [], "Barcode #": [], "x": [], "y": [], "z": []}
+    centers = {coor: [] for coor in "xyz"}
+    for trace in range(N_TRACES):
+        center = rng.uniform(0, 50, 3)
+        for barcode in np.flatnonzero(rng.random(N_BARCODES) > 0.25):
+            rows["Trace_ID"].append(f"trace-{trace:03d}")
+            rows["Barcode #"].append(barcode + 1)
+            for i, coor in enumerate("xyz"):
+                rows[coor].append(center[i] + offsets[coor][barcode])
+                centers[coor].append(center[i])
+    table = Table(rows)
+    for coor in "xyz":
+        table[coor] = table[coor].astype(np.float32)
+    return table, {coor: np.array(values) for coor, values in centers.items()}
+
+
+def barcode_offsets(table, centers, coor):
+    """Mean offset of each barcode from the true center of its traces."""
+    barcodes = np.asarray(table["Barcode #"])
+    deviations = np.asarray(table[coor], dtype=float) - centers[coor]
+    return np.array([deviations[barcodes == b].mean() for b in np.unique(barcodes)])
+
+
+def test_optimize_offsets_z(shifted_traces):
+    table, centers = shifted_traces
+    corrected = optimize_offsets(table, coordinates=("z",), max_iter=50, tolerance=1e-5)
+
+    # offsets are removed up to a global shift of all the barcodes
+    assert np.ptp(barcode_offsets(table, centers, "z")) > 0.5
+    assert np.ptp(barcode_offsets(corrected, centers, "z")) < 1e-3
+    for coor in "xy":
+        np.testing.assert_array_equal(corrected[coor], table[coor])
+    assert corrected["z"].dtype == np.float32
+
+
+def test_correct_coordinates_xy(tmp_path, shifted_traces):
+    table, centers = shifted_traces
+    input_file = str(tmp_path / "traces.ecsv")
+    table.write(input_file, format="ascii.ecsv")
+
+    result = subprocess.run(
+        [
+            "trace_correct_coordinates",
+            "--input",
+            input_file,
+            "--coordinates",
+            "x",
+            "y",
+            "--max_iter",
+            "50",
+            "--tolerance",
+            "1e-5",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+
+    corrected = Table.read(tmp_path / "traces_corrected.ecsv", format="ascii.ecsv")
+    for coor in "xy":
+        assert np.ptp(barcode_offsets(table, centers, coor)) > 0.5
+        assert np.ptp(barcode_offsets(corrected, centers, coor)) < 1e-3
+    np.testing.assert_array_equal(corrected["z"], table["z"])
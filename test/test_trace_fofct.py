@@ -0,0 +1,68 @@
+import os
+import subprocess
+
+import numpy as np
+from astropy.table import Table
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+INPUT_DIR = os.path.join(TESTS_DIR, "data", "trace_fofct", "IN")
+INPUT_ECSV = os.path.join(INPUT_DIR, "two_traces_seven_spots.ecsv")
+INPUT_BED = os.path.join(INPUT_DIR, "barcodes.bed")
+INPUT_JSON = os.path.join(INPUT_DIR, "parameters.json")
+
+
+def test_export_import_round_trip():
+    fofct_file = os.path.join(INPUT_DIR, "two_traces_seven_spots_FOFCT.csv.gz")
+    ecsv_file = os.path.join(INPUT_DIR, "two_traces_seven_spots_imported.ecsv")
+
+    # Export to a gzipped FOF-CT file, formatted by blocks of 3 rows
+    result = subprocess.run(
+        [
+            "trace_export_to_fofct",
+            "--ecsv_file",
+            INPUT_ECSV,
+            "--bed_file",
+            INPUT_BED,
+            "--json_file",
+            INPUT_JSON,
+            "--output_file",
+            fofct_file.removesuffix(".gz"),
+            "--gzip",
+            "--chunksize",
+            "3",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+    assert os.path.exists(fofct_file)
+
+    # Import it back, parsed by chunks of 2 rows
+    result = subprocess.run(
+        [
+            "trace_import_from_fofct",
+            "--fofct_file",
+            fofct_file,
+            "--bed_file",
+            INPUT_BED,
+            "--output_file",
+            ecsv_file,
+            "--chunksize",
+            "2",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+
+    original = Table.read(INPUT_ECSV, format="ascii.ecsv")
+    imported = Table.read(ecsv_file, format="ascii.ecsv")
+    for col in ["Spot_ID", "Trace_ID", "Barcode #", "ROI #"]:
+        assert np.array_equal(original[col], imported[col]), f"{col} differs"
+    for col in ["x", "y", "z"]:
+        assert np.allclose(original[col], imported[col]), f"{col} differs"
+    expected_chroms = ["chr3R", "chr2L", "chr2L", "chr2L", "chr2L", "chr3R", "chr3R"]
+    assert list(imported["Chrom"]) == expected_chroms
+
+    os.remove(fofct_file)
+    os.remove(ecsv_file)
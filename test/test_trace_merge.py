@@ -45,3 +45,22 @@ def test_merge_conflict():
         gen_file, expected_file, shallow=False
     ), f"Difference detected between {gen_file} and {expected_file}"
     os.remove(gen_file)
+
+
+def test_merge_conflict_stream():
+    out_file = "merged_trace_1_2_3.ecsv"
+    # Run script with CLI, streaming rows to the output file
+    result = subprocess.run(
+        f"cd {INPUT_DIR} && ls trace_*.ecsv | trace_merge --name {out_file} --stream",
+        capture_output=True,
+        text=True,
+        shell=True,  # Allows shell commands like `|`
+    )
+    assert result.returncode == 0, f"Runtime error: {result.stderr}"
+    gen_file = os.path.join(INPUT_DIR, out_file)
+    expected_file = os.path.join(OUTPUT_DIR, out_file)
+    assert os.path.exists(gen_file)
+    assert filecmp.cmp(
+        gen_file, expected_file, shallow=False
+    ), f"Difference detected between {gen_file} and {expected_file}"
+    os.remove(gen_file)
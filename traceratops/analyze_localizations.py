@@ -17,7 +17,11 @@ import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 
-from traceratops.core.localization_table import LocalizationTable
+from traceratops.core.localization_table import (
+    LocalizationTable,
+    localizations_per_barcode,
+    summarize_rois,
+)
 
 font = {"weight": "normal", "size": 12}
 matplotlib.rc("font", **font)
@@ -67,10 +71,7 @@ def get_barcode_statistics(barcode_map, output_filename="localization_analysis.p
     None.
 
     """
-    localizations_by_barcode = barcode_map.group_by("Barcode #")
-    trace_lengths = list()
-    for sub_trace_table in localizations_by_barcode.groups:
-        trace_lengths.append(len(sub_trace_table))
+    _, trace_lengths = localizations_per_barcode(barcode_map)
     distributions = [trace_lengths]
     axis_x_labels = [
         "number of localizations",
@@ -113,13 +114,8 @@ def get_number_localization_per_barcode(
     None.
 
     """
-    localizations_by_barcode = barcode_map.group_by("Barcode #")
-    barcode_lengths = list()
-    barcode_name = list()
-    for sub_trace_table in localizations_by_barcode.groups:
-        barcode_lengths.append(len(sub_trace_table))
-        unique_barcode_name = list(set(sub_trace_table["Barcode #"]))
-        barcode_name.append(str(unique_barcode_name[0]))
+    barcodes, barcode_lengths = localizations_per_barcode(barcode_map)
+    barcode_name = [str(barcode) for barcode in barcodes]
     print("Barcodes detected: \n{}".format(barcode_name))
     distributions = [barcode_lengths]
     axis_x_labels = [
@@ -183,6 +179,36 @@ def analyze_table(table, localization_file, barcode_map, unique_barcodes):
     get_number_localization_per_barcode(
         barcode_map, "".join(localization_stats_perBarcode_file)
     )
+    summarize_localizations(
+        barcode_map, localization_file.split(".")[0] + "_localization_stats_perROI.ecsv"
+    )
+
+
+def summarize_localizations(barcode_map, output_filename):
+    """
+    Prints the number of localizations per ROI and saves a table with the
+    number of localizations and median flux and peak of each (ROI, barcode) pair.
+
+    Parameters
+    ----------
+    barcode_map : astropy Table
+        localization table.
+    output_filename : str
+        output ecsv file.
+
+    Returns
+    -------
+    summary : astropy Table
+        per-ROI, per-barcode summary.
+    """
+    summary = summarize_rois(barcode_map)
+    rois, codes = np.unique(summary["ROI #"], return_inverse=True)
+    counts = np.bincount(codes.ravel(), weights=summary["n_localizations"])
+    for roi, count in zip(rois, counts):
+        print(f"$ ROI {roi}: {int(count)} localizations")
+    summary.write(output_filename, format="ascii.ecsv", overwrite=True)
+    print(f"$ Saved per-ROI localization statistics: {output_filename}")
+    return summary
 
 
 def process_localizations(folder, localization_files=list()):
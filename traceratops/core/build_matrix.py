@@ -22,9 +22,8 @@ import glob
 import os
 
 import numpy as np
-from astropy.table import unique
 from sklearn.metrics import pairwise_distances
-from tqdm.contrib import tzip
+from tqdm import tqdm
 
 from traceratops.core.chromatin_trace_table import ChromatinTraceTable
 from traceratops.core.him_matrix_operations import (
@@ -112,13 +111,13 @@ class BuildMatrix:
         self.unique_barcodes list of unique barcodes
 
         """
-        # detects number of unique traces from trace table
-        number_matrices = len(unique(self.trace_table.data, keys="Trace_ID"))
-
-        # finds unique barcodes from trace table
-        unique_barcodes = unique(self.trace_table.data, keys="Barcode #")[
-            "Barcode #"
-        ].data
+        # indexes traces and barcodes of the trace table
+        trace_index = self.trace_table.trace_index
+        number_matrices = len(trace_index)
+        data = self.trace_table.data
+        unique_barcodes, barcode_codes = np.unique(
+            data["Barcode #"].data, return_inverse=True
+        )
         number_unique_barcodes = unique_barcodes.shape[0]
 
         print(
@@ -130,67 +129,45 @@ class BuildMatrix:
         sc_matrix = np.zeros(
             (number_unique_barcodes, number_unique_barcodes, number_matrices)
         )
-        sc_matrix[:] = np.NaN
+        sc_matrix[:] = np.nan
 
         # loops over traces
         print("> Processing traces...", "INFO")
-        data_traces = self.trace_table.data.group_by("Trace_ID")
-        for trace, itrace in tzip(data_traces.groups, range(number_matrices)):
-            barcodes_to_process = trace["Barcode #"].data
-
-            # gets lists of x, y and z coordinates for barcodes assigned to a cell mask
-            x, y, z = (
-                np.array(trace["x"].data),
-                np.array(trace["y"].data),
-                np.array(trace["z"].data),
-            )
+        traces = trace_index.iterate(
+            barcode_codes.ravel(), data["x"].data, data["y"].data, data["z"].data
+        )
+        for itrace, (_, (barcode_indices, x, y, z)) in enumerate(
+            tqdm(traces, total=number_matrices)
+        ):
             pwd_matrix = self.calculate_pwd_single_mask(x, y, z)
 
-            # loops over barcodes detected in cell mask: barcode1
-            for barcode1, ibarcode1 in zip(
-                barcodes_to_process, range(len(barcodes_to_process))
-            ):
-                index_barcode_1 = np.nonzero(unique_barcodes == barcode1)[0][0]
-
-                # loops over barcodes detected in cell mask: barcode2
-                for barcode2, ibarcode2 in zip(
-                    barcodes_to_process, range(len(barcodes_to_process))
-                ):
-                    if barcode1 != barcode2:
-                        index_barcode_2 = np.nonzero(unique_barcodes == barcode2)[0][0]
-
-                        # attributes distance from the PWDmatrix field in the sc_pwd_item table
-                        newdistance = pwd_matrix[ibarcode1, ibarcode2]
-
-                        # checks distance
-                        if newdistance < distance_threshold:
-                            # inserts newdistance into sc_matrix using desired method
-                            if mode == "last":
-                                sc_matrix[index_barcode_1][index_barcode_2][
-                                    itrace
-                                ] = newdistance
-                            elif mode == "mean":
-                                sc_matrix[index_barcode_1][index_barcode_2][itrace] = (
-                                    np.nanmean(
-                                        [
-                                            newdistance,
-                                            sc_matrix[index_barcode_1][index_barcode_2][
-                                                itrace
-                                            ],
-                                        ]
-                                    )
-                                )
-                            elif mode == "min":
-                                sc_matrix[index_barcode_1][index_barcode_2][itrace] = (
-                                    np.nanmin(
-                                        [
-                                            newdistance,
-                                            sc_matrix[index_barcode_1][index_barcode_2][
-                                                itrace
-                                            ],
-                                        ]
-                                    )
-                                )
+            # pairs of different barcodes detected in the trace
+            index_barcode_1, index_barcode_2 = np.meshgrid(
+                barcode_indices, barcode_indices, indexing="ij"
+            )
+            valid = (index_barcode_1 != index_barcode_2) & (
+                pwd_matrix < distance_threshold
+            )
+
+            if mode == "min":
+                np.fmin.at(
+                    sc_matrix[:, :, itrace],
+                    (index_barcode_1[valid], index_barcode_2[valid]),
+                    pwd_matrix[valid],
+                )
+                continue
+
+            # inserts distances into sc_matrix in trace order using desired method
+            for ibarcode1, ibarcode2 in zip(*np.nonzero(valid)):
+                index_1 = barcode_indices[ibarcode1]
+                index_2 = barcode_indices[ibarcode2]
+                newdistance = pwd_matrix[ibarcode1, ibarcode2]
+                if mode == "last":
+                    sc_matrix[index_1][index_2][itrace] = newdistance
+                elif mode == "mean":
+                    sc_matrix[index_1][index_2][itrace] = np.nanmean(
+                        [newdistance, sc_matrix[index_1][index_2][itrace]]
+                    )
 
         self.sc_matrix = sc_matrix
         self.unique_barcodes = unique_barcodes
@@ -352,7 +329,7 @@ class BuildMatrix:
 
         # creates and loads trace table
         self.trace_table = ChromatinTraceTable()
-        self.trace_table.load(file)
+        self.trace_table.load(file, encode_ids=True)
 
         # runs calculation of PWD matrix
         self.build_distance_matrix(
@@ -3,6 +3,7 @@
 trace table management class
 """
 
+import gzip
 import os
 import sys
 
@@ -11,11 +12,33 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from astropy.table import Table, vstack
+from astropy.table.meta import get_header_from_yaml
 from tqdm import tqdm
 
 font = {"weight": "normal", "size": 22}
 matplotlib.rc("font", **font)
 
+# explicit dtypes of the FOF-CT core columns, avoids type inference on large files
+FOFCT_DTYPES = {
+    "Spot_ID": str,
+    "Trace_ID": str,
+    "X": "float64",
+    "Y": "float64",
+    "Z": "float64",
+    "Chrom": "category",
+    "Chrom_Start": "int64",
+    "Chrom_End": "int64",
+}
+GENOMIC_COORDINATES = ["Chrom", "Chrom_Start", "Chrom_End"]
+# UUID columns that can be held as integer codes in memory
+ID_COLUMNS = ("Trace_ID", "Spot_ID")
+# columns dictionary-encoded by ChromatinTraceTable.encode_ids
+CATEGORICAL_COLUMNS = ID_COLUMNS + ("Chrom",)
+# separator of the labels of a spot in the 'label' column
+LABEL_SEPARATOR = ","
+# maximum number of distinct labels held in a bitset
+MAX_LABELS = 64
+
 
 def read_table_from_ecsv(path):
     """Read an astropy Table saved as an ``ecsv`` file."""
@@ -37,6 +60,251 @@ def save_table_to_ecsv(data, path):
     )
 
 
+def read_ecsv_header(path):
+    """
+    Read only the YAML header of an ``ecsv`` file, without parsing its rows.
+    Returns a dict with the ``datatype`` list of the columns and the table ``meta``.
+    """
+    lines = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            lines.append(line[1:].removeprefix(" ").rstrip("\n"))
+
+    return get_header_from_yaml(lines)
+
+
+def remap_rois(rois, used_rois):
+    """
+    Renumbers the ROIs of a table that are already used by other tables.
+
+    Conflicting ROIs get the next numbers above ``max(used_rois)`` that are
+    neither used nor present in the table itself. The mapping is applied to
+    all rows at once.
+
+    Parameters
+    ----------
+    rois : array-like
+        'ROI #' column of the table to add.
+    used_rois : set
+        ROIs already present in the other tables. Updated in place with the
+        ROIs of the remapped table.
+
+    Returns
+    -------
+    numpy.ndarray
+        remapped 'ROI #' column.
+    """
+    unique_rois, inverse = np.unique(np.asarray(rois), return_inverse=True)
+    new_rois = unique_rois.copy()
+    taken = used_rois | set(unique_rois.tolist())
+    current_max = max(used_rois) + 1 if used_rois else 1
+    for idx, roi in enumerate(unique_rois.tolist()):
+        if roi in used_rois:
+            while current_max in taken:
+                current_max += 1
+            new_rois[idx] = current_max
+            taken.add(current_max)
+    used_rois.update(new_rois.tolist())
+
+    return new_rois[inverse.ravel()]
+
+
+def open_text(file_name, mode="r"):
+    """
+    Opens a text file for reading ("r") or writing ("w"),
+    gzip-compressed if its name ends with ``.gz``.
+    """
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, mode + "t", newline="", encoding="utf-8")
+    return open(file_name, mode, newline="", encoding="utf-8")
+
+
+def strip_gz(file_name):
+    """Returns <file_name> without its ``.gz`` extension, if any."""
+    return file_name[:-3] if file_name.endswith(".gz") else file_name
+
+
+def write_csv_blocks(f, table, columns=None, chunksize=100_000, lineterminator="\n"):
+    """
+    Writes the rows of an astropy Table as CSV, without header, one block of
+    <chunksize> rows at a time so that the formatting buffer stays bounded.
+
+    Parameters
+    ----------
+    f : file object
+        opened text file.
+    table : astropy Table
+        table to write.
+    columns : list of str, optional
+        columns to write, in this order. The default is all columns.
+    chunksize : int, optional
+        number of rows formatted at once. The default is 100_000.
+    lineterminator : str, optional
+        end of line characters. The default is "\n".
+    """
+    for start in range(0, len(table), chunksize):
+        block = table[start : start + chunksize]
+        if columns is not None:
+            block = block[columns]
+        block = block.to_pandas()
+        block.to_csv(f, header=False, index=False, lineterminator=lineterminator)
+
+
+def read_fofct_csv(file, column_names, chunksize=1_000_000):
+    """
+    Reads the body of a FOF-CT file in chunks of <chunksize> rows, with explicit
+    dtypes for the core columns. Chromosome names are kept as a categorical.
+
+    Chunks are split into columns as they are parsed and each column is
+    concatenated on its own, so that only one column is duplicated at a time
+    instead of the whole table.
+
+    Parameters
+    ----------
+    file : str
+        FOF-CT file (.4dn or .csv).
+    column_names : list of str
+        column names, as read from the ``##columns`` header line.
+    chunksize : int, optional
+        number of rows parsed at once. The default is 1_000_000.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    dtypes = {col: dtype for col, dtype in FOFCT_DTYPES.items() if col in column_names}
+    pieces = {col: [] for col in column_names}
+    reader = pd.read_csv(
+        file,
+        comment="#",
+        header=None,
+        names=column_names,
+        dtype=dtypes,
+        chunksize=chunksize,
+    )
+    with reader:
+        for chunk in reader:
+            for col in column_names:
+                pieces[col].append(chunk[col])
+            del chunk
+    if not pieces[column_names[0]]:
+        return pd.DataFrame({col: pd.Series(dtype=object) for col in column_names})
+
+    data = {}
+    for col in column_names:
+        col_pieces = pieces.pop(col)
+        if col == "Chrom":
+            # categories of each chunk differ, merges them in sorted order
+            data[col] = pd.Series(
+                pd.api.types.union_categoricals(col_pieces, sort_categories=True)
+            )
+        else:
+            data[col] = pd.concat(col_pieces, ignore_index=True)
+        del col_pieces
+    return pd.DataFrame(data, copy=False)
+
+
+def factorize_genomic_coordinates(data):
+    """
+    Factorizes the (Chrom, Chrom_Start, Chrom_End) triplets of a FOF-CT table.
+
+    Returns
+    -------
+    codes : numpy.ndarray
+        index of the triplet of each row in <unique_coordinates>.
+    unique_coordinates : pandas.DataFrame
+        sorted unique (Chrom, Chrom_Start, Chrom_End) triplets.
+    """
+    grouped = data.groupby(GENOMIC_COORDINATES, sort=True, observed=True)
+    codes = grouped.ngroup().to_numpy()
+    unique_coordinates = grouped.size().reset_index()[GENOMIC_COORDINATES]
+    return codes, unique_coordinates
+
+
+def dictionary_encode(values):
+    """
+    Encodes values as integer codes into a sorted dictionary of unique values.
+
+    Returns
+    -------
+    codes : numpy array
+        int32 (int64 for more than 2**31 - 1 values) codes, with
+        ``dictionary[codes]`` equal to <values>.
+    dictionary : numpy array
+        sorted unique values.
+    """
+    dictionary, codes = np.unique(np.asarray(values), return_inverse=True)
+    dtype = np.int32 if len(dictionary) <= np.iinfo(np.int32).max else np.int64
+    return codes.ravel().astype(dtype), dictionary
+
+
+def encode_labels(labels, separator=LABEL_SEPARATOR):
+    """
+    Encodes separated multi-labels as bitsets, with one bit per distinct label.
+
+    Parameters
+    ----------
+    labels : array of str
+        label string of each spot, e.g. 'label_1,nucleus'.
+    separator : str, optional
+        separator of the labels of a spot. The default is ','.
+
+    Returns
+    -------
+    bits : numpy array
+        uint64 bitset of each spot.
+    dictionary : list of str
+        label of each bit, in order of first appearance.
+    strings : dict
+        bitset to original string, to restore labels exactly on decoding.
+
+    Raises
+    ------
+    ValueError
+        if there are more than MAX_LABELS distinct labels.
+    """
+    unique_labels, first, inverse = np.unique(
+        np.asarray(labels).astype(str), return_index=True, return_inverse=True
+    )
+    dictionary, strings = [], {}
+    unique_bits = np.zeros(len(unique_labels), dtype=np.uint64)
+    for idx in np.argsort(first):
+        bits = 0
+        for label in unique_labels[idx].split(separator):
+            if not label:
+                continue
+            if label not in dictionary:
+                dictionary.append(label)
+            bits |= 1 << dictionary.index(label)
+        if len(dictionary) > MAX_LABELS:
+            raise ValueError(f"more than {MAX_LABELS} distinct labels")
+        unique_bits[idx] = bits
+        strings.setdefault(bits, str(unique_labels[idx]))
+    return unique_bits[inverse.ravel()], dictionary, strings
+
+
+def decode_labels(bits, dictionary, strings=None, separator=LABEL_SEPARATOR):
+    """
+    Decodes label bitsets (see encode_labels) into separated label strings.
+    Bitsets found in <strings> get their original string, others list their
+    labels in dictionary order.
+    """
+    strings = strings or {}
+    unique_bits, inverse = np.unique(np.asarray(bits), return_inverse=True)
+    decoded = [
+        strings.get(
+            int(value),
+            separator.join(
+                label for bit, label in enumerate(dictionary) if int(value) >> bit & 1
+            ),
+        )
+        for value in unique_bits
+    ]
+    return np.array(decoded, dtype=str)[inverse.ravel()]
+
+
 def decode_rois(data):
     data_indexed = data.group_by("ROI #")
     number_rois = len(data_indexed.groups.keys)
@@ -52,6 +320,146 @@ def build_color_dict(data, key="Barcode #"):
     }
 
 
+class TraceIndex:
+    """
+    CSR-style index of the rows of a trace table grouped by trace.
+
+    Rows of trace i are ``order[offsets[i]:offsets[i + 1]]``, in their original
+    order. Traces are sorted by ID, as with ``group_by("Trace_ID")``.
+
+    Attributes
+    ----------
+    keys : numpy array
+        sorted unique trace IDs.
+    codes : numpy array
+        trace number of each row, indexing <keys>.
+    order : numpy array
+        row permutation grouping the rows by trace.
+    offsets : numpy array
+        start of each trace in <order>, followed by the number of rows.
+    """
+
+    def __init__(self, trace_ids):
+        self.keys, self.codes = np.unique(np.asarray(trace_ids), return_inverse=True)
+        self.codes = self.codes.ravel()
+        self.order = np.argsort(self.codes, kind="stable")
+        self.offsets = np.zeros(len(self.keys) + 1, dtype=np.intp)
+        np.cumsum(self.count(), out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def count(self):
+        """Number of rows of each trace."""
+        return np.bincount(self.codes, minlength=len(self.keys))
+
+    def sum(self, values):
+        return np.bincount(
+            self.codes, weights=np.asarray(values, dtype=float), minlength=len(self)
+        )
+
+    def mean(self, values):
+        return self.sum(values) / np.maximum(self.count(), 1)
+
+    def _reduce(self, ufunc, values):
+        if len(self) == 0:
+            return np.asarray(values)[:0]
+        return ufunc.reduceat(np.asarray(values)[self.order], self.offsets[:-1])
+
+    def min(self, values):
+        return self._reduce(np.minimum, values)
+
+    def max(self, values):
+        return self._reduce(np.maximum, values)
+
+    def any(self, mask):
+        """True for the traces with at least one row in <mask>."""
+        return (
+            np.bincount(self.codes[np.asarray(mask, dtype=bool)], minlength=len(self))
+            > 0
+        )
+
+    def value_counts(self, values, where=None):
+        """
+        Counts the rows of each (trace, value) pair, on a combined integer key.
+
+        Parameters
+        ----------
+        values : array-like
+            value of each row (e.g. barcode or mask label).
+        where : numpy array, optional
+            boolean mask of the rows to count. The default is None (all rows).
+
+        Returns
+        -------
+        traces : numpy array
+            trace number of each pair, in increasing order.
+        pair_values : numpy array
+            value of each pair, in increasing order within a trace.
+        counts : numpy array
+            number of rows of each pair.
+        inverse : numpy array
+            pair of each (selected) row.
+        """
+        values, codes = np.asarray(values), self.codes
+        if where is not None:
+            values, codes = values[where], codes[where]
+        unique_values, value_codes = np.unique(values, return_inverse=True)
+        n_values = max(len(unique_values), 1)
+        keys, inverse, counts = np.unique(
+            codes.astype(np.int64) * n_values + value_codes.ravel(),
+            return_inverse=True,
+            return_counts=True,
+        )
+        traces, pair_values = np.divmod(keys, n_values)
+        return traces, unique_values[pair_values], counts, inverse.ravel()
+
+    def n_unique(self, values):
+        """Number of distinct values (e.g. barcodes) in each trace."""
+        traces = self.value_counts(values)[0]
+        return np.bincount(traces, minlength=len(self))
+
+    def n_repeated(self, values):
+        """Number of distinct values present more than once in each trace."""
+        traces, _, counts, _ = self.value_counts(values)
+        return np.bincount(traces[counts > 1], minlength=len(self))
+
+    def repeats(self, values):
+        """Number of rows of the same trace sharing the value of each row."""
+        _, _, counts, inverse = self.value_counts(values)
+        return counts[inverse]
+
+    def radius_of_gyration(self, x, y, z):
+        """Radius of gyration of each trace."""
+        squared_deviations = 0.0
+        for coordinate in (x, y, z):
+            coordinate = np.asarray(coordinate, dtype=float)
+            center_of_mass = self.mean(coordinate)
+            squared_deviations = (
+                squared_deviations + (coordinate - center_of_mass[self.codes]) ** 2
+            )
+        return np.sqrt(self.mean(squared_deviations))
+
+    def broadcast(self, values):
+        """Expands one value per trace to one value per row."""
+        return np.asarray(values)[self.codes]
+
+    def rows(self, idx):
+        """Row indices of trace number <idx>."""
+        return self.order[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def iterate(self, *columns):
+        """
+        Yields (trace ID, column arrays of the trace) for each trace.
+
+        Columns are permuted once, so the arrays yielded are views.
+        """
+        sorted_columns = [np.asarray(column)[self.order] for column in columns]
+        for idx, key in enumerate(self.keys):
+            start, end = self.offsets[idx], self.offsets[idx + 1]
+            yield key, [column[start:end] for column in sorted_columns]
+
+
 class ChromatinTraceTable:
 
     def __init__(self, xyz_unit="micron", genome_assembly="mm10"):
@@ -70,9 +478,159 @@ class ChromatinTraceTable:
         self.software_repository = ""
         self.software_citation = ""
         self.columns = []
+        self._trace_index = None
+        self._trace_index_column = None
         self.data = None
         self.original_format = "ecsv"  # Default format
         self.number_traces = 0
+        self.id_dictionaries = {}
+        self.label_dictionary = None
+        self._label_strings = {}
+
+    @property
+    def data(self):
+        """Astropy table of spots. Assigning a new table resets the trace index."""
+        return self._data
+
+    @data.setter
+    def data(self, table):
+        self._data = table
+        self.invalidate_trace_index()
+
+    @property
+    def trace_index(self):
+        """
+        TraceIndex of self.data, cached for the current Trace_ID column object.
+
+        Replacing self.data or its Trace_ID column, or adding or removing rows,
+        rebuilds it. Sorting self.data or editing Trace_ID values in place keeps
+        the same column object and must be followed by invalidate_trace_index().
+        """
+        column = self.data["Trace_ID"]
+        if (
+            self._trace_index is None
+            or column is not self._trace_index_column
+            or len(column) != len(self._trace_index.codes)
+        ):
+            self._trace_index = TraceIndex(column)
+            self._trace_index_column = column
+        return self._trace_index
+
+    def invalidate_trace_index(self):
+        """Discards the cached trace index, rebuilt on next access."""
+        self._trace_index = None
+        self._trace_index_column = None
+
+    def encode_ids(self):
+        """
+        Replaces the Trace_ID, Spot_ID and Chrom string columns of self.data by
+        integer codes. The strings are kept in self.id_dictionaries and restored
+        on save. Codes follow the sorting of the strings, so grouping order is
+        unchanged.
+        """
+        for name in CATEGORICAL_COLUMNS:
+            if name in self.data.colnames and name not in self.id_dictionaries:
+                codes, dictionary = dictionary_encode(self.data[name])
+                self.data.replace_column(name, codes)
+                self.id_dictionaries[name] = dictionary
+
+    def decode_ids(self):
+        """Restores the string Trace_ID, Spot_ID and Chrom columns of self.data."""
+        for name, dictionary in self.id_dictionaries.items():
+            self.data.replace_column(name, dictionary[self.data[name]])
+        self.id_dictionaries = {}
+
+    def id_strings(self, name):
+        """Returns the <name> column of self.data as strings, decoded if needed."""
+        if name in self.id_dictionaries:
+            return self.id_dictionaries[name][self.data[name]]
+        return np.asarray(self.data[name])
+
+    def encode_labels(self):
+        """
+        Replaces the label column of self.data by bitsets, one bit per label of
+        self.label_dictionary (see encode_labels). Labels are kept as strings
+        if there are too many distinct labels.
+        """
+        if self.label_dictionary is not None or "label" not in self.data.colnames:
+            return
+        try:
+            bits, dictionary, strings = encode_labels(self.data["label"])
+        except ValueError as error:
+            print(f"! Labels kept as strings: {error}")
+            return
+        self.data.replace_column("label", bits)
+        self.label_dictionary, self._label_strings = dictionary, strings
+
+    def decode_labels(self):
+        """Restores the label strings of self.data."""
+        if self.label_dictionary is not None:
+            self.data.replace_column("label", self.label_strings())
+        self.label_dictionary, self._label_strings = None, {}
+
+    def label_strings(self):
+        """Returns the label column of self.data as strings, decoded if needed."""
+        if self.label_dictionary is None:
+            return np.asarray(self.data["label"]).astype(str)
+        return decode_labels(
+            self.data["label"], self.label_dictionary, self._label_strings
+        )
+
+    def has_label(self, label):
+        """
+        True for the spots with a label containing <label>, as a substring of
+        any of their labels.
+        """
+        if not label:
+            return np.ones(len(self.data), dtype=bool)
+        if self.label_dictionary is None:
+            return np.char.find(self.label_strings(), label) >= 0
+        mask = sum(
+            1 << bit for bit, name in enumerate(self.label_dictionary) if label in name
+        )
+        return (np.asarray(self.data["label"]) & np.uint64(mask)) != 0
+
+    def add_label(self, label, selected):
+        """
+        Adds <label> to the labels of the <selected> spots that do not have it yet.
+        With bitsets, new combinations of labels are decoded in the order of
+        self.label_dictionary.
+        """
+        if self.label_dictionary is not None and (
+            label in self.label_dictionary or len(self.label_dictionary) < MAX_LABELS
+        ):
+            if label not in self.label_dictionary:
+                self.label_dictionary.append(label)
+            bit = np.uint64(1 << self.label_dictionary.index(label))
+            bits = np.asarray(self.data["label"]).copy()
+            bits[np.asarray(selected, dtype=bool)] |= bit
+            self.data.replace_column("label", bits)
+            return
+        self.decode_labels()
+        labels = self.label_strings()
+        separated = np.char.add(np.char.add(LABEL_SEPARATOR, labels), LABEL_SEPARATOR)
+        missing = np.char.find(separated, LABEL_SEPARATOR + label + LABEL_SEPARATOR) < 0
+        self.data.replace_column(
+            "label",
+            np.where(
+                np.asarray(selected, dtype=bool) & missing,
+                np.where(
+                    labels == "", label, np.char.add(labels, LABEL_SEPARATOR + label)
+                ),
+                labels,
+            ),
+        )
+
+    def decoded_data(self):
+        """Returns self.data with string IDs and labels, sharing the other columns."""
+        if not self.id_dictionaries and self.label_dictionary is None:
+            return self.data
+        table = self.data.copy(copy_data=False)
+        for name in self.id_dictionaries:
+            table.replace_column(name, self.id_strings(name))
+        if self.label_dictionary is not None:
+            table.replace_column("label", self.label_strings())
+        return table
 
     def initialize(self):
         self.data = Table(
@@ -110,16 +668,20 @@ class ChromatinTraceTable:
             f"xyz_unit={self.xyz_unit}",
             f"genome_assembly={self.genome_assembly}",
         ]
+        self.id_dictionaries = {}
+        self.label_dictionary, self._label_strings = None, {}
 
-    def load(self, file):
+    def load(self, file, encode_ids=False):
         """
-        Loads a trace table from a .ecsv or .4dn file.
+        Loads a trace table from a .ecsv or .4dn (optionally gzipped) file.
+        With <encode_ids>, Trace_ID, Spot_ID and Chrom are held as integer codes
+        and labels as bitsets (see encode_ids and encode_labels).
         """
         if not os.path.exists(file):
             print(f"# ERROR: could not find file: {file}")
             sys.exit()
 
-        file_ext = os.path.splitext(file)[1].lower()
+        file_ext = os.path.splitext(strip_gz(file.lower()))[1]
         if file_ext == ".ecsv":
             print("$ Importing table from pyHiM format")
             self.data = read_table_from_ecsv(file)
@@ -130,7 +692,13 @@ class ChromatinTraceTable:
             self.data = self._convert_4dn_to_astropy(file)
             self.original_format = "4dn"
         else:
-            raise ValueError("Unsupported file format. Use .ecsv or .4dn")
+            raise ValueError("Unsupported file format. Use .ecsv, .4dn or .4dn.gz")
+
+        self.id_dictionaries = {}
+        self.label_dictionary, self._label_strings = None, {}
+        if encode_ids:
+            self.encode_ids()
+            self.encode_labels()
 
         print(f"Successfully loaded trace table: {file}")
         return self.data
@@ -148,9 +716,10 @@ class ChromatinTraceTable:
     def save(self, file_name, comments=""):
         """
         Saves the trace table in the appropriate format (.ecsv or .4dn).
+        4dn tables are gzip-compressed if <file_name> ends with .gz
         """
         if self.original_format == "4dn":
-            self._convert_astropy_to_4dn(self.data, file_name)
+            self._convert_astropy_to_4dn(self.decoded_data(), file_name)
         else:
             print(f"$ Saving output table as {file_name} ...")
             self.remove_empty_comments()
@@ -160,14 +729,16 @@ class ChromatinTraceTable:
             except KeyError:
                 self.data.meta["comments"] = [comments]
 
-            save_table_to_ecsv(self.data, file_name)
+            save_table_to_ecsv(self.decoded_data(), file_name)
 
     def _read_metadata_from_4dn(self, file):
         """
         Reads metadata fields from a .4dn file and stores them as class attributes.
         """
-        with open(file, "r") as f:
+        with open_text(file) as f:
             for line in f:
+                if not line.startswith("#"):
+                    break
                 if line.startswith("#experimenter_name:"):
                     self.experimenter_name = line.split(": ")[1].strip()
                 elif line.startswith("#experimenter_contact:"):
@@ -198,7 +769,7 @@ class ChromatinTraceTable:
         Also saves a BED file mapping genomic coordinates to barcode numbers.
         """
         column_names = self.columns  # self._read_column_names_from_4dn(fofct_file)
-        csv_data = pd.read_csv(fofct_file, comment="#", header=None, names=column_names)
+        csv_data = read_fofct_csv(fofct_file, column_names)
 
         # Rename XYZ columns for Astropy compatibility
         csv_data.rename(columns={"X": "x", "Y": "y", "Z": "z"}, inplace=True)
@@ -218,55 +789,34 @@ class ChromatinTraceTable:
             csv_data["ROI #"] = 0  # Default value if missing
 
         # Assign Barcode # by ordering and mapping unique genomic positions
-        unique_barcodes = (
-            csv_data[["Chrom", "Chrom_Start", "Chrom_End"]]
-            .drop_duplicates()
-            .sort_values(by=["Chrom", "Chrom_Start", "Chrom_End"])
-            .reset_index(drop=True)
-        )
+        codes, unique_barcodes = factorize_genomic_coordinates(csv_data)
         unique_barcodes["Barcode #"] = range(1, len(unique_barcodes) + 1)
-        barcode_mapping = {
-            tuple(row[:3]): row[3]
-            for row in unique_barcodes.itertuples(index=False, name=None)
-        }
-
-        csv_data["Barcode #"] = csv_data.apply(
-            lambda row: barcode_mapping[
-                (row["Chrom"], row["Chrom_Start"], row["Chrom_End"])
-            ],
-            axis=1,
-        )
+        csv_data["Barcode #"] = codes + 1
         csv_data["label"] = "None"  # Placeholder for label
 
         # Save BED file with Barcode # mapping
-        bed_file = fofct_file.replace(".4dn", ".bed")
+        bed_file = strip_gz(fofct_file).replace(".4dn", ".bed")
         unique_barcodes.to_csv(bed_file, sep="\t", header=False, index=False)
         print(f"Saved BED file: {bed_file}")
 
         return Table.from_pandas(csv_data)
 
-    def _convert_astropy_to_4dn(self, table, output_file):
+    def _convert_astropy_to_4dn(self, table, output_file, chunksize=100_000):
         """
         Converts an Astropy table back to .4dn format with appropriate headers.
+        Rows are formatted by blocks of <chunksize> rows.
         """
-        output_file = output_file.strip(".ecsv") + ".4dn"
-
-        csv_data = table.to_pandas()
-        csv_data.rename(columns={"x": "X", "y": "Y", "z": "Z"}, inplace=True)
+        compress = output_file.endswith(".gz")
+        output_file = os.path.splitext(strip_gz(output_file))[0] + ".4dn"
+        if compress:
+            output_file += ".gz"
 
         # Remove extra columns
-        csv_data = csv_data.drop(columns=["Barcode #", "label"], errors="ignore")
-
-        # Rename columns
-        if "Extra_Cell_ROI_ID" in self.columns:
-            csv_data.rename(columns={"ROI #": "Extra_Cell_ROI_ID"}, inplace=True)
-        else:
-            csv_data = csv_data.drop(columns=["ROI #"], errors="ignore")
-
-        if "Cell_ID" in self.columns:
-            csv_data.rename(columns={"Mask_id": "Cell_ID"}, inplace=True)
-        else:
-            csv_data = csv_data.drop(columns=["Mask_id"], errors="ignore")
+        columns = [col for col in table.colnames if col not in ("Barcode #", "label")]
+        if "Extra_Cell_ROI_ID" not in self.columns and "ROI #" in columns:
+            columns.remove("ROI #")
+        if "Cell_ID" not in self.columns and "Mask_id" in columns:
+            columns.remove("Mask_id")
 
         # parses column list for header
         column_list = ", ".join(self.columns)
@@ -287,24 +837,15 @@ class ChromatinTraceTable:
 #additional_tables:
 ##columns=({column_list})
 """
-        # print(f"> Columnds to export to 4dn table: {csv_data.columns}")
-        with open(output_file, "w") as f:
+        # print(f"> Columnds to export to 4dn table: {columns}")
+        with open_text(output_file, "w") as f:
             f.write(header)
-            csv_data.to_csv(f, index=False, header=False)
+            write_csv_blocks(f, table, columns=columns, chunksize=chunksize)
         print(f"Saved 4dn trace table with headers: {output_file}")
 
     def prevent_roi_conflict(self, table):
-        existing_roi = set(self.data["ROI #"])
-        conflicting_rois = set(table["ROI #"]) & existing_roi
-        roi_mapping = {}
-        current_max = max(existing_roi) + 1 if existing_roi else 1
-        for roi in conflicting_rois:
-            while current_max in existing_roi:
-                current_max += 1
-            roi_mapping[roi] = current_max
-            existing_roi.add(current_max)
-        new_roi_numbers = [roi_mapping.get(roi, roi) for roi in table["ROI #"]]
-        table["ROI #"] = new_roi_numbers
+        existing_roi = set(np.unique(self.data["ROI #"]).tolist())
+        table["ROI #"] = remap_rois(table["ROI #"], existing_roi)
         return table
 
     def load_bed_file(self, bed_file):
@@ -408,16 +949,28 @@ class ChromatinTraceTable:
 
         Parameters
         ----------
-        table : astropy table
-            table to append to existing self.data table.
+        table : astropy table or ChromatinTraceTable
+            table to append to existing self.data table. IDs and labels of a
+            ChromatinTraceTable are decoded first, so encoded tables can be
+            appended to each other.
 
         Returns
         -------
         None.
 
         """
+        if isinstance(table, ChromatinTraceTable):
+            table = table.decoded_data().copy()
         table = self.prevent_roi_conflict(table)
+        ids_encoded = bool(self.id_dictionaries)
+        labels_encoded = self.label_dictionary is not None
+        self.decode_ids()
+        self.decode_labels()
         self.data = vstack([self.data, table])
+        if ids_encoded:
+            self.encode_ids()
+        if labels_encoded:
+            self.encode_labels()
 
     def filter_traces_by_coordinate(self, coor="z", coor_min=0.0, coor_max=np.inf):
         """
@@ -440,34 +993,22 @@ class ChromatinTraceTable:
         trace_table = self.data
 
         if len(trace_table) > 0:
-            # indexes trace file
-            trace_table_indexed = trace_table.group_by("Trace_ID")
-
-            # iterates over traces
             print(f"\n$ Will keep localizations with {coor_min} < {coor} < {coor_max}.")
             print(
-                f"$ Number of original spots / traces: {len(trace_table)} / {len(trace_table_indexed.groups)}"
+                f"$ Number of original spots / traces: {len(trace_table)} / {len(self.trace_index)}"
+            )
+            coordinates = np.asarray(trace_table[coor], dtype=float)
+            rows_to_remove = np.flatnonzero(
+                (coordinates < coor_min) | (coordinates > coor_max)
             )
-            rows_to_remove = []
-            for idx, row in enumerate(trace_table):
-                coordinate = float(row[coor])
-
-                if coordinate < coor_min or coordinate > coor_max:
-                    rows_to_remove.append(idx)
-                    # coordinates.append(coordinate)
 
             print(f"$ Number of spots to remove: {len(rows_to_remove)}")
 
             trace_table.remove_rows(rows_to_remove)
-
-            if len(trace_table) > 0:
-                trace_table_indexed = trace_table.group_by("Trace_ID")
-                number_traces_left = len(trace_table_indexed.groups)
-            else:
-                number_traces_left = 0
+            self.invalidate_trace_index()
 
             print(
-                f"$ Number of spots / traces left: {len(trace_table)} / {number_traces_left}"
+                f"$ Number of spots / traces left: {len(trace_table)} / {len(self.trace_index)}"
             )
 
         else:
@@ -483,8 +1024,7 @@ class ChromatinTraceTable:
         rows_to_remove = []
         number_spots = len(trace.data)
         intensities_kept = list()
-        for idx, row in enumerate(trace.data):
-            spot_id = row["Spot_ID"]
+        for idx, spot_id in enumerate(trace.id_strings("Spot_ID")):
             try:
                 intensity = localizations.loc[spot_id]["peak"]
                 if intensity < intensity_min:
@@ -495,6 +1035,7 @@ class ChromatinTraceTable:
                 continue  # If Spot_ID is not found, keep the entry
 
         trace.data.remove_rows(rows_to_remove)
+        trace.invalidate_trace_index()
         print(
             f"> Removed {len(rows_to_remove)}/{number_spots} localizations below intensity threshold ({intensity_min})."
         )
@@ -502,14 +1043,9 @@ class ChromatinTraceTable:
 
         return intensities_kept
 
-    def barcode_statistics(self, trace_table):
+    def barcode_statistics(self):
         """
-        calculates the number of times a barcode is repeated in a trace for all traces in a trace table
-
-        Parameters
-        ----------
-        trace_table : ASTROPY table
-            trace table.
+        calculates the number of times a barcode is repeated in a trace for all traces in self.data
 
         Returns
         -------
@@ -517,29 +1053,21 @@ class ChromatinTraceTable:
             dict with barcode identities as keys and a list of the number of times it was present in each trace treated.
 
         """
-        collective_barcode_stats = {}
-
-        trace_table_indexed = trace_table.group_by("Trace_ID")
-
-        # iterates over traces
         print("$ Calculating barcode stats...")
 
-        for trace in tqdm(trace_table_indexed.groups):
-            unique_barcodes = list(set(trace["Barcode #"].data))
-            barcodes = list(trace["Barcode #"].data)
-
-            # if number_unique_barcodes < number_barcodes:
-            barcode_stats = {}
-            for barcode in unique_barcodes:
-                barcode_rep = barcodes.count(barcode)
-                barcode_stats[str(barcode)] = barcode_rep
-
-                if str(barcode) in collective_barcode_stats:
-                    collective_barcode_stats[str(barcode)].append(barcode_rep)
-                else:
-                    collective_barcode_stats[str(barcode)] = [barcode_rep]
+        traces, barcodes, counts, _ = self.trace_index.value_counts(
+            self.data["Barcode #"]
+        )
 
-        return collective_barcode_stats
+        # groups the counts by barcode, keeping the trace order
+        order = np.argsort(barcodes, kind="stable")
+        unique_barcodes, starts = np.unique(barcodes[order], return_index=True)
+        return {
+            str(barcode): barcode_counts.tolist()
+            for barcode, barcode_counts in zip(
+                unique_barcodes, np.split(counts[order], starts[1:])
+            )
+        }
 
     def plots_barcode_statistics(
         self,
@@ -609,12 +1137,12 @@ class ChromatinTraceTable:
 
     def trace_remove_label(self, label=""):
         """
-        This function will remove traces that do not contain the word 'label' in the 'label' column
+        This function will remove the spots that contain the word 'label' in the 'label' column
 
         Parameters
         ----------
         label : TYPE, string
-            the labe to keep. The default is "".
+            the label to remove. The default is "".
 
         Returns
         -------
@@ -623,15 +1151,7 @@ class ChromatinTraceTable:
         """
         trace_table = self.data
 
-        trace_table_new = trace_table.copy()
-
-        rows_to_remove = []
-
-        for idx, row in enumerate(trace_table_new):
-            if label in row["label"]:
-                rows_to_remove.append(idx)
-
-        trace_table_new.remove_rows(rows_to_remove)
+        trace_table_new = trace_table[~self.has_label(label)]
 
         removed = len(trace_table) - len(trace_table_new)
         print(f"$ Removed {removed} spots that contained the label: {label}")
@@ -640,12 +1160,12 @@ class ChromatinTraceTable:
 
     def trace_keep_label(self, label=""):
         """
-        This function will remove traces that do not contain the word 'label' in the 'label' column
+        This function will remove the spots that do not contain the word 'label' in the 'label' column
 
         Parameters
         ----------
         label : TYPE, string
-            the labe to keep. The default is "".
+            the label to keep. The default is "".
 
         Returns
         -------
@@ -654,15 +1174,7 @@ class ChromatinTraceTable:
         """
         trace_table = self.data
 
-        trace_table_new = trace_table.copy()
-
-        rows_to_remove = []
-
-        for idx, row in enumerate(trace_table_new):
-            if label not in row["label"]:
-                rows_to_remove.append(idx)
-
-        trace_table_new.remove_rows(rows_to_remove)
+        trace_table_new = trace_table[self.has_label(label)]
 
         removed = len(trace_table) - len(trace_table_new)
         print(f"$ Removed {removed} spots that did not contain the label: {label}")
@@ -687,16 +1199,13 @@ class ChromatinTraceTable:
         trace_table_new = trace_table.copy()
         print("\n$ Removing spots with repeated barcodes...")
         if len(trace_table) > 0:
-            # indexes trace file
-            trace_table_indexed = trace_table.group_by("Trace_ID")
-
-            # iterates over traces
+            trace_index = self.trace_index
             print(
-                f"\n$ Number of original \n spots: {len(trace_table)} \n traces: {len(trace_table_indexed.groups)}"
+                f"\n$ Number of original \n spots: {len(trace_table)} \n traces: {len(trace_index)}"
             )
 
             # calculates the statistics for the table before processing
-            collective_barcode_stats = self.barcode_statistics(trace_table)
+            collective_barcode_stats = self.barcode_statistics()
 
             # plots statistics of barcodes and saves in file
             self.plots_barcode_statistics(
@@ -706,48 +1215,26 @@ class ChromatinTraceTable:
                 norm=True,
             )
 
-            # iterates over traces
-            spots_to_remove = []
-            for trace in tqdm(trace_table_indexed.groups):
-                unique_barcodes = list(set(trace["Barcode #"].data))
-                number_unique_barcodes = len(unique_barcodes)
-                barcodes = list(trace["Barcode #"].data)
-                number_barcodes = len(barcodes)
-
-                if number_unique_barcodes < number_barcodes:
-                    trace_indexed_by_barcode = trace.group_by("Barcode #")
-
-                    for row in trace_indexed_by_barcode:
-                        barcode = row["Barcode #"].data
-                        barcode_rep = barcodes.count(barcode)
-
-                        # if a barcode is more than once I will remove both instances
-                        if barcode_rep > 1:
-                            spots_to_remove.append(row["Spot_ID"])
-
+            # if a barcode is more than once in a trace I will remove all instances
+            repeated = trace_index.repeats(trace_table["Barcode #"]) > 1
+            spots_to_remove = np.asarray(trace_table["Spot_ID"])[repeated]
             print(f"$ Number of spots to remove: {len(spots_to_remove)}")
             print("$ Removing repeated spots...")
 
-            rows_to_remove = []
-            for idx, row in enumerate(trace_table):
-                spot_id = row["Spot_ID"]
-
-                if spot_id in spots_to_remove:
-                    rows_to_remove.append(idx)
-
+            rows_to_remove = np.flatnonzero(
+                np.isin(np.asarray(trace_table["Spot_ID"]), spots_to_remove)
+            )
             trace_table_new.remove_rows(rows_to_remove)
+            self.data = trace_table_new
 
             print(f"$ Number of rows to remove: {len(rows_to_remove)}")
 
-            if len(trace_table_new) > 0:
-                trace_table_indexed = trace_table_new.group_by("Trace_ID")
-
             print(
-                f"$ After filtering, I see \n spots: {len(trace_table_new)} \n traces: {len(trace_table_indexed.groups)}"
+                f"$ After filtering, I see \n spots: {len(trace_table_new)} \n traces: {len(self.trace_index)}"
             )
 
-            # calculates the statistics for the table before processing
-            collective_barcode_stats_new = self.barcode_statistics(trace_table_new)
+            # calculates the statistics for the table after processing
+            collective_barcode_stats_new = self.barcode_statistics()
 
             # plots statistics of barcodes and saves in file
             self.plots_barcode_statistics(
@@ -784,64 +1271,57 @@ class ChromatinTraceTable:
             print("! Error: you are trying to filter an empty trace table!")
             return
 
-        trace_table_indexed = trace_table.group_by("Trace_ID")
+        trace_index = self.trace_index
         trace_table.add_index("Spot_ID")  # Add index for faster lookup
         rows_to_remove = []
 
-        if localization_table is not None:
+        # rows of barcodes repeated in their trace, sorted by trace and barcode
+        barcodes = np.asarray(trace_table["Barcode #"])
+        repeated = np.flatnonzero(trace_index.repeats(barcodes) > 1)
+        repeated = repeated[
+            np.lexsort((barcodes[repeated], trace_index.codes[repeated]))
+        ]
+
+        if localization_table is not None and len(repeated) > 0:
             print("$ Using intensity to resolve duplicates...")
             localization_table.add_index("Buid")
 
-            for trace in tqdm(trace_table_indexed.groups):
-                barcode_groups = trace.group_by("Barcode #").groups
-                for group in barcode_groups:
-                    if len(group) == 1:
-                        continue  # no duplicates
-
-                    peaks = []
-                    for row in group:
-                        spot_id = row["Spot_ID"]
-                        try:
-                            peak = localization_table.loc[spot_id]["peak"]
-                        except KeyError:
-                            peak = -1
-                        peaks.append(peak)
-
-                    max_idx = peaks.index(max(peaks))
-                    for idx, row in enumerate(group):
-                        if idx != max_idx:
-                            global_idx = trace_table.loc_indices[row["Spot_ID"]]
-                            rows_to_remove.append(global_idx)
-
-        else:
+            spot_ids = self.id_strings("Spot_ID")
+            group_keys = np.stack([trace_index.codes[repeated], barcodes[repeated]])
+            group_starts = np.flatnonzero(np.any(np.diff(group_keys, axis=1), axis=0))
+            for group in tqdm(np.split(repeated, group_starts + 1)):
+                peaks = []
+                for spot_id in spot_ids[group]:
+                    try:
+                        peak = localization_table.loc[spot_id]["peak"]
+                    except KeyError:
+                        peak = -1
+                    peaks.append(peak)
+
+                max_idx = peaks.index(max(peaks))
+                for idx, spot_id in enumerate(trace_table["Spot_ID"][group]):
+                    if idx != max_idx:
+                        rows_to_remove.append(trace_table.loc_indices[spot_id])
+
+        elif localization_table is None:
             print(
                 "$ No localization table provided. Removing all instances of duplicated barcodes."
             )
 
-            for trace in trace_table_indexed.groups:
-                barcode_groups = trace.group_by("Barcode #").groups
-                for group in barcode_groups:
-                    if len(group) <= 1:
-                        continue
-                    for row in group:
-                        global_idx = trace_table.loc_indices[row["Spot_ID"]]
-                        rows_to_remove.append(global_idx)
+            rows_to_remove = [
+                trace_table.loc_indices[spot_id]
+                for spot_id in trace_table["Spot_ID"][repeated]
+            ]
 
         trace_table_new.remove_rows(rows_to_remove)
+        self.data = trace_table_new
 
         print(f"$ Number of rows to remove: {len(rows_to_remove)}")
 
-        if len(trace_table_new) > 0:
-            number_traces_left = len(trace_table_new.group_by("Trace_ID").groups)
-        else:
-            number_traces_left = 0
-
         print(
-            f"$ After filtering, I see \n spots: {len(trace_table_new)} \n traces: {number_traces_left}"
+            f"$ After filtering, I see \n spots: {len(trace_table_new)} \n traces: {len(self.trace_index)}"
         )
 
-        self.data = trace_table_new
-
     def remove_duplicates(self):
         """
         removes duplicated (identical) spots
@@ -965,47 +1445,29 @@ class ChromatinTraceTable:
         """
 
         trace_table = self.data
+        trace_index = self.trace_index
 
-        # indexes trace file
-        trace_table_indexed = trace_table.group_by("Trace_ID")
-
-        # iterates over traces
         print(f"\n$ Removing traces with < {minimum_number_barcodes} spots")
         print(
-            f"$ Number of original spots / traces: {len(trace_table)} / {len(trace_table_indexed.groups)}"
+            f"$ Number of original spots / traces: {len(trace_table)} / {len(trace_index)}"
         )
 
-        barcodes_to_remove = []
         print("$ Analyzing traces...")
-
-        for trace in tqdm(trace_table_indexed.groups):
-            number_unique_barcodes = len(list(set(trace["Barcode #"].data)))
-
-            if number_unique_barcodes < minimum_number_barcodes:
-                barcodes_to_remove.append(list(trace["Spot_ID"].data))
-
-        print(f"$ Number of traces to remove: {len(barcodes_to_remove)}")
-
-        list_barcode_to_remove = []
-        for barcodes in tqdm(barcodes_to_remove):
-            list_barcode_to_remove.extend(iter(barcodes))
-        rows_to_remove = []
+        traces_to_remove = (
+            trace_index.n_unique(trace_table["Barcode #"]) < minimum_number_barcodes
+        )
+        print(f"$ Number of traces to remove: {np.sum(traces_to_remove)}")
 
         print("$ Finding which rows to remove...")
-        for idx, row in enumerate(tqdm(trace_table)):
-            spot_id = row["Spot_ID"]
-            if spot_id in list_barcode_to_remove:
-                rows_to_remove.append(idx)
+        spot_ids = np.asarray(trace_table["Spot_ID"])
+        spots_to_remove = spot_ids[trace_index.broadcast(traces_to_remove)]
+        rows_to_remove = np.flatnonzero(np.isin(spot_ids, spots_to_remove))
 
         trace_table.remove_rows(rows_to_remove)
-        if len(trace_table) > 0:
-            trace_table_indexed = trace_table.group_by("Trace_ID")
-            number_traces_left = len(trace_table_indexed.groups)
-        else:
-            number_traces_left = 0
+        self.invalidate_trace_index()
 
         print(
-            f"$ Number of spots / traces left: {len(trace_table)} / {number_traces_left}"
+            f"$ Number of spots / traces left: {len(trace_table)} / {len(self.trace_index)}"
         )
 
         self.data = trace_table
@@ -6,7 +6,6 @@ contains functions and classes needed for the analysis and plotting of HiM matri
 
 
 import csv
-import itertools
 import json
 import os
 
@@ -83,7 +82,8 @@ class AnalysisHiMMatrix:
         else:
             print("No anchors found")
 
-        # loads datasets: numpy matrices
+        # loads datasets: numpy matrices, memory-mapped so that cells are only
+        # read when they are used
         data = {}
         print(f"Loading datasets from: {output_filename}")
         for i_data_file, value in data_files.items():
@@ -91,7 +91,7 @@ class AnalysisHiMMatrix:
                 f"Loaded: {i_data_file}: <{os.path.basename(output_filename + value)}>"
             )
             data[i_data_file] = np.load(
-                output_filename + data_files[i_data_file]
+                output_filename + data_files[i_data_file], mmap_mode="r"
             ).squeeze()
 
         # loads datasets: lists
@@ -102,6 +102,9 @@ class AnalysisHiMMatrix:
         data["uniqueBarcodes"] = load_list(f"{output_filename}_uniqueBarcodes.csv")
         print(f"""Loaded barcodes #: {data["uniqueBarcodes"]}""")
         self.number_barcodes = len(data["uniqueBarcodes"])
+        check_matrix_shape(
+            data["SCmatrixCollated"], data["uniqueBarcodes"], name="SCmatrixCollated"
+        )
 
         print(f"""Total number of cells loaded: {data["SCmatrixCollated"].shape[2]}""")
         print(f"""Number Datasets loaded: {len(data["runName"])}""")
@@ -178,19 +181,23 @@ class AnalysisHiMMatrix:
 
         return pos
 
-    def n_cells_loaded(self):
+    def cells_selected(self):
+        """
+        returns the mask of the cells with the label requested, or None if
+        all cells are used
+        """
         if self.run_parameters["action"] == "labeled":
-            cells_with_label = [
-                idx for idx, x in enumerate(self.data["SClabeledCollated"]) if x > 0
-            ]
-            n_cells = len(cells_with_label)
-        elif self.run_parameters["action"] == "unlabeled":
-            cells_with_label = [
-                idx for idx, x in enumerate(self.data["SClabeledCollated"]) if x == 0
-            ]
-            n_cells = len(cells_with_label)
-        else:
+            return np.asarray(self.data["SClabeledCollated"]) > 0
+        if self.run_parameters["action"] == "unlabeled":
+            return np.asarray(self.data["SClabeledCollated"]) == 0
+        return None
+
+    def n_cells_loaded(self):
+        cells = self.cells_selected()
+        if cells is None:
             n_cells = self.data["SCmatrixCollated"].shape[2]
+        else:
+            n_cells = int(np.count_nonzero(cells))
         print(f"n_cells selected with label: {n_cells}")
         return n_cells
 
@@ -198,38 +205,207 @@ class AnalysisHiMMatrix:
         """
         retrieves single cells that have the label requested
 
+        The selection is a lazy view of the memory-mapped matrix: cells are only
+        read when they are indexed.
+
         Returns
         -------
         self.sc_matrix_selected
 
         """
-        n_cells = self.n_cells_loaded()
-        sc_matrix_selected = np.zeros(
-            (self.number_barcodes, self.number_barcodes, n_cells)
-        )
-
-        if self.run_parameters["action"] == "labeled":
-            cells_with_label = [
-                idx for idx, x in enumerate(self.data["SClabeledCollated"]) if x > 0
-            ]
-            for new_cell, i_cell in enumerate(cells_with_label):
-                sc_matrix_selected[:, :, new_cell] = self.data["SCmatrixCollated"][
-                    :, :, i_cell
-                ]
-        elif self.run_parameters["action"] == "unlabeled":
-            cells_with_label = [
-                idx for idx, x in enumerate(self.data["SClabeledCollated"]) if x == 0
-            ]
-            for new_cell, i_cell in enumerate(cells_with_label):
-                sc_matrix_selected[:, :, new_cell] = self.data["SCmatrixCollated"][
-                    :, :, i_cell
-                ]
-        else:
+        cells = self.cells_selected()
+        if cells is None:
             sc_matrix_selected = self.data["SCmatrixCollated"]
+        else:
+            sc_matrix_selected = MatrixView(self.data["SCmatrixCollated"], cells=cells)
         print(f"n_cells retrieved: {sc_matrix_selected.shape[2]}")
         self.sc_matrix_selected = sc_matrix_selected
 
 
+def _select_positions(positions, index):
+    # positions[index], with boolean masks converted to integer indices
+    index = np.asarray(index)
+    if index.dtype == bool:
+        index = np.flatnonzero(index)
+    return positions[index]
+
+
+def _is_index_array(key):
+    # integer (not boolean) index arrays with at least one dimension
+    if isinstance(key, slice) or key is Ellipsis:
+        return False
+    key = np.asarray(key)
+    return key.ndim > 0 and np.issubdtype(key.dtype, np.integer)
+
+
+def _normalize_index(key, size):
+    # converts an index along one axis into (positions, relative index)
+    if isinstance(key, slice):
+        return np.arange(size)[key], slice(None)
+    key = np.asarray(key)
+    if key.dtype == bool:
+        key = np.flatnonzero(key)
+    if key.ndim == 0:
+        return np.arange(size)[[int(key)]], 0
+    positions, relative = np.unique(np.arange(size)[key], return_inverse=True)
+    return positions, relative.reshape(key.shape)
+
+
+class MatrixView:
+    """
+    Read-only view of a single-cell matrix with a lazy selection of barcodes
+    and cells.
+
+    Nothing is read when the view is created: indexing the view follows NumPy
+    semantics on the selected matrix, and only the elements requested are read
+    from the underlying (usually memory-mapped) array.
+
+    Parameters
+    ----------
+    data : numpy array
+        (n_barcodes, n_barcodes, n_cells) matrix, possibly memory-mapped.
+    barcodes : array-like, optional
+        positions of the barcodes kept, in the order of the view.
+        The default is None (all barcodes).
+    cells : array-like, optional
+        positions or boolean mask of the cells kept. The default is None (all cells).
+    """
+
+    def __init__(self, data, barcodes=None, cells=None):
+        self.data = data
+        self.barcodes = None
+        self.cells = None
+        if barcodes is not None:
+            self.barcodes = _select_positions(np.arange(data.shape[0]), barcodes)
+        if cells is not None:
+            self.cells = _select_positions(np.arange(data.shape[2]), cells)
+
+    @property
+    def shape(self):
+        n_barcodes = self.data.shape[0] if self.barcodes is None else len(self.barcodes)
+        n_cells = self.data.shape[2] if self.cells is None else len(self.cells)
+        return (n_barcodes, n_barcodes, n_cells)
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def select(self, barcodes=None, cells=None):
+        """
+        Returns a new view restricted to barcodes and cells of this view.
+        """
+        view = MatrixView(self.data)
+        view.barcodes, view.cells = self.barcodes, self.cells
+        if barcodes is not None:
+            view.barcodes = _select_positions(self._positions(0), barcodes)
+        if cells is not None:
+            view.cells = _select_positions(self._positions(2), cells)
+        return view
+
+    def _positions(self, axis):
+        index = self.cells if axis == 2 else self.barcodes
+        return np.arange(self.data.shape[axis]) if index is None else index
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (4 - len(key)) + key[i + 1 :]
+        key = key + (slice(None),) * (3 - len(key))
+
+        # pairs of barcodes (e.g. an upper triangle) are gathered directly
+        if _is_index_array(key[0]) and _is_index_array(key[1]):
+            if isinstance(key[2], slice):
+                rows = self._positions(0)[np.asarray(key[0])]
+                cols = self._positions(1)[np.asarray(key[1])]
+                cells = slice(None) if self.cells is None else self.cells
+                return np.asarray(self.data[rows, cols])[..., cells][..., key[2]]
+
+        # slices of unselected axes are applied first and do not read anything,
+        # then the orthogonal block of elements needed is read and indexed
+        slices, positions, relative = [], [], []
+        for axis, (k, size) in enumerate(zip(key, self.shape)):
+            index = self.cells if axis == 2 else self.barcodes
+            if index is None and isinstance(k, slice):
+                slices.append(k)
+                positions.append(None)
+                relative.append(slice(None))
+            else:
+                local, rel = _normalize_index(k, size)
+                slices.append(slice(None))
+                positions.append(self._positions(axis)[local])
+                relative.append(rel)
+        data = self.data[tuple(slices)]
+        positions = [
+            np.arange(n) if p is None else p for p, n in zip(positions, data.shape)
+        ]
+        block = np.asarray(data[np.ix_(*positions)])
+        return block[tuple(relative)]
+
+    def __array__(self, dtype=None, copy=None):
+        block = self[:, :, :]
+        return block if dtype is None else block.astype(dtype)
+
+
+def load_sc_matrix(
+    file_name, unique_barcodes=None, barcodes=None, cells=None, mmap_mode="r", ndim=3
+):
+    """
+    Loads a matrix from a NPY file without reading it, and validates its shape.
+
+    Parameters
+    ----------
+    file_name : str
+        NPY file.
+    unique_barcodes : list, optional
+        barcodes of the matrix, checked against its first dimensions.
+        The default is None.
+    barcodes : array-like, optional
+        positions of the barcodes to keep, e.g. a shuffle. The default is None.
+    cells : array-like, optional
+        positions or boolean mask of the cells to keep. The default is None.
+    mmap_mode : str, optional
+        memory-map mode of np.load; None reads the whole file. The default is "r".
+    ndim : int, optional
+        expected number of dimensions: 3 for single-cell matrices,
+        2 for ensemble matrices. The default is 3.
+
+    Returns
+    -------
+    numpy memmap or MatrixView
+        the matrix, or a lazy view of it if barcodes or cells are selected.
+    """
+    matrix = np.load(file_name, mmap_mode=mmap_mode)
+    check_matrix_shape(matrix, unique_barcodes, ndim=ndim, name=file_name)
+    if barcodes is None and cells is None:
+        return matrix
+    return MatrixView(matrix, barcodes=barcodes, cells=cells)
+
+
+def check_matrix_shape(matrix, unique_barcodes=None, ndim=3, name="matrix"):
+    """
+    Raises a ValueError if matrix is not a square (barcodes x barcodes [x cells])
+    matrix matching unique_barcodes.
+    """
+    if matrix.ndim != ndim or matrix.shape[0] != matrix.shape[1]:
+        raise ValueError(
+            f"{name} has shape {matrix.shape}, expected a {ndim}D matrix of barcodes x barcodes"
+            + (" x cells" if ndim == 3 else "")
+        )
+    if unique_barcodes is not None and len(unique_barcodes) != matrix.shape[0]:
+        raise ValueError(
+            f"{name} has {matrix.shape[0]} barcodes but {len(unique_barcodes)} unique barcodes were provided"
+        )
+
+
 def load_list(file_name):
     with open(file_name, newline="", encoding="utf-8") as csvfile:
         spamreader = csv.reader(csvfile, delimiter=" ", quotechar="|")
@@ -357,22 +533,43 @@ def plot_matrix(
     return mean_sc_matrix
 
 
-def shuffle_matrix(matrix, index):
-    new_size = len(index)
-    new_matrix = np.zeros((new_size, new_size, len(matrix[0][0])))
+def shuffle_matrix(matrix, index, lazy=False):
+    """
+    Reorders (or subsets) the barcodes of a matrix.
+
+    Parameters
+    ----------
+    matrix : numpy array
+        (n_barcodes, n_barcodes) or (n_barcodes, n_barcodes, n_cells) matrix.
+    index : list of int
+        positions of the barcodes of the new matrix in matrix.
+    lazy : bool, optional
+        for 3D matrices, returns a `MatrixView` applying the permutation when
+        the matrix is read instead of a reordered copy. The default is False.
 
+    Returns
+    -------
+    numpy array or MatrixView
+        (len(index), len(index)[, n_cells]) matrix.
+    """
+    new_size = len(index)
     if new_size > matrix.shape[0]:
         raise ValueError(
             f"Error: shuffle size {new_size} is larger than matrix dimensions {matrix.shape[0]}\nShuffle: {index}"
         )
-    for i, j in itertools.product(range(new_size), range(new_size)):
-        if index[i] < matrix.shape[0] and index[j] < matrix.shape[0]:
-            new_matrix[i, j] = matrix[index[i], index[j]]
-        else:
-            raise ValueError(
-                f"Out of index; matrix.shape[0]: {matrix.shape[0]} |i: {i} |index[i]: {index[i]} |j: {j} |index[j]: {index[j]}"
-            )
-    return new_matrix
+    index = np.asarray(index, dtype=int)
+    out_of_range = np.flatnonzero(index >= matrix.shape[0])
+    if len(out_of_range) > 0:
+        i = out_of_range[0]
+        raise ValueError(
+            f"Out of index; matrix.shape[0]: {matrix.shape[0]} |i: {i} |index[i]: {index[i]}"
+        )
+
+    if lazy and matrix.ndim == 3:
+        if isinstance(matrix, MatrixView):
+            return matrix.select(barcodes=index)
+        return MatrixView(matrix, barcodes=index)
+    return np.asarray(matrix[np.ix_(index, index)], dtype=float)
 
 
 def decodes_trace(single_trace):
@@ -402,32 +599,48 @@ def decodes_trace(single_trace):
     return barcodes, X, Y, Z, trace_name
 
 
-def write_xyz_2_pdb(file_name, single_trace, barcode_type=dict()):
-    # writes xyz coordinates to a PDB file with pseudoatoms
-    # file_name : string of output file path, e.g. '/foo/bar/test2.pdb'
-    # xyz      : n-by-3 numpy array with atom coordinates
-
-    default_atom_name = "xxx"
-    barcodes, X, Y, Z, trace_name = decodes_trace(single_trace)
-
-    # builds NP array
-    xyz = np.transpose(np.array([X, Y, Z]))
-
-    # calculates center of mass
-    center_of_mass = np.mean(X), np.mean(Y), np.mean(Z)
-
-    # recenters and converts to A
-    unit_conversion = 10.0  # converts from nm to Angstroms
-    xyz = unit_conversion * (xyz - center_of_mass)
+# PDB record of a pseudoatom, see the column layout in ``format_pdb_trace``
+PDB_ATOM_LINE = (
+    "HETATM"  # record name
+    " {:4d}"  # atom serial number
+    "  {}"  # atom name
+    " "  # alternate location indicator
+    "{} "  # residue name
+    " "  # chain identifier
+    "{:4d}"  # residue sequence number
+    "    "  # code for insertion of residues
+    "{}{}{}"  # X, Y, Z
+    "   0.0"  # occupancy
+    "   0.0"  # temperature factor
+    "      PSDO"  # segment identifier
+    " X"  # element symbol
+    " X"  # charge on the atom
+    "\n"
+)
+
+
+def complete_barcode_type(barcode_type, barcodes, default_atom_name="xxx"):
+    """
+    Adds the barcodes missing from <barcode_type> with a default atom name.
 
-    # writes PDB file
-    n_atoms = xyz.shape[0]
+    Parameters
+    ----------
+    barcode_type : dict
+        barcode (as string) to 3-character atom name. Updated in place.
+    barcodes : iterable
+        barcodes to be written.
+    default_atom_name : str, optional
+        atom name of missing barcodes. The default is "xxx".
 
-    # defines atom names from barcode properties
+    Returns
+    -------
+    dict
+        updated barcode_type.
+    """
     if len(barcode_type) < 1:
         # all atoms have the same identity
         print("did not find barcode_type dictionary")
-        for i, barcode in enumerate(barcodes):
+        for barcode in barcodes:
             barcode_type[str(barcode)] = default_atom_name
     else:
         # adds missing keys
@@ -435,8 +648,35 @@ def write_xyz_2_pdb(file_name, single_trace, barcode_type=dict()):
             if str(barcode) not in barcode_type.keys():
                 barcode_type[str(barcode)] = default_atom_name
                 print(f"$ fixing key {barcode} as not found in dict")
+    return barcode_type
+
+
+def format_pdb_coordinate(value):
+    return " {:0<7.3f}".format(value)[:8]
+
 
+def format_pdb_trace(barcodes, xyz, trace_name, barcode_type):
     """
+    Formats the atoms and connectivity of one trace as PDB lines.
+
+    Parameters
+    ----------
+    barcodes : list of int
+        barcode of each atom.
+    xyz : numpy array
+        n-by-3 recentered coordinates in Angstroms.
+    trace_name : str
+        3-character residue name.
+    barcode_type : dict
+        barcode (as string) to 3-character atom name, must contain all barcodes.
+
+    Returns
+    -------
+    str
+        PDB lines.
+
+    Notes
+    -----
         COLUMNS        DATA TYPE       CONTENTS
     --------------------------------------------------------------------------------
      1 -  6        Record name     "ATOM  "
@@ -456,128 +696,293 @@ def write_xyz_2_pdb(file_name, single_trace, barcode_type=dict()):
     77 - 78        LString(2)      Element symbol, right-justified.
     79 - 80        LString(2)      Charge on the atom.
     """
-
-    with open(file_name, mode="w+", encoding="utf-8") as fid:
-        # atom coordinates
-        # txt = "HETATM  {: 3d}  C{:02d} {} P   1      {: 5.3f}  {: 5.3f}  {: 5.3f}  0.00  0.00      PSDO C  \n"
-        # txt = "HETATM  {: 3d}  {} {} P{: 3d}      {: 5.3f}  {: 5.3f}  {: 5.3f}  0.00  0.00      PSDO C  \n"
-        # for i in range(n_atoms):
-        #    atom_name = barcode_type[str(barcodes[i])]
-        # fid.write(txt.format(i + 1, i + 1, trace_name, int(barcodes[i]), xyz[i, 0], xyz[i, 1], xyz[i, 2]))
-        #    fid.write(txt.format(i + 1, atom_name, trace_name, int(barcodes[i]), xyz[i, 0], xyz[i, 1], xyz[i, 2]))
-
-        # fills fields with correct spacing
-        field_record = "HETATM"
-        field_atom_number = " {:4d}"
-        field_atom_name = "  {}"
-        field_alternative_location_indicator = " "
-        field_res_name = trace_name + " "
-        field_chain_identifier = " "
-        field_residue_seq_number = "{:4d}"
-        field_code_insertion = "    "
-        field_X = "{}"
-        field_Y = "{}"
-        field_Z = "{}"  # " {:0<7.3f}"
-        field_occupancy = "   0.0"
-        field_temp_factor = "   0.0"
-        field_segment_identifier = "      " + "PSDO"
-        field_element_symbol = " X"
-        field_charge_atom = " X"
-        txt = (
-            field_record
-            + field_atom_number
-            + field_atom_name
-            + field_alternative_location_indicator
-            + field_res_name
-            + field_chain_identifier
-            + field_residue_seq_number
-            + field_code_insertion
-            + field_X
-            + field_Y
-            + field_Z
-            + field_occupancy
-            + field_temp_factor
-            + field_segment_identifier
-            + field_element_symbol
-            + field_charge_atom
-            + "\n"
+    n_atoms = len(barcodes)
+    lines = [
+        PDB_ATOM_LINE.format(
+            i + 1,
+            barcode_type[str(barcode)],
+            trace_name,
+            int(barcode),
+            format_pdb_coordinate(x),
+            format_pdb_coordinate(y),
+            format_pdb_coordinate(z),
         )
+        for i, (barcode, (x, y, z)) in enumerate(zip(barcodes, xyz.tolist()))
+    ]
 
-        # txt = "HETATM  {: 3d}  C{:02d} {} P   1      {: 5.3f}  {: 5.3f}  {: 5.3f}  0.00  0.00      PSDO C  \n"
-        for i in range(n_atoms):
-            atom_name = barcode_type[str(barcodes[i])]
-            fid.write(
-                txt.format(
-                    i + 1,
-                    atom_name,
-                    int(barcodes[i]),
-                    " {:0<7.3f}".format(xyz[i, 0])[:8],
-                    " {:0<7.3f}".format(xyz[i, 1])[:8],
-                    " {:0<7.3f}".format(xyz[i, 2])[:8],
-                )
-            )
+    # connectivity
+    txt1 = "CONNECT  {: 3d}  {: 3d}\n"
+    txt2 = "CONNECT  {: 3d}  {: 3d}  {: 3d}\n"
 
-        # connectivity
-        txt1 = "CONNECT  {: 3d}  {: 3d}\n"
-        txt2 = "CONNECT  {: 3d}  {: 3d}  {: 3d}\n"
+    # first line of connectivity
+    lines.append(txt1.format(1, 2))
+    # consecutive lines
+    lines.extend(txt2.format(i, i - 1, i + 1) for i in range(2, n_atoms))
+    # last line
+    lines.append(txt1.format(n_atoms, n_atoms - 1))
 
-        # first line of connectivity
-        fid.write(txt1.format(1, 2))
+    return "".join(lines)
 
-        # consecutive lines
-        for i in range(2, n_atoms):
-            fid.write(txt2.format(i, i - 1, i + 1))
 
-        # last line
-        fid.write(txt1.format(i + 1, i))
+def write_xyz_2_pdb(file_name, single_trace, barcode_type=dict()):
+    # writes xyz coordinates to a PDB file with pseudoatoms
+    # file_name : string of output file path, e.g. '/foo/bar/test2.pdb'
+    # xyz      : n-by-3 numpy array with atom coordinates
+
+    barcodes, X, Y, Z, trace_name = decodes_trace(single_trace)
+
+    # builds NP array
+    xyz = np.transpose(np.array([X, Y, Z]))
+
+    # calculates center of mass
+    center_of_mass = np.mean(X), np.mean(Y), np.mean(Z)
+
+    # recenters and converts to A
+    unit_conversion = 10.0  # converts from nm to Angstroms
+    xyz = unit_conversion * (xyz - center_of_mass)
+
+    # defines atom names from barcode properties
+    complete_barcode_type(barcode_type, barcodes)
 
+    # writes PDB file
+    n_atoms = xyz.shape[0]
+    with open(file_name, mode="w+", encoding="utf-8") as fid:
+        fid.write(format_pdb_trace(barcodes, xyz, trace_name, barcode_type))
         print(f"Done writing {file_name:s} with {n_atoms:d} atoms.")
 
 
+def sort_traces(trace_table):
+    """
+    Sorts a trace table by Trace_ID and Barcode # once, and returns it as
+    segmented column arrays.
+
+    Parameters
+    ----------
+    trace_table : astropy table
+        trace table.
+
+    Returns
+    -------
+    trace_ids : numpy array
+        Trace_ID of each trace.
+    offsets : numpy array
+        rows of trace i are in [offsets[i], offsets[i + 1]).
+    barcodes : numpy array
+        sorted barcodes.
+    xyz : numpy array
+        3-by-n sorted coordinates, in the dtype of the table columns.
+    """
+    trace_column = np.asarray(trace_table["Trace_ID"])
+    barcodes = np.asarray(trace_table["Barcode #"])
+    order = np.lexsort((barcodes, trace_column))
+    trace_column = trace_column[order]
+    trace_ids, starts = np.unique(trace_column, return_index=True)
+    offsets = np.append(starts, len(trace_column))
+    xyz = np.stack([np.asarray(trace_table[coor])[order] for coor in ("x", "y", "z")])
+    return trace_ids, offsets, barcodes[order], xyz
+
+
+def format_pdb_traces(
+    trace_ids, offsets, barcodes, xyz, barcode_type, multi_model=False, first_model=1
+):
+    """
+    Formats sorted traces (see ``sort_traces``) as PDB blocks.
+
+    Each trace is recentered on its center of mass and converted to Angstroms,
+    in the dtype of the coordinates, as in ``write_xyz_2_pdb``.
+
+    Parameters
+    ----------
+    multi_model : bool, optional
+        wraps each trace in MODEL/ENDMDL records. The default is False.
+    first_model : int, optional
+        number of the first model. The default is 1.
+
+    Returns
+    -------
+    list of str
+        one PDB block per trace.
+    """
+    unit_conversion = 10.0  # converts from nm to Angstroms
+
+    blocks = []
+    for idx, trace_id in enumerate(trace_ids):
+        start, end = offsets[idx], offsets[idx + 1]
+        trace_xyz = xyz[:, start:end]
+        center_of_mass = trace_xyz.mean(axis=1, keepdims=True)
+        trace_xyz = unit_conversion * (trace_xyz - center_of_mass)
+        block = format_pdb_trace(
+            barcodes[start:end].tolist(), trace_xyz.T, trace_id[:3], barcode_type
+        )
+        if multi_model:
+            block = f"MODEL     {first_model + idx:4d}\n{block}ENDMDL\n"
+        blocks.append(block)
+    return blocks
+
+
 def distances_2_coordinates(distances):
-    """Infer coordinates from distances"""
-    N = distances.shape[0]
-    d_0 = []
-
-    # pre-caching
-    cache = {}
-    for j in range(N):
-        sumi = sum(distances[j, k] ** 2 for k in range(j + 1, N))
-        cache[j] = sumi
-
-    # compute distances from center of mass
-    sum2 = sum(cache[j] for j in range(N))
-    for i in range(N):
-        sum1 = cache[i] + sum(distances[j, i] ** 2 for j in range(i + 1))
-
-        val = 1 / N * sum1 - 1 / N**2 * sum2
-        d_0.append(val)
-
-    # generate gram matrix
-    gram = np.zeros(distances.shape)
-    for row in range(distances.shape[0]):
-        for col in range(distances.shape[1]):
-            dists = d_0[row] ** 2 + d_0[col] ** 2 - distances[row, col] ** 2
-            gram[row, col] = 1 / 2 * dists
+    """
+    Infers coordinates from distances by classical multidimensional scaling.
 
-    # extract coordinates from gram matrix
-    coordinates = []
-    vals, vecs = npl.eigh(gram)
+    The Gram matrix is obtained by double centering the squared distances and
+    the coordinates from its three largest eigenvalues. Stacks of matrices are
+    reconstructed with a single batched eigendecomposition.
+
+    Parameters
+    ----------
+    distances : numpy array
+        N-by-N distance matrix, or stack of matrices with shape (..., N, N).
+        Must not contain NaNs, see ``distances_2_coordinates_nan``.
+
+    Returns
+    -------
+    numpy array
+        N-by-3 coordinates, or (..., N, 3) for a stack of matrices.
+    """
+    squared_distances = np.asarray(distances, dtype=float) ** 2
 
-    vals = vals[N - 3 :]
-    vecs = vecs.T[N - 3 :]
+    # double centering: gram = -1/2 J D^2 J, with J = I - 1/N
+    row_means = squared_distances.mean(axis=-1, keepdims=True)
+    col_means = squared_distances.mean(axis=-2, keepdims=True)
+    grand_mean = row_means.mean(axis=-2, keepdims=True)
+    gram = -0.5 * (squared_distances - row_means - col_means + grand_mean)
 
-    # print('eigvals:', vals) # must all be positive for PSD (positive semidefinite) matrix
+    # extract coordinates from gram matrix
+    vals, vecs = npl.eigh(gram)
 
     # same eigenvalues might be small -> exact embedding does not exist
-    # fix by replacing all but largest 3 eigvals by 0
+    # fix by keeping the largest 3 eigvals and clipping negative ones to 0
     # better if three largest eigvals are separated by large spectral gap
+    vals = np.clip(vals[..., -3:], 0, None)
+    vecs = vecs[..., -3:]
 
-    for val, vec in zip(vals, vecs):
-        coord = vec * np.sqrt(val)
-        coordinates.append(coord)
+    return vecs * np.sqrt(vals)[..., None, :]
 
-    return np.array(coordinates).T
+
+def coordinates_2_distances(coordinates):
+    """
+    Calculates the pairwise distance matrices of (stacks of) coordinates.
+
+    Parameters
+    ----------
+    coordinates : numpy array
+        coordinates with shape (..., N, 3).
+
+    Returns
+    -------
+    numpy array
+        distances with shape (..., N, N).
+    """
+    squared_norms = np.sum(coordinates**2, axis=-1)
+    squared_distances = (
+        squared_norms[..., :, None]
+        + squared_norms[..., None, :]
+        - 2 * coordinates @ np.swapaxes(coordinates, -1, -2)
+    )
+    return np.sqrt(np.clip(squared_distances, 0, None))
+
+
+def distances_2_coordinates_nan(
+    distances, initial_distances=None, max_iter=100, tolerance=1e-4
+):
+    """
+    Infers coordinates from distance matrices with missing (NaN) distances.
+
+    Missing distances are imputed iteratively: they are first filled with
+    <initial_distances> (or the mean of the observed distances of each matrix),
+    then replaced by the distances of the MDS reconstruction until they
+    converge. Barcodes without any observed distance get NaN coordinates.
+
+    Parameters
+    ----------
+    distances : numpy array
+        N-by-N distance matrix, or stack of matrices with shape (..., N, N).
+    initial_distances : numpy array, optional
+        N-by-N matrix used as first guess of the missing distances, for
+        instance the ensemble matrix. The default is None.
+    max_iter : int, optional
+        maximum number of imputation iterations. The default is 100.
+    tolerance : float, optional
+        stops when the largest change of an imputed distance, relative to the
+        largest distance, is below this value. The default is 1e-4.
+
+    Returns
+    -------
+    numpy array
+        N-by-3 coordinates, or (..., N, 3) for a stack of matrices.
+    """
+    distances = np.array(distances, dtype=float)
+    n_barcodes = distances.shape[-1]
+
+    # symmetrizes using the distances observed in either triangle
+    transposed = np.swapaxes(distances, -1, -2)
+    distances = np.where(np.isnan(distances), transposed, distances)
+    diagonal = np.eye(n_barcodes, dtype=bool)
+    distances[..., diagonal] = 0
+    missing = np.isnan(distances)
+    absent_barcodes = np.all(missing | diagonal, axis=-1)
+
+    # first guess of the missing distances
+    if initial_distances is None:
+        observed = np.where(missing | diagonal, 0, distances)
+        n_observed = np.sum(~(missing | diagonal), axis=(-1, -2), keepdims=True)
+        fill = np.sum(observed, axis=(-1, -2), keepdims=True) / np.maximum(
+            n_observed, 1
+        )
+        fill = np.broadcast_to(fill, distances.shape)
+    else:
+        fill = np.broadcast_to(np.nan_to_num(initial_distances), distances.shape)
+    distances[missing] = fill[missing]
+
+    # iterates on a flat stack, dropping the matrices that converged
+    shape = distances.shape
+    distances = distances.reshape(-1, n_barcodes, n_barcodes)
+    missing = missing.reshape(distances.shape)
+    scales = np.maximum(np.max(distances, axis=(-1, -2)), np.finfo(float).eps)
+    coordinates = distances_2_coordinates(distances)
+    active = np.flatnonzero(np.any(missing, axis=(-1, -2)))
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        active_missing = missing[active]
+        active_distances = distances[active]
+        reconstructed = coordinates_2_distances(coordinates[active])
+        change = np.max(
+            np.where(active_missing, np.abs(reconstructed - active_distances), 0),
+            axis=(-1, -2),
+        )
+        active_distances[active_missing] = reconstructed[active_missing]
+        distances[active] = active_distances
+        coordinates[active] = distances_2_coordinates(active_distances)
+        active = active[change / scales[active] >= tolerance]
+    coordinates = coordinates.reshape(shape[:-1] + (3,))
+
+    coordinates[absent_barcodes] = np.nan
+    return coordinates
+
+
+def sc_matrix_2_coordinates(sc_matrix, initial_distances=None, **kwargs):
+    """
+    Reconstructs the 3D coordinates of every cell of a PWDscMatrix in one call.
+
+    Parameters
+    ----------
+    sc_matrix : numpy array
+        single-cell PWD matrices with shape (N, N, n_cells).
+    initial_distances : numpy array, optional
+        N-by-N first guess of the missing distances, e.g. the ensemble matrix.
+    **kwargs :
+        passed to ``distances_2_coordinates_nan``.
+
+    Returns
+    -------
+    numpy array
+        coordinates with shape (n_cells, N, 3), NaN for missing barcodes.
+    """
+    distances = np.moveaxis(np.asarray(sc_matrix), -1, 0)
+    return distances_2_coordinates_nan(
+        distances, initial_distances=initial_distances, **kwargs
+    )
 
 
 def is_notebook():
@@ -738,6 +1143,7 @@ def plot_single_matrix(
     cbar.set_label(cm_title, fontsize=float(fontsize) * 1.0)
     adjust_colorbar(cbar, pos, c_min, clim)
     plt.savefig(fig_path)
+    plt.close()
 
 
 def get_matrix_title(
@@ -874,20 +1280,117 @@ def plot_him_matrix(
     return plot_path[:-4]
 
 
+def iterate_row_blocks(sc_matrices, max_elements=10_000_000):
+    """
+    Yields blocks of rows of a single-cell matrix as float arrays.
+
+    Parameters
+    ----------
+    sc_matrices : numpy array
+        (n_barcodes, n_barcodes, n_cells) matrix, possibly memory-mapped.
+    max_elements : int, optional
+        maximum number of elements per block. The default is 10_000_000.
+
+    Yields
+    ------
+    start : int
+        first row of the block.
+    block : numpy array
+        (n_rows, n_barcodes, n_cells) rows of the matrix.
+    """
+    n_barcodes, n_y, n_cells = sc_matrices.shape
+    n_rows = max(1, max_elements // max(n_y * n_cells, 1))
+    for start in range(0, n_barcodes, n_rows):
+        yield start, np.asarray(sc_matrices[start : start + n_rows], dtype=float)
+
+
 def calculate_nan_matrix(sc_matrices):
     n_barcodes = sc_matrices.shape[0]
     n_cells = sc_matrices.shape[2]
-    nan_matrix = np.zeros((n_barcodes, n_barcodes))
-    for i in range(n_barcodes):
-        for j in range(n_barcodes):
-            if i != j:
-                distance_distribution = sc_matrices[i, j, :]
-                number_nans = len(np.nonzero(np.isnan(distance_distribution))[0])
-                nan_percentage = number_nans / n_cells
-                nan_matrix[i, j] = nan_percentage
+    nan_matrix = np.zeros((n_barcodes, sc_matrices.shape[1]))
+    for start, block in iterate_row_blocks(sc_matrices):
+        nan_matrix[start : start + len(block)] = np.isnan(block).sum(axis=2) / n_cells
+    np.fill_diagonal(nan_matrix, 0)
     return nan_matrix
 
 
+def calculate_contact_probability_matrices(
+    i_sc_matrix_collated,
+    pixel_size,
+    thresholds,
+    remove_nan=False,
+    min_number_contacts=0,
+):
+    """
+    Calculates contact probability matrices for several proximity thresholds.
+
+    The distances of each pair of barcodes are binned once by the sorted
+    thresholds, and the cumulative histogram gives the number of distances
+    below every threshold.
+
+    Parameters
+    ----------
+    i_sc_matrix_collated : numpy array
+        (n_barcodes, n_barcodes, n_cells) single-cell PWD matrix, possibly
+        memory-mapped.
+    pixel_size : float
+        pixel size in µm.
+    thresholds : list of float
+        proximity thresholds in µm.
+    remove_nan : bool, optional
+        normalizes by the number of non-NaN distances of each pair instead
+        of the number of cells. The default is False.
+    min_number_contacts : int, optional
+        pairs with fewer non-NaN distances get a probability of 0.
+        The default is 0.
+
+    Returns
+    -------
+    numpy array
+        (n_thresholds, n_barcodes, n_barcodes) contact probabilities, in the
+        order of thresholds, with zeros on the diagonal.
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    order = np.argsort(thresholds)
+    sorted_thresholds = thresholds[order]
+    n_thresholds = len(thresholds)
+    n_x, n_y, n_cells = i_sc_matrix_collated.shape
+
+    counts = np.zeros((n_x, n_y, n_thresholds))
+    n_real = np.zeros((n_x, n_y))
+    for start, block in iterate_row_blocks(i_sc_matrix_collated):
+        block = pixel_size * block
+        n_real[start : start + len(block)] = n_cells - np.isnan(block).sum(axis=2)
+        # number of thresholds <= distance; NaNs are placed after all thresholds
+        bins = np.searchsorted(sorted_thresholds, block, side="right")
+        pairs = np.arange(bins.shape[0] * n_y).reshape(-1, n_y, 1)
+        histogram = np.bincount(
+            (pairs * (n_thresholds + 1) + bins).ravel(),
+            minlength=pairs.size * (n_thresholds + 1),
+        ).reshape(-1, n_y, n_thresholds + 1)
+        counts[start : start + len(block)] = np.cumsum(histogram, axis=2)[..., :-1]
+
+    if remove_nan:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            probabilities = counts / n_real[..., None]
+    else:
+        probabilities = counts / n_cells
+
+    rejected = n_real < min_number_contacts
+    np.fill_diagonal(rejected, False)
+    for i, j in np.argwhere(rejected):
+        print(
+            f"$ Rejected {i}-{j} because number contacts: {int(n_real[i, j])} < {min_number_contacts}"
+        )
+    probabilities[rejected] = 0.0
+    for k in range(n_thresholds):
+        np.fill_diagonal(probabilities[..., k], 0.0)
+
+    result = np.empty_like(probabilities)
+    result[..., order] = probabilities
+    return np.moveaxis(result, 2, 0)
+
+
 def calculate_contact_probability_matrix(
     i_sc_matrix_collated,
     pixel_size,
@@ -895,37 +1398,13 @@ def calculate_contact_probability_matrix(
     remove_nan=False,
     min_number_contacts=0,
 ):
-    n_x = n_y = i_sc_matrix_collated.shape[0]
-    n_cells = i_sc_matrix_collated.shape[2]
-    sc_matrix = np.zeros((n_x, n_y))
-    for i in range(n_x):
-        for j in range(n_y):
-            if i != j:
-                distance_distribution = pixel_size * i_sc_matrix_collated[i, j, :]
-                number_contacts = distance_distribution.squeeze().shape[0] - len(
-                    np.nonzero(np.isnan(distance_distribution))[0]
-                )
-                number_nans = len(np.nonzero(np.isnan(distance_distribution))[0])
-                if number_contacts < min_number_contacts:
-                    print(
-                        f"$ Rejected {i}-{j} because number contacts: {number_contacts} < {min_number_contacts}"
-                    )
-                    probability = 0.0
-                elif not remove_nan:
-                    probability = (
-                        len(np.nonzero(distance_distribution < threshold)[0]) / n_cells
-                    )
-                else:
-                    if n_cells == number_nans:
-                        probability = np.nan
-                    else:
-                        n_real_bin = n_cells - number_nans
-                        below_threshold_indices = np.nonzero(
-                            distance_distribution < threshold
-                        )[0]
-                        probability = len(below_threshold_indices) / n_real_bin
-                sc_matrix[i, j] = probability
-    return sc_matrix
+    return calculate_contact_probability_matrices(
+        i_sc_matrix_collated,
+        pixel_size,
+        [threshold],
+        remove_nan=remove_nan,
+        min_number_contacts=min_number_contacts,
+    )[0]
 
 
 # @jit(nopython=True)
@@ -1124,18 +1603,12 @@ def get_detection_eff_barcodes(sc_matrix_collated):
             "getBarcodeEff: Expected axis 0 and 1 to have the same length."
         )
 
-    # make sure the diagonal is NaN
-    for i in range(sc_matrix_collated.shape[0]):
-        sc_matrix_collated[i, i, :] = np.NaN
-
     # calculate barcode efficiency
     n_cells = sc_matrix_collated.shape[2]
 
-    eff = np.sum(~np.isnan(sc_matrix_collated), axis=0)
-    eff[eff > 1] = 1
+    eff = detected_barcodes(sc_matrix_collated).astype(int)
 
-    eff0 = eff.copy()
-    n_cells_2 = np.nonzero(np.sum(eff0, axis=0) > 2)[0].shape[0]
+    n_cells_2 = np.nonzero(np.sum(eff, axis=0) > 2)[0].shape[0]
 
     eff = np.sum(eff, axis=-1)  # sum over all cells
 
@@ -1150,15 +1623,26 @@ def get_barcodes_per_cell(sc_matrix_collated):
     Returns the number of barcodes that were detected in each cell of sc_matrix_collated.
     """
 
-    # make sure the diagonal is NaN
-    for i in range(sc_matrix_collated.shape[0]):
-        sc_matrix_collated[i, i, :] = np.NaN
+    return np.sum(detected_barcodes(sc_matrix_collated), axis=0)
 
-    num_barcodes = np.sum(~np.isnan(sc_matrix_collated), axis=0)
-    num_barcodes[num_barcodes > 1] = 1
-    num_barcodes = np.sum(num_barcodes, axis=0)
 
-    return num_barcodes
+def detected_barcodes(sc_matrix_collated):
+    """
+    Returns a (n_barcodes, n_cells) mask of the barcodes detected in each cell,
+    i.e. with at least one PWD to another barcode.
+
+    The matrix is read by blocks of rows and is not modified, so it can be
+    memory-mapped read-only.
+    """
+    n_barcodes, _, n_cells = sc_matrix_collated.shape
+    detected = np.zeros((n_barcodes, n_cells), dtype=bool)
+    for start, block in iterate_row_blocks(sc_matrix_collated):
+        rows = np.arange(len(block))
+        not_nan = ~np.isnan(block)
+        # ignores the diagonal
+        not_nan[rows, start + rows, :] = False
+        detected |= np.any(not_nan, axis=0)
+    return detected
 
 
 def get_coordinates_from_pwd_matrix(matrix):
@@ -1214,6 +1698,14 @@ def kde_fit(x, x_d, bandwidth=0.2, kernel="gaussian"):
     return logprob, kde
 
 
+def _cells_index(cells_to_plot, n_cells):
+    # slice(None) when all cells are used in order, to avoid copying them
+    cells = np.arange(n_cells)[np.asarray(cells_to_plot, dtype=int)]
+    if np.array_equal(cells, np.arange(n_cells)):
+        return slice(None)
+    return cells
+
+
 def calculate_ensemble_pwd_matrix(sc_matrix, pixel_size, cells_to_plot, mode="median"):
     """
     performs a KDE or median to calculate the max of the PWD distribution
@@ -1247,9 +1739,13 @@ def calculate_ensemble_pwd_matrix(sc_matrix, pixel_size, cells_to_plot, mode="me
 
             keep_plotting = False
         else:
-            mean_sc_matrix = pixel_size * np.nanmedian(
-                sc_matrix[:, :, cells_to_plot], axis=2
-            )
+            # reads the matrix by blocks of rows, so that memory-mapped or
+            # shuffled matrices are never copied as a whole
+            cells = _cells_index(cells_to_plot, sc_matrix.shape[2])
+            for start, block in iterate_row_blocks(sc_matrix):
+                mean_sc_matrix[start : start + len(block)] = pixel_size * np.nanmedian(
+                    block[:, :, cells], axis=2
+                )
             keep_plotting = True
 
     elif mode == "KDE":
@@ -1263,6 +1759,9 @@ def calculate_ensemble_pwd_matrix(sc_matrix, pixel_size, cells_to_plot, mode="me
 
             keep_plotting = False
         else:
+            cells = _cells_index(cells_to_plot, sc_matrix.shape[2])
+            if not isinstance(cells, slice):
+                sc_matrix = sc_matrix[:, :, cells]
             for bin1 in trange(n_barcodes):
                 for bin2 in range(n_barcodes):
                     if bin1 != bin2:
@@ -1273,7 +1772,7 @@ def calculate_ensemble_pwd_matrix(sc_matrix, pixel_size, cells_to_plot, mode="me
                             _,
                             _,
                         ) = distribution_maximum_kernel_density_estimation(
-                            sc_matrix[:, :, cells_to_plot],
+                            sc_matrix,
                             bin1,
                             bin2,
                             pixel_size,
@@ -11,6 +11,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 from astropy.table import Table, vstack
 
+from traceratops.core.chromatin_trace_table import TraceIndex, dictionary_encode
+
 
 def read_table_from_ecsv(path):
     """Read an astropy Table saved as an ``ecsv`` file."""
@@ -58,7 +60,7 @@ class LocalizationTable:
 
         return barcode_map, unique_barcodes
 
-    def save(self, file_name, barcode_map, comments=""):
+    def save(self, file_name, barcode_map, comments="", format="ascii.ecsv"):
         """
         Saves output table
 
@@ -74,6 +76,8 @@ class LocalizationTable:
             file extension. The default is 'ecsv'.
         comments : list of strings, optional
             Will output as comments to the header. The default is [].
+        format : string, optional
+            astropy output format, e.g. 'fits' or 'parquet'. The default is 'ascii.ecsv'.
 
         Returns
         -------
@@ -89,7 +93,7 @@ class LocalizationTable:
 
         barcode_map.write(
             file_name,
-            format="ascii.ecsv",
+            format=format,
             overwrite=True,
         )
 
@@ -192,14 +196,19 @@ class LocalizationTable:
         """
 
         # indexes table by ROI
-        barcode_map_roi, number_rois = decode_rois(barcode_map_full)
-
-        for i_roi in range(number_rois):
-            # creates sub Table for this ROI
-            barcode_map = barcode_map_roi.groups[i_roi]
-            n_roi = barcode_map["ROI #"][0]
+        roi_index = TraceIndex(barcode_map_full["ROI #"])
+        print(f"\n$ rois detected: {len(roi_index)}")
+
+        barcodes = np.asarray(barcode_map_full["Barcode #"])
+        coordinates = [
+            np.asarray(barcode_map_full[label])
+            for label in ("xcentroid", "ycentroid", "zcentroid")
+        ]
+
+        for idx, n_roi in enumerate(roi_index.keys):
+            # rows of this ROI
+            rows = roi_index.rows(idx)
             print(f"> Plotting barcode localization map for ROI: {n_roi}")
-            color_dict = build_color_dict(barcode_map, key="Barcode #")
 
             # initializes figure
             fig = plt.figure(constrained_layout=False)
@@ -212,11 +221,9 @@ class LocalizationTable:
                 fig.add_subplot(gs[1, 1]),
             ]
 
-            # defines variables
-            x = barcode_map["xcentroid"]
-            y = barcode_map["ycentroid"]
-            z = barcode_map["zcentroid"]
-            colors = [color_dict[str(x)] for x in barcode_map["Barcode #"]]
+            # defines variables; colors index the sorted barcodes of the ROI
+            x, y, z = (coordinate[rows] for coordinate in coordinates)
+            colors, _ = dictionary_encode(barcodes[rows])
             titles = ["Z-projection", "X-projection", "Y-projection"]
 
             # makes plot
@@ -230,6 +237,7 @@ class LocalizationTable:
             filename_list_i = filename_list.copy()
             filename_list_i.insert(-1, f"_ROI{str(n_roi)}")
             fig.savefig("".join(filename_list_i))
+            plt.close(fig)
 
     def compares_localizations(
         self, barcode_map_1, barcode_map_2, filename_list, fontsize=20
@@ -246,35 +254,25 @@ class LocalizationTable:
 
         Returns
         -------
-        None.
+        diffs : dict
+            differences of each centroid coordinate (table 2 - table 1) for
+            the localizations found in both tables and not NaN in either.
 
         """
 
-        barcode_map_2.add_index("Buid")
-        number_localizations = len(barcode_map_1)
-
         labels = ["xcentroid", "ycentroid", "zcentroid"]
-        diffs = {label: [] for label in labels}
-        # iterates over rows in barcode_map_1
-        for row in range(number_localizations):
-            buid_1 = barcode_map_2[row]["Buid"]
-            barcode_found = True
-
-            # finds same Buid in barcode_map_2
-            try:
-                barcode_map_2.loc[buid_1]
-            except KeyError:
-                barcode_found = False
-
-            # collects differences in values between same localization in both tables
-            if barcode_found:
-                for label in labels:
-                    a, b = barcode_map_2.loc[buid_1][label], barcode_map_1[row][label]
-                    if ~np.isnan(a).any() and ~np.isnan(b).any():
-                        # diff = a - b
-                        # if np.isnan(diff):
-                        #    diff = 0
-                        diffs[label].append(a - b)
+
+        # finds the same Buid in barcode_map_2 for every row of barcode_map_1
+        rows_1, rows_2 = match_keys(barcode_map_1["Buid"], barcode_map_2["Buid"])
+        print(f"$ Localizations matched: {len(rows_1)}/{len(barcode_map_1)} by Buid")
+
+        # collects differences in values between same localization in both tables
+        deltas = {
+            label: np.asarray(barcode_map_2[label], dtype=float)[rows_2]
+            - np.asarray(barcode_map_1[label], dtype=float)[rows_1]
+            for label in labels
+        }
+        diffs = {label: delta[~np.isnan(delta)] for label, delta in deltas.items()}
 
         # plots figures
         fig, axes = plt.subplots(2, 2)
@@ -287,14 +285,134 @@ class LocalizationTable:
             axis.set_xlabel(f"{label} correction, px", fontsize=fontsize)
             axis.set_ylabel("counts", fontsize=fontsize)
 
+        valid = ~np.isnan(deltas["xcentroid"]) & ~np.isnan(deltas["ycentroid"])
         ax[3].scatter(
-            np.array(diffs["ycentroid"]), np.array(diffs["xcentroid"]), s=3, alpha=0.8
+            deltas["ycentroid"][valid], deltas["xcentroid"][valid], s=3, alpha=0.8
         )
         ax[3].set_xlabel("dx-position, px", fontsize=fontsize)
         ax[3].set_ylabel("dy-position, px", fontsize=fontsize)
 
         fig.savefig("".join(filename_list))
 
+        return diffs
+
+
+def match_keys(keys_1, keys_2):
+    """
+    Matches two key columns by sorted-key lookup.
+
+    Parameters
+    ----------
+    keys_1 : array-like
+        keys of table 1, e.g. Buid.
+    keys_2 : array-like
+        keys of table 2.
+
+    Returns
+    -------
+    rows_1 : numpy array
+        rows of table 1 whose key is found in table 2.
+    rows_2 : numpy array
+        first row of table 2 with the same key, for each of rows_1.
+    """
+    keys_1, keys_2 = np.asarray(keys_1), np.asarray(keys_2)
+    order = np.argsort(keys_2, kind="stable")
+    sorted_keys = keys_2[order]
+
+    positions = np.searchsorted(sorted_keys, keys_1)
+    found = positions < len(sorted_keys)
+    found[found] = sorted_keys[positions[found]] == keys_1[found]
+
+    return np.flatnonzero(found), order[positions[found]]
+
+
+def segment_median(codes, values, n_segments):
+    """
+    Median of the non-NaN values of each segment, with one lexsort.
+
+    Parameters
+    ----------
+    codes : numpy array
+        integer code of each row, in [0, n_segments).
+    values : numpy array
+        value of each row.
+    n_segments : int
+        number of codes.
+
+    Returns
+    -------
+    numpy array
+        median of each segment, NaN for segments without values.
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    sorted_values = values[np.lexsort((values, codes))]
+
+    counts = np.bincount(codes, minlength=n_segments)
+    starts = np.cumsum(counts) - counts
+    medians = np.full(n_segments, np.nan)
+    found = counts > 0
+    low = starts[found] + (counts[found] - 1) // 2
+    high = starts[found] + counts[found] // 2
+    medians[found] = (sorted_values[low] + sorted_values[high]) / 2
+    return medians
+
+
+def localizations_per_barcode(barcode_map, key="Barcode #"):
+    """
+    Counts the localizations of each barcode.
+
+    Parameters
+    ----------
+    barcode_map : astropy Table
+        localization table.
+    key : str, optional
+        barcode column. The default is "Barcode #".
+
+    Returns
+    -------
+    barcodes : numpy array
+        sorted barcodes.
+    counts : numpy array
+        number of localizations of each barcode.
+    """
+    barcode_index = TraceIndex(barcode_map[key])
+    return barcode_index.keys, barcode_index.count()
+
+
+def summarize_rois(barcode_map, columns=("flux", "peak")):
+    """
+    Summarizes the localizations of each (ROI, barcode) pair.
+
+    Parameters
+    ----------
+    barcode_map : astropy Table
+        localization table.
+    columns : tuple of str, optional
+        columns whose median is reported, when present.
+        The default is ("flux", "peak").
+
+    Returns
+    -------
+    astropy Table
+        one row per (ROI, barcode) pair with the number of localizations
+        and the median of each column.
+    """
+    roi_index = TraceIndex(barcode_map["ROI #"])
+    rois, barcodes, counts, codes = roi_index.value_counts(barcode_map["Barcode #"])
+
+    summary = Table()
+    summary["ROI #"] = roi_index.keys[rois]
+    summary["Barcode #"] = barcodes
+    summary["n_localizations"] = counts
+    for column in columns:
+        if column in barcode_map.colnames:
+            summary[f"median_{column}"] = segment_median(
+                codes, barcode_map[column], len(counts)
+            )
+    return summary
+
 
 def decode_rois(data):
     data_indexed = data.group_by("ROI #")
@@ -7,11 +7,13 @@ import sys
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import bootstrap, ranksums
+from scipy.stats import bootstrap, norm
 from tqdm import trange
 
 from traceratops.core.him_matrix_operations import (
     calculate_contact_probability_matrix,
+    iterate_row_blocks,
+    load_sc_matrix,
     shuffle_matrix,
 )
 
@@ -69,8 +71,16 @@ def get_position_from_unique_barcode_list(i: int, unique_barcodes: list) -> int:
 
 def gets_matrix(run_parameters, scPWDMatrix_filename="", uniqueBarcodes=""):
 
+    uniqueBarcodes = list(np.loadtxt(uniqueBarcodes, delimiter=" "))
+    uniqueBarcodes = [int(x) for x in uniqueBarcodes]
+    print(f"$ unique barcodes loaded: {uniqueBarcodes}")
+
     if os.path.exists(scPWDMatrix_filename):
-        sc_matrix = np.load(scPWDMatrix_filename)
+        try:
+            sc_matrix = load_sc_matrix(scPWDMatrix_filename, uniqueBarcodes)
+        except ValueError as e:
+            print(f"*** Error: {e}")
+            sys.exit(-1)
         print(f"$ Loaded: {scPWDMatrix_filename}")
     else:
         print("*** Error: could not find {}".format(scPWDMatrix_filename))
@@ -82,16 +92,14 @@ def gets_matrix(run_parameters, scPWDMatrix_filename="", uniqueBarcodes=""):
 
     print("$ N traces to plot: {}/{}".format(len(cells2Plot), sc_matrix.shape[2]))
 
-    uniqueBarcodes = list(np.loadtxt(uniqueBarcodes, delimiter=" "))
-    uniqueBarcodes = [int(x) for x in uniqueBarcodes]
-    print(f"$ unique barcodes loaded: {uniqueBarcodes}")
-
     print(f"$ averaging method: {run_parameters['dist_calc_mode']}")
 
     if run_parameters["cMax"] == 0:
-        cScale = (
-            sc_matrix[~np.isnan(sc_matrix)].max() / run_parameters["scalingParameter"]
+        max_distance = max(
+            np.max(block, initial=-np.inf, where=~np.isnan(block))
+            for _, block in iterate_row_blocks(sc_matrix)
         )
+        cScale = max_distance / run_parameters["scalingParameter"]
     else:
         cScale = run_parameters["cMax"]
 
@@ -112,7 +120,7 @@ def gets_matrix(run_parameters, scPWDMatrix_filename="", uniqueBarcodes=""):
         index = range(sc_matrix.shape[0])
     else:
         index = [int(i) for i in run_parameters["shuffle"].split(",")]
-        sc_matrix = shuffle_matrix(sc_matrix, index)
+        sc_matrix = shuffle_matrix(sc_matrix, index, lazy=True)
 
     if run_parameters["dist_calc_mode"] == "proximity":
         # calculates and plots contact probability matrix from merged samples/datasets
@@ -137,23 +145,213 @@ def gets_matrix(run_parameters, scPWDMatrix_filename="", uniqueBarcodes=""):
     return sc_matrix, uniqueBarcodes, cScale, n_cells, outputFileName, fileNameEnding
 
 
+def rank_rows(data):
+    """
+    Ranks each row of a padded 2D array, ignoring NaNs.
+
+    Tied values receive the average of their ranks, as in `scipy.stats.rankdata`.
+
+    Parameters
+    ----------
+    data : numpy array
+        (n_rows, n_values) array, padded with NaNs.
+
+    Returns
+    -------
+    ranks : numpy array
+        (n_rows, n_values) ranks starting at 1, NaN where data is NaN.
+    ties : numpy array
+        sum of t**3 - t over the groups of t tied values of each row.
+    """
+    n_rows, n_values = data.shape
+    order = np.argsort(data, axis=1)
+    sorted_data = np.take_along_axis(data, order, axis=1)
+    valid = ~np.isnan(sorted_data)
+
+    # runs of equal values in the flattened rows; NaNs are never equal
+    starts = np.ones(sorted_data.shape, dtype=bool)
+    starts[:, 1:] = sorted_data[:, 1:] != sorted_data[:, :-1]
+    starts = starts.ravel()
+    run_ids = np.cumsum(starts) - 1
+    run_starts = np.flatnonzero(starts)
+    run_lengths = np.diff(np.append(run_starts, starts.size))
+    run_ranks = run_starts % n_values + (run_lengths + 1) / 2
+
+    ranks = np.empty(data.shape)
+    np.put_along_axis(ranks, order, run_ranks[run_ids].reshape(data.shape), axis=1)
+    ranks[np.isnan(data)] = np.nan
+
+    run_valid = valid.ravel()[run_starts]
+    ties = np.bincount(
+        run_starts[run_valid] // n_values,
+        weights=run_lengths[run_valid] ** 3.0 - run_lengths[run_valid],
+        minlength=n_rows,
+    )
+    return ranks, ties
+
+
+def ranksums_rows(x, y, tie_correction=True):
+    """
+    Wilcoxon rank-sum test between each row of x and the same row of y.
+
+    Equivalent to calling `scipy.stats.ranksums` on every pair of rows after
+    removing NaNs, with an optional correction of the variance for ties.
+
+    Parameters
+    ----------
+    x : numpy array
+        (n_rows, n1) first samples, padded with NaNs.
+    y : numpy array
+        (n_rows, n2) second samples, padded with NaNs.
+    tie_correction : bool, optional
+        corrects the variance of the statistic for tied values. The default is True.
+
+    Returns
+    -------
+    z : numpy array
+        rank-sum statistic of each row.
+    p : numpy array
+        two-sided p-value of each row, NaN if one of the samples is empty.
+    """
+    ranks, ties = rank_rows(np.concatenate((x, y), axis=1))
+    n1 = np.count_nonzero(~np.isnan(x), axis=1)
+    n2 = np.count_nonzero(~np.isnan(y), axis=1)
+    n = n1 + n2
+
+    rank_sum = np.nansum(ranks[:, : x.shape[1]], axis=1)
+    expected = n1 * (n + 1) / 2
+    variance = n1 * n2 * (n + 1) / 12
+    if tie_correction:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            variance = variance - n1 * n2 * ties / (12 * n * (n - 1))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (rank_sum - expected) / np.sqrt(variance)
+    p = 2 * norm.sf(np.abs(z))
+    p[(n1 == 0) | (n2 == 0)] = np.nan
+    return z, p
+
+
+def permutation_ranksums_rows(
+    x, y, n_permutations=9999, rng=None, max_elements=10_000_000
+):
+    """
+    Permutation version of the rank-sum test, vectorized across rows.
+
+    The observed rank sum of x is compared with the rank sums of random
+    relabellings of the pooled samples of each row. Suited to small samples,
+    for which the normal approximation of `ranksums_rows` is poor.
+
+    Parameters
+    ----------
+    x : numpy array
+        (n_rows, n1) first samples, padded with NaNs.
+    y : numpy array
+        (n_rows, n2) second samples, padded with NaNs.
+    n_permutations : int, optional
+        number of random relabellings. The default is 9999.
+    rng : numpy.random.Generator or int, optional
+        random generator or seed. The default is None.
+    max_elements : int, optional
+        maximum number of elements of the (permutations, rows, values) array
+        processed at once. The default is 10_000_000.
+
+    Returns
+    -------
+    p : numpy array
+        two-sided p-value of each row, NaN if one of the samples is empty.
+    """
+    rng = np.random.default_rng(rng)
+    ranks, _ = rank_rows(np.concatenate((x, y), axis=1))
+    valid = ~np.isnan(ranks)
+    ranks = np.where(valid, ranks, 0.0)
+    n1 = np.count_nonzero(~np.isnan(x), axis=1)
+    n = valid.sum(axis=1)
+
+    expected = n1 * (n + 1) / 2
+    observed = np.abs(ranks[:, : x.shape[1]].sum(axis=1) - expected)
+    # relative tolerance for rank sums equal to the observed one
+    observed = observed - 1e-9 * np.maximum(expected, 1)
+
+    n_rows, n_values = ranks.shape
+    batch_size = max(1, max_elements // max(n_rows * n_values, 1))
+    rows = np.arange(n_rows)
+    last = np.maximum(n1 - 1, 0)
+    count = np.zeros(n_rows)
+
+    for start in range(0, n_permutations, batch_size):
+        n_batch = min(batch_size, n_permutations - start)
+        # random order of the valid values of each row; the first n1 form group 1
+        keys = rng.random((n_batch, n_rows, n_values))
+        keys[:, ~valid] = np.inf
+        order = np.argsort(keys, axis=-1)
+        sums = np.cumsum(np.take_along_axis(ranks[None], order, axis=-1), axis=-1)
+        sums = np.where(n1 > 0, sums[:, rows, last], 0.0)
+        count += np.sum(np.abs(sums - expected) >= observed, axis=0)
+
+    p = (count + 1) / (n_permutations + 1)
+    p[(n1 == 0) | (n - n1 == 0)] = np.nan
+    return p
+
+
 def Wilcoxon_matrix(
     m1,
     m2,
     uniqueBarcodes,
+    mode="ranksums",
+    n_permutations=9999,
+    rng=None,
+    max_elements=10_000_000,
 ):
-
+    """
+    Wilcoxon rank-sum test between the single-cell distributions of two matrices.
+
+    All the pairs of the upper triangle are tested at once, in stacked arrays
+    padded with NaNs, and the p-values are mirrored to the lower triangle.
+
+    Parameters
+    ----------
+    m1 : numpy array
+        (n_bins, n_bins, n_cells1) single-cell PWD matrix.
+    m2 : numpy array
+        (n_bins, n_bins, n_cells2) single-cell PWD matrix.
+    uniqueBarcodes : list
+        barcodes of the matrices.
+    mode : str, optional
+        'ranksums' (normal approximation with tie correction) or 'permutation'.
+        The default is "ranksums".
+    n_permutations : int, optional
+        number of permutations in 'permutation' mode. The default is 9999.
+    rng : numpy.random.Generator or int, optional
+        random generator or seed for 'permutation' mode. The default is None.
+    max_elements : int, optional
+        maximum number of elements processed at once. The default is 10_000_000.
+
+    Returns
+    -------
+    result : numpy array
+        (n_bins, n_bins) matrix of p-values, with zeros on the diagonal.
+    """
     nbins = len(uniqueBarcodes)
     result = np.zeros((nbins, nbins))
+    rows, cols = np.triu_indices(nbins, k=1)
+
+    rng = np.random.default_rng(rng)
+    chunk = max(1, max_elements // max(m1.shape[2] + m2.shape[2], 1))
+
+    for start in range(0, len(rows), chunk):
+        i, j = rows[start : start + chunk], cols[start : start + chunk]
+        x = np.asarray(m1[i, j, :], dtype=float)
+        y = np.asarray(m2[i, j, :], dtype=float)
+        if mode == "permutation":
+            p = permutation_ranksums_rows(
+                x, y, n_permutations=n_permutations, rng=rng, max_elements=max_elements
+            )
+        else:
+            _, p = ranksums_rows(x, y)
+        result[i, j] = p
 
-    for i in range(nbins):
-        for j in range(nbins):
-            if i != j:
-                x, y = m1[i, j, :], m2[i, j, :]
-                x = x[~np.isnan(x)]
-                y = y[~np.isnan(y)]
-                a, p = ranksums(x, y)  # , nan_policy='omit')
-                result[i, j] = p
+    result[cols, rows] = result[rows, cols]
     return result
 
 
@@ -172,6 +370,8 @@ def plot_Wilcoxon_matrix(
     plottingFileExtension=".png",
     n_cells=0,
     cmap="RdBu",
+    mode="ranksums",
+    n_permutations=9999,
 ):
 
     cmtitle = "log10(p-value)"
@@ -186,6 +386,8 @@ def plot_Wilcoxon_matrix(
         m1,
         m2,
         uniqueBarcodes,
+        mode=mode,
+        n_permutations=n_permutations,
     )
 
     fig1 = plt.figure(constrained_layout=True)
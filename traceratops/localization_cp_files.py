@@ -7,6 +7,12 @@ import argparse
 import os
 import re
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ioctl request cloning a whole file on Linux filesystems supporting reflinks
+FICLONE = 0x40049409
+STAGING_MODES = ["copy", "hardlink", "symlink", "reflink"]
 
 
 def parse_arguments():
@@ -20,29 +26,36 @@ def parse_arguments():
     parser.add_argument(
         "--destination_folder", required=True, help="Destination folder path"
     )
+    parser.add_argument(
+        "--mode",
+        default="copy",
+        choices=STAGING_MODES,
+        help="copy, hardlink, symlink or reflink (copy-on-write clone, falls back to copy). Default: copy",
+    )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        default=4,
+        help="Number of threads copying files in parallel. Default: 4",
+    )
     return parser
 
 
-def copy_and_rename_files(file_list, destination_folder):
+def plan_copies(file_list, destination_folder):
     """
-    Copy files from the list to the destination folder,
-    renaming them to include the unique folder name.
+    Builds the destination path of each file, renamed to include the unique
+    folder name.
 
     Args:
         file_list (list): List of file paths to copy
         destination_folder (str): Destination folder path
-    """
-    # Create destination folder if it doesn't exist
-    if not os.path.exists(destination_folder):
-        os.makedirs(destination_folder)
-        print(f"Created destination folder: {destination_folder}")
 
-    if not file_list:
-        print("No files provided to copy")
-        return
-
-    print(f"Processing {len(file_list)} files")
+    Returns:
+        list: (source, destination) path pairs
 
+    Raises:
+        ValueError: if several files are renamed to the same destination
+    """
     # Find the common pattern and the variable part (folder name)
     # We'll analyze the first file to determine the pattern
     sample_paths = [file_list[0]]
@@ -74,6 +87,7 @@ def copy_and_rename_files(file_list, destination_folder):
             varying_index = -3  # Default to 3rd from last segment if we can't determine
 
     # Process each file
+    copies = []
     for file_path in file_list:
         # Extract the variable folder name
         path_parts = file_path.split("/")
@@ -90,15 +104,149 @@ def copy_and_rename_files(file_list, destination_folder):
         # Full path for the destination file
         dest_path = os.path.join(destination_folder, new_filename)
 
-        # Copy the file
-        shutil.copy2(file_path, dest_path)
-        print(f"Copied: {file_path} -> {dest_path}")
+        copies.append((file_path, dest_path))
+
+    # Files staged in parallel to the same destination would overwrite each other
+    sources = {}
+    for file_path, dest_path in copies:
+        sources.setdefault(dest_path, []).append(file_path)
+    duplicates = {dest: srcs for dest, srcs in sources.items() if len(srcs) > 1}
+    if duplicates:
+        conflicts = "\n".join(
+            f"  {dest} <- {', '.join(srcs)}" for dest, srcs in duplicates.items()
+        )
+        raise ValueError(
+            f"{len(duplicates)} destination(s) would receive several files, "
+            f"nothing was copied:\n{conflicts}"
+        )
+
+    return copies
+
+
+def is_unchanged(source, destination, mode="copy"):
+    """
+    Checks whether destination already holds source.
+
+    Symbolic links must point to the source. Copies must have the same size
+    and modification time (to the second) and must not be a hard link to the
+    source, so that editing them leaves the source untouched. Hard links are
+    unchanged if they point to the source, or if they are a copy made when
+    linking failed.
+    """
+    if mode == "symlink":
+        return os.path.islink(destination) and os.readlink(
+            destination
+        ) == os.path.abspath(source)
+    if not os.path.exists(destination) or os.path.islink(destination):
+        return False
+    if os.path.samefile(source, destination):
+        return mode == "hardlink"
+    src, dst = os.stat(source), os.stat(destination)
+    return src.st_size == dst.st_size and int(src.st_mtime) == int(dst.st_mtime)
+
+
+def reflink(source, destination):
+    """
+    Clones source into destination without copying data (copy-on-write).
+    Raises OSError if the filesystem does not support it.
+    """
+    import fcntl
+
+    with open(source, "rb") as f_src, open(destination, "wb") as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        except OSError:
+            f_dst.close()
+            os.remove(destination)
+            raise
+    shutil.copystat(source, destination)
+
+
+def stage_file(source, destination, mode="copy"):
+    """
+    Copies or links one file, unless destination already holds it.
+
+    Args:
+        source (str): file to stage
+        destination (str): destination path
+        mode (str): copy, hardlink, symlink or reflink
+
+    Returns:
+        tuple: (action, number of bytes copied), action being 'skipped',
+        'copied', 'linked' or 'cloned'
+    """
+    if is_unchanged(source, destination, mode):
+        return "skipped", 0
+    if os.path.lexists(destination):
+        os.remove(destination)
+
+    try:
+        if mode == "hardlink":
+            os.link(source, destination)
+            return "linked", 0
+        if mode == "symlink":
+            os.symlink(os.path.abspath(source), destination)
+            return "linked", 0
+        if mode == "reflink":
+            reflink(source, destination)
+            return "cloned", 0
+    except (OSError, ImportError) as error:
+        print(f"! Could not {mode} {source} ({error}), copying instead")
+
+    shutil.copy2(source, destination)
+    return "copied", os.path.getsize(destination)
+
+
+def copy_and_rename_files(file_list, destination_folder, mode="copy", n_workers=4):
+    """
+    Copy files from the list to the destination folder,
+    renaming them to include the unique folder name.
+
+    Files are staged in a pool of threads, and files already present with
+    the same size and modification time are skipped.
+
+    Args:
+        file_list (list): List of file paths to copy
+        destination_folder (str): Destination folder path
+        mode (str): copy, hardlink, symlink or reflink
+        n_workers (int): number of threads
+    """
+    # Create destination folder if it doesn't exist
+    if not os.path.exists(destination_folder):
+        os.makedirs(destination_folder)
+        print(f"Created destination folder: {destination_folder}")
+
+    if not file_list:
+        print("No files provided to copy")
+        return
+
+    print(f"Processing {len(file_list)} files")
+    copies = plan_copies(file_list, destination_folder)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        sources, destinations = zip(*copies)
+        results = executor.map(stage_file, sources, destinations, [mode] * len(copies))
+        actions, number_bytes = {}, 0
+        for (file_path, dest_path), (action, n_bytes) in zip(copies, results):
+            print(f"{action.capitalize()}: {file_path} -> {dest_path}")
+            actions[action] = actions.get(action, 0) + 1
+            number_bytes += n_bytes
+    elapsed = time.perf_counter() - start
+
+    summary = ", ".join(f"{count} {action}" for action, count in actions.items())
+    print(
+        f"$ {summary} in {elapsed:.2f} s: {number_bytes / 1e6:.1f} MB copied"
+        f" ({number_bytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s)"
+    )
 
 
 def main():
     parser = parse_arguments()
     args = parser.parse_args()
-    copy_and_rename_files(args.files, args.destination_folder)
+    copy_and_rename_files(
+        args.files, args.destination_folder, mode=args.mode, n_workers=args.n_workers
+    )
     print("Operation completed!")
 
 
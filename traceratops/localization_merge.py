@@ -8,24 +8,47 @@ and related metadata for microscopy or imaging analysis.
 The script takes localization files as input via stdin (e.g., through piping or redirection)
 and merges them into a single output file. It preserves all data from the original files
 while combining them into one comprehensive table.
+
+Input files can be parsed in parallel (--n_workers); their columns are copied once
+into preallocated arrays and the merged table is written in a single pass, either
+as ECSV text or in a binary columnar format (--format fits or parquet).
 """
 
 import argparse
 import os
 import select
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from astropy.table import Column, MaskedColumn, Table
+from astropy.utils import metadata
 
 from traceratops.core.localization_table import LocalizationTable
 
+OUTPUT_FORMATS = {"ecsv": "ascii.ecsv", "fits": "fits", "parquet": "parquet"}
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument(
         "-o",
         "--output_file",
-        help="Output File name. Default = merged_localizations.ecsv",
+        help="Output File name, with the extension of --format. Default = merged_localizations.<format>",
     )
     parser.add_argument("-O", "--output_folder", help="Output File name. Default = ./")
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        default=1,
+        help="Number of processes used to read input files. Default = 1",
+    )
+    parser.add_argument(
+        "--format",
+        default="ecsv",
+        choices=list(OUTPUT_FORMATS),
+        help="Output format: ecsv (text), fits or parquet (binary, requires pyarrow). Default = ecsv",
+    )
     return parser
 
 
@@ -35,10 +58,27 @@ def create_dict_args(args):
         p["outputFolder"] = args.output_folder
     else:
         p["outputFolder"] = "."
+    p["n_workers"] = args.n_workers
+    p["format"] = args.format
+    if p["format"] == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("! Error: --format parquet requires the pyarrow package")
+            sys.exit(-1)
     if args.output_file:
         p["output_file"] = args.output_file
+        ext = os.path.splitext(args.output_file)[1]
+        if not ext:
+            p["output_file"] = f"{args.output_file}.{p['format']}"
+            print(f"$ No extension in output file name, saving to {p['output_file']}")
+        elif ext.lower() != "." + p["format"]:
+            print(
+                f"! Error: output file {args.output_file} does not match --format {p['format']}"
+            )
+            sys.exit(-1)
     else:
-        p["output_file"] = "merged_localizations.ecsv"
+        p["output_file"] = f"merged_localizations.{p['format']}"
     p["loc_files"] = []
     if select.select(
         [
@@ -57,29 +97,111 @@ def create_dict_args(args):
     return p
 
 
-def appends_traces(loc_files):
-    new_loc_table = LocalizationTable()
-    number_loc_tables = 0
-    # iterates over traces in folder
+def read_localizations(loc_file):
+    """
+    Reads one localization file, in a worker process if called from a pool.
+
+    Parameters
+    ----------
+    loc_file : str
+        localization table, in any format readable by astropy.
+
+    Returns
+    -------
+    astropy Table
+        localization table.
+    """
+    if os.path.splitext(loc_file)[1].lower() == ".ecsv":
+        table, _ = LocalizationTable().load(loc_file)
+    else:
+        table = Table.read(loc_file)
+        table.convert_bytestring_to_unicode()
+    print(f" $ read loc file {loc_file} with {len(table)} localizations")
+    return table
+
+
+def concatenate_tables(tables):
+    """
+    Concatenates tables with identical column names into preallocated columns.
+
+    Each row is copied once. Column attributes are taken from the first table,
+    dtypes are promoted across tables, and the metadata are merged as in vstack.
+
+    Parameters
+    ----------
+    tables : list of astropy Tables
+        tables to concatenate.
+
+    Returns
+    -------
+    astropy Table
+        concatenated table.
+    """
+    names = tables[0].colnames
+    for table in tables[1:]:
+        if table.colnames != names:
+            raise ValueError(
+                f"Columns {table.colnames} differ from the first table {names}"
+            )
+
+    offsets = np.cumsum([0] + [len(table) for table in tables])
+    merged = Table(meta=tables[0].meta.copy())
+    for name in names:
+        first = tables[0][name]
+        dtype = np.result_type(*[table[name].dtype for table in tables])
+        data = np.empty((offsets[-1],) + first.shape[1:], dtype=dtype)
+        masked = any(hasattr(table[name], "mask") for table in tables)
+        mask = np.zeros(data.shape, dtype=bool) if masked else None
+        for table, start, end in zip(tables, offsets[:-1], offsets[1:]):
+            column = table[name]
+            data[start:end] = getattr(column, "data", column)
+            if masked and hasattr(column, "mask"):
+                mask[start:end] = column.mask
+
+        column_class = MaskedColumn if masked else Column
+        kwargs = {"mask": mask} if masked else {}
+        merged[name] = column_class(
+            data,
+            name=name,
+            unit=first.info.unit,
+            description=first.info.description,
+            format=first.info.format,
+            meta=first.info.meta,
+            **kwargs,
+        )
+
+    for table in tables[1:]:
+        merged.meta = metadata.merge(
+            merged.meta, table.meta, metadata_conflicts="silent"
+        )
+    return merged
+
+
+def appends_traces(loc_files, n_workers=1):
+    """
+    Reads localization files, in parallel if n_workers > 1, and concatenates them.
+
+    Returns
+    -------
+    collected_tables : astropy Table
+        merged localizations.
+    number_loc_tables : int
+        number of files merged.
+    """
     for loc_file in loc_files:
         print(f"$ loc file to process: {loc_file}")
-        # reads new trace
-        new_table, _ = new_loc_table.load(loc_file)
-        # adds it to existing trace collection
-        if number_loc_tables == 0:
-            collected_tables = new_table
-        else:
-            collected_tables = new_loc_table.append(collected_tables, new_table)
-        number_loc_tables += 1
-        print(f" $ appended loc file with {len(new_table)} localizations")
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            tables = list(executor.map(read_localizations, loc_files))
+    else:
+        tables = [read_localizations(loc_file) for loc_file in loc_files]
+    collected_tables = concatenate_tables(tables)
     print(f" $ Merged loc file will contain {len(collected_tables)} localizations")
-    return collected_tables, number_loc_tables
+    return collected_tables, len(tables)
 
 
-def load_localizations(loc_files=[]):
-    if len(loc_files) > 1:
-        # user provided a list of files to concatenate
-        collected_tables, number_loc_tables = appends_traces(loc_files)
+def load_localizations(loc_files=[], n_workers=1):
+    collected_tables, number_loc_tables = appends_traces(loc_files, n_workers=n_workers)
     print(f"Read and accumulated {number_loc_tables} localization files")
     return collected_tables, number_loc_tables
 
@@ -92,13 +214,16 @@ def run(p):
         os.mkdir(p["outputFolder"])
         print("Folder created: {}".format(p["outputFolder"]))
     # loads and merges traces
-    collected_tables, number_loc_tables = load_localizations(loc_files=p["loc_files"])
+    collected_tables, number_loc_tables = load_localizations(
+        loc_files=p["loc_files"], n_workers=p["n_workers"]
+    )
     # saves merged trace table
-    output_file = p["output_file"]
+    output_file = os.path.join(p["outputFolder"], p["output_file"])
     localizations.save(
         output_file,
         collected_tables,
         comments="appended_loc_files=" + str(number_loc_tables),
+        format=OUTPUT_FORMATS[p["format"]],
     )
     print(f"$ Saved merged file to: {output_file}")
     print("Finished execution")
@@ -16,6 +16,8 @@ import sys
 import matplotlib.pyplot as plt
 import numpy as np
 
+from traceratops.core.him_matrix_operations import load_sc_matrix
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description=__doc__)
@@ -165,7 +167,11 @@ def main():
             print(f"File not found: {npy_file}")
             continue
         print(f"Loading matrix: {npy_file}")
-        matrix = np.load(npy_file)
+        try:
+            matrix = load_sc_matrix(npy_file, ndim=2)
+        except ValueError as e:
+            print(f"Skipping {npy_file}: {e}")
+            continue
         anchor = extract_anchor(npy_file)
         print(f"$ anchor: {anchor}")
         label_map = (
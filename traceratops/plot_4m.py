@@ -62,46 +62,52 @@ def parse_arguments():
     return parser
 
 
-def compute_colocalization(trace_table, anchor_barcode, distance_cutoff):
-    """Computes the frequency of colocalization between the anchor barcode and all other barcodes."""
+def compute_colocalization(
+    trace, anchor_barcode, distance_cutoff, selected_traces=None
+):
+    """
+    Computes the frequency of colocalization between the anchor barcode and all other
+    barcodes, in the traces of trace.trace_index selected by the boolean mask
+    <selected_traces> (all by default).
+    """
     # Make sure we're dealing with a single anchor barcode
     if isinstance(anchor_barcode, list):
         raise TypeError(
             "compute_colocalization expects a single anchor_barcode, not a list"
         )
     barcode_interactions = {}
-    trace_groups = trace_table.group_by("Trace_ID").groups
-    for trace in tqdm(trace_groups, desc="Processing traces"):
-        anchor_positions = trace[trace["Barcode #"] == anchor_barcode]
-        other_barcodes = np.unique(trace["Barcode #"])
-        for barcode in other_barcodes:
+    trace_table = trace.data
+    trace_index = trace.trace_index
+    if selected_traces is None:
+        selected_traces = np.ones(len(trace_index), dtype=bool)
+    traces = trace_index.iterate(
+        trace_table["Barcode #"], trace_table["x"], trace_table["y"], trace_table["z"]
+    )
+    for idx, (_, (barcodes, x, y, z)) in enumerate(
+        tqdm(traces, total=len(trace_index), desc="Processing traces")
+    ):
+        if not selected_traces[idx]:
+            continue
+        positions = np.stack([x, y, z], axis=1)
+        anchor_positions = positions[barcodes == anchor_barcode]
+        if len(anchor_positions) == 0:
+            continue
+
+        # spots closer than the cutoff to any anchor spot
+        distances = np.linalg.norm(
+            positions[:, None] - anchor_positions[None, :], axis=-1
+        )
+        colocalized_barcodes = set(
+            barcodes[np.any(distances < distance_cutoff, axis=1)].tolist()
+        )
+        for barcode in np.unique(barcodes):
             if barcode == anchor_barcode:
                 continue
-            other_positions = trace[trace["Barcode #"] == barcode]
-            if len(anchor_positions) > 0 and len(other_positions) > 0:
-                distances = np.linalg.norm(
-                    np.array(
-                        [
-                            anchor_positions["x"],
-                            anchor_positions["y"],
-                            anchor_positions["z"],
-                        ]
-                    ).T[:, None]
-                    - np.array(
-                        [
-                            other_positions["x"],
-                            other_positions["y"],
-                            other_positions["z"],
-                        ]
-                    ).T,
-                    axis=-1,
-                )
-                colocalized = np.any(distances < distance_cutoff)
-                if barcode not in barcode_interactions:
-                    barcode_interactions[barcode] = [0, 0]
-                barcode_interactions[barcode][1] += 1  # Total occurrences
-                if colocalized:
-                    barcode_interactions[barcode][0] += 1  # Co-localized occurrences
+            if barcode not in barcode_interactions:
+                barcode_interactions[barcode] = [0, 0]
+            barcode_interactions[barcode][1] += 1  # Total occurrences
+            if barcode in colocalized_barcodes:
+                barcode_interactions[barcode][0] += 1  # Co-localized occurrences
     # Compute frequencies
     barcode_frequencies = {
         barcode: (count[0] / count[1] if count[1] > 0 else 0)
@@ -111,22 +117,20 @@ def compute_colocalization(trace_table, anchor_barcode, distance_cutoff):
     return barcode_frequencies
 
 
-def bootstrap_colocalization(
-    trace_table, anchor_barcodes, distance_cutoff, n_bootstrap=100
-):
+def bootstrap_colocalization(trace, anchor_barcodes, distance_cutoff, n_bootstrap=100):
     """Performs bootstrapping to estimate mean and SEM of colocalization frequencies for multiple anchors."""
     # If a single anchor is provided, convert to a list for consistent processing
     if not isinstance(anchor_barcodes, list):
         anchor_barcodes = [anchor_barcodes]
     barcode_samples = {anchor: {} for anchor in anchor_barcodes}
-    trace_ids = np.unique(trace_table["Trace_ID"])
+    trace_ids = trace.trace_index.keys
     for _ in tqdm(range(n_bootstrap), desc="Bootstrapping"):
         sampled_traces = np.random.choice(trace_ids, size=len(trace_ids), replace=True)
-        sampled_table = trace_table[np.isin(trace_table["Trace_ID"], sampled_traces)]
+        selected_traces = np.isin(trace_ids, sampled_traces)
         # Process each anchor barcode separately
         for anchor in anchor_barcodes:
             colocalization = compute_colocalization(
-                sampled_table, anchor, distance_cutoff
+                trace, anchor, distance_cutoff, selected_traces=selected_traces
             )
             for barcode, frequency in colocalization.items():
                 if barcode not in barcode_samples[anchor]:
@@ -234,9 +238,9 @@ def main():
             trace = ChromatinTraceTable()
             trace.initialize()
 
-            trace.load(trace_file)
+            trace.load(trace_file, encode_ids=True)
             barcode_means, barcode_sems = bootstrap_colocalization(
-                trace.data, args.anchors, args.cutoff, args.bootstrapping_cycles
+                trace, args.anchors, args.cutoff, args.bootstrapping_cycles
             )
             plot_frequencies(
                 barcode_means,
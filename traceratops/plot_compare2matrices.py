@@ -76,6 +76,18 @@ def parse_arguments():
 
     parser.add_argument("--cMin", help="Colormap min cscale. Default: 0")
     parser.add_argument("--cmap", help="Colormap. Default: coolwarm")
+    parser.add_argument(
+        "--wilcoxon_mode",
+        default="ranksums",
+        choices=["ranksums", "permutation"],
+        help="Wilcoxon test: normal approximation (ranksums) or permutation test for small samples. Default: ranksums",
+    )
+    parser.add_argument(
+        "--n_permutations",
+        type=int,
+        default=9999,
+        help="Number of permutations of the permutation test. Default: 9999",
+    )
     return parser
 
 
@@ -168,6 +180,8 @@ def create_dict_args(args):
         run_parameters["cMin"] = float(args.cMin)
     else:
         run_parameters["cMin"] = 0.0
+    run_parameters["wilcoxon_mode"] = args.wilcoxon_mode
+    run_parameters["n_permutations"] = args.n_permutations
     print("Input parameters:{}".format(run_parameters))
     return run_parameters
 
@@ -307,6 +321,8 @@ def main():
                 plottingFileExtension=run_parameters["plottingFileExtension"],
                 n_cells=n_cells1 + n_cells2,
                 cmap=run_parameters["cmap"],
+                mode=run_parameters["wilcoxon_mode"],
+                n_permutations=run_parameters["n_permutations"],
             )
 
     else:
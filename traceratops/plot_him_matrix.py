@@ -8,18 +8,20 @@ This script calculates and plots matrices (PWD and proximity) from:
 
 
 import argparse
-import itertools
 import os
 import sys
 
 import numpy as np
 
 from traceratops.core.him_matrix_operations import (
+    calculate_contact_probability_matrices,
     calculate_contact_probability_matrix,
     calculate_ensemble_pwd_matrix,
     calculate_nan_matrix,
+    load_sc_matrix,
     plot_him_matrix,
     plot_nan_matrix,
+    shuffle_matrix,
 )
 
 
@@ -89,6 +91,19 @@ Outputs:
     parser_proximity.add_argument(
         "-T", "--threshold", help="Proximity threshold in µm", default=0.25, type=float
     )
+    parser_proximity.add_argument(
+        "--thresholds",
+        help="Sweep mode: list of proximity thresholds in µm (e.g. 0.1 0.2 0.3). One matrix, figure and NPY file is produced per threshold, from a single pass over the data.",
+        nargs="+",
+        type=float,
+        default=None,
+    )
+    parser_proximity.add_argument(
+        "--stack",
+        help="In sweep mode, also save all matrices and thresholds in a single NPZ file.",
+        action="store_true",
+        default=False,
+    )
     parser_proximity.add_argument(
         "-K",
         "--keep_nan",
@@ -143,11 +158,12 @@ def create_output_folder(folder_path):
     print(f"Output path: {folder_path}")
 
 
-def load_matrix(matrix_path):
+def load_matrix(matrix_path, unique_barcodes=None, mmap_mode="r"):
     if not os.path.exists(matrix_path):
         raise ValueError(f"File not found: {matrix_path}")
+    matrix = load_sc_matrix(matrix_path, unique_barcodes, mmap_mode=mmap_mode)
     print(f"$ Matrix loaded: {matrix_path}")
-    return np.load(matrix_path)
+    return matrix
 
 
 def load_barcodes(barcodes_path):
@@ -157,28 +173,11 @@ def load_barcodes(barcodes_path):
     return unique_barcodes
 
 
-def shuffle_matrix(matrix, index):
-    new_size = len(index)
-    new_matrix = np.zeros((new_size, new_size, len(matrix[0][0])))
-
-    if new_size > matrix.shape[0]:
-        raise ValueError(
-            f"Error: shuffle size {new_size} is larger than matrix dimensions {matrix.shape[0]}\nShuffle: {index}"
-        )
-    for i, j in itertools.product(range(new_size), range(new_size)):
-        if index[i] < matrix.shape[0] and index[j] < matrix.shape[0]:
-            new_matrix[i, j] = matrix[index[i], index[j]]
-        else:
-            raise ValueError(
-                f"Out of index; matrix.shape[0]: {matrix.shape[0]} |i: {i} |index[i]: {index[i]} |j: {j} |index[j]: {index[j]}"
-            )
-    return new_matrix
-
-
 def new_shuffle_matrix(shuffle_csl, barcode_list, sc_matrix):
     index = [barcode_list.index(int(i)) for i in shuffle_csl.split(",")]
     new_barcode_list = [barcode_list[i] for i in index]
-    sc_matrix_shuffled = shuffle_matrix(sc_matrix, index)
+    # the permutation is applied when the matrix is read, without copying it
+    sc_matrix_shuffled = shuffle_matrix(sc_matrix, index, lazy=True)
     return new_barcode_list, sc_matrix_shuffled
 
 
@@ -198,28 +197,94 @@ def merge_matrices(mode, matrices, threshold=None, remove_nan=None):
 
 
 def apply_nan_threshold(matrix, nan_matrix, threshold):
-    n_barcodes = matrix.shape[0]
-    for i in range(n_barcodes):
-        for j in range(n_barcodes):
-            if nan_matrix[i][j] > threshold:
-                matrix[i][j] = np.nan
+    matrix[nan_matrix > threshold] = np.nan
     return matrix
 
 
+def sweep_thresholds(args, sc_matrices, u_barcodes, nan_matrix):
+    """
+    Calculates, plots and saves one proximity matrix per threshold of
+    ``args.thresholds`` from a single pass over the single-cell matrices.
+
+    Returns
+    -------
+    numpy array
+        (n_thresholds, n_barcodes, n_barcodes) proximity matrices.
+    """
+    rm_nan = not args.keep_nan
+    n_cells = sc_matrices.shape[2]
+    print(f"$ calculating contact probability matrices for {args.thresholds}")
+    matrices = calculate_contact_probability_matrices(
+        sc_matrices, 1, args.thresholds, remove_nan=rm_nan
+    )
+    for threshold, matrix_to_plot in zip(args.thresholds, matrices):
+        if args.nan_threshold:
+            apply_nan_threshold(matrix_to_plot, nan_matrix, args.nan_threshold)
+        plot_path = plot_him_matrix(
+            matrix_to_plot,
+            u_barcodes,
+            input_filename=args.matrix,
+            output_folder=args.output,
+            file_format=args.plot_format,
+            mode="proximity",
+            n_cells=n_cells,
+            font_size=args.fontsize,
+            proximity_threshold=threshold,
+            remove_nan=rm_nan,
+            cmtitle="proximity frequency",
+            c_min=args.c_min,
+            c_max=args.c_max,
+            c_m=args.c_map,
+        )
+        np.save(plot_path, matrix_to_plot)
+        print(f"Output data: {plot_path}.npy")
+
+    if args.stack:
+        input_basename = os.path.basename(args.matrix).split(".")[0]
+        norm_txt = "_norm" if rm_nan else ""
+        stack_path = os.path.join(
+            args.output, f"Fig_{input_basename}_proximity{norm_txt}_sweep.npz"
+        )
+        np.savez(
+            stack_path,
+            thresholds=np.asarray(args.thresholds),
+            matrices=matrices,
+            barcodes=np.asarray(u_barcodes),
+        )
+        print(f"Output stack: {stack_path}")
+    return matrices
+
+
 def main():
     parser = parse_arguments()
     args = parser.parse_args()
     check_required_arg(args, parser)
     create_output_folder(args.output)
-    sc_matrices = load_matrix(args.matrix)
+    if args.thresholds and args.mode != "proximity":
+        print("Error: --thresholds can only be used with --mode proximity.")
+        sys.exit(-1)
     u_barcodes = load_barcodes(args.barcodes)
+    sc_matrices = load_matrix(args.matrix, u_barcodes)
     if args.shuffle:
         u_barcodes, sc_matrices = new_shuffle_matrix(
             args.shuffle, u_barcodes, sc_matrices
         )
     rm_nan = not args.keep_nan
-    matrix_to_plot = merge_matrices(args.mode, sc_matrices, args.threshold, rm_nan)
     nan_matrix = calculate_nan_matrix(sc_matrices)
+    if args.thresholds:
+        plot_nan_matrix(
+            nan_matrix,
+            u_barcodes,
+            input_filename=args.matrix,
+            output_folder=args.output,
+            file_format=args.plot_format,
+            n_cells=sc_matrices.shape[2],
+            font_size=args.fontsize,
+            remove_nan=rm_nan,
+        )
+        sweep_thresholds(args, sc_matrices, u_barcodes, nan_matrix)
+        return
+    matrix_to_plot = merge_matrices(args.mode, sc_matrices, args.threshold, rm_nan)
     if args.nan_threshold:
         matrix_to_plot = apply_nan_threshold(
             matrix_to_plot, nan_matrix, args.nan_threshold
@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Compare PWD matrices from two experiments
+Compare PWD matrices from two or more experiments
 *- pearson correlation in ensemble *
 *- also now plots violin diagrams with the distribution of proximities/distances for each dataset*
+*- N x N tables of Pearson, Spearman and rank-sum statistics for any number of datasets*
 - make sure to map barcodes to allow for experiments with different barcode combinations [TODO]
 - same but single cell [TODO]
 """
 
 import argparse
+import os
 import sys
 
 import matplotlib.pyplot as plt
@@ -19,6 +21,7 @@ import seaborn as sns
 from traceratops.core.him_matrix_operations import (
     calculate_contact_probability_matrix,
     calculate_ensemble_pwd_matrix,
+    load_sc_matrix,
 )
 
 sns.set(font_scale=2)
@@ -28,6 +31,11 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("--input1", help="Name of first input trace file.")
     parser.add_argument("--input2", help="Name of second input trace file.")
+    parser.add_argument(
+        "--inputs",
+        nargs="+",
+        help="Names of two or more input matrix files, compared all against all. Overrides --input1 and --input2.",
+    )
     parser.add_argument(
         "--output", help="Name of output plot. Default: scatter_plot.png"
     )
@@ -85,9 +93,10 @@ def create_dict_args(args):
         p["scale"] = args.scale
     else:
         p["scale"] = "linear"
-    p["input_files"] = list()
-    p["input_files"].append(p["input1"])
-    p["input_files"].append(p["input2"])
+    if args.inputs:
+        p["input_files"] = list(args.inputs)
+    else:
+        p["input_files"] = [f for f in (p["input1"], p["input2"]) if f is not None]
     print("Input parameters\n" + "=" * 16)
     for item in p.keys():
         print("{}-->{}".format(item, p[item]))
@@ -177,60 +186,175 @@ def plots_distributions(x, y, output_filename="violin_plot.png", y_axis_label="c
 def parses_matrix_to_vector(matrix):
     # this version instead only attributes non-diagonal elements
     matrix_size = matrix.shape[0]
-    vector = []
-    for i in range(matrix_size):
-        for j in range(i + 1, matrix_size):
-            if np.isnan(matrix[i, j]):
-                vector.append(0.0)  # otherwise Pearson cannot be calculated
-            else:
-                vector.append(matrix[i, j])
+    rows, cols = np.triu_indices(matrix_size, k=1)
+    vector = np.nan_to_num(matrix[rows, cols], nan=0.0)  # otherwise Pearson fails
     print(
         f"$ Converted {matrix_size}x{matrix_size} matrix to vector of length: {len(vector)}"
     )
-    return np.array(vector)
+    return vector
 
 
 def load_matrix(file):
-    return np.load(file)
+    """
+    Memory-maps a single-cell matrix read-only and checks its shape.
 
+    Parameters
+    ----------
+    file : str
+        .npy file with a (n_barcodes, n_barcodes, n_cells) matrix.
+
+    Returns
+    -------
+    numpy memmap
+        read-only view of the file.
+    """
+    return load_sc_matrix(file)
+
+
+def calculates_ensemble_matrix(matrix, mode="median", max_distance=np.inf):
+    """
+    Calculates the ensemble matrix of a single-cell matrix without modifying it.
+
+    Distances above max_distance are ignored. In median mode, the matrix is
+    read by blocks of rows so that memory-mapped files are never fully loaded.
+
+    Parameters
+    ----------
+    matrix : numpy array
+        (n_barcodes, n_barcodes, n_cells) single-cell matrix.
+    mode : str, optional
+        'median', 'KDE' or 'proximity'. The default is "median".
+    max_distance : float, optional
+        upper distance threshold. The default is np.inf.
+
+    Returns
+    -------
+    numpy array
+        (n_barcodes, n_barcodes) ensemble matrix.
+    """
+    n_barcodes, _, n_cells = matrix.shape
+
+    if mode == "median":
+        mean_sc_matrix = np.empty((n_barcodes, n_barcodes))
+        block = max(1, 10_000_000 // max(n_barcodes * n_cells, 1))
+        for start in range(0, n_barcodes, block):
+            rows = np.array(matrix[start : start + block], dtype=float)
+            rows[rows > max_distance] = np.nan
+            mean_sc_matrix[start : start + block] = np.nanmedian(rows, axis=2)
+        return mean_sc_matrix
+
+    matrix = np.array(matrix, dtype=float)
+    matrix[matrix > max_distance] = np.nan
+    if "proximity" in mode:
+        return calculate_contact_probability_matrix(matrix, 1.0)
+
+    mean_sc_matrix, _ = calculate_ensemble_pwd_matrix(
+        matrix, 1.0, range(n_cells), mode=mode
+    )
+    return mean_sc_matrix
+
+
+def calculates_ensemble_matrices(files, mode="median", max_distance=np.inf, cache=None):
+    """
+    Calculates the ensemble matrix of each file once.
+
+    Parameters
+    ----------
+    files : list of str
+        .npy files with single-cell matrices.
+    mode : str, optional
+        'median', 'KDE' or 'proximity'. The default is "median".
+    max_distance : float, optional
+        upper distance threshold. The default is np.inf.
+    cache : dict, optional
+        ensembles already calculated, keyed by (file, mode, max_distance) and
+        updated in place. The default is None.
+
+    Returns
+    -------
+    list of numpy arrays
+        ensemble matrices, in the order of files.
+    """
+    if cache is None:
+        cache = {}
 
-def calculates_ensemble_matrices(matrices, mode="median", max_distance=2):
     mean_sc_matrices = list()
-    for matrix in matrices:
-        matrix[matrix > max_distance] = np.nan
-        if "proximity" in mode:
-            mean_sc_matrix, n_cells = calculate_contact_probability_matrix(
-                matrix,
-                list(),
-                1.0,
-                norm="n_cells",
+    for file in files:
+        key = (os.path.realpath(file), mode, max_distance)
+        if key not in cache:
+            cache[key] = calculates_ensemble_matrix(
+                load_matrix(file), mode=mode, max_distance=max_distance
             )
-        else:
-            cells_to_plot = range(matrix.shape[2])
-            mean_sc_matrix, _ = calculate_ensemble_pwd_matrix(
-                matrix, 1.0, cells_to_plot, mode=mode
-            )
-        mean_sc_matrices.append(mean_sc_matrix)
-    return mean_sc_matrices
-
+        mean_sc_matrices.append(cache[key])
 
-def common_member(a, b):
-    result = [i for i in a if i in b]
-    return result
+    shapes = {matrix.shape for matrix in mean_sc_matrices}
+    if len(shapes) > 1:
+        raise ValueError(f"matrices have different numbers of barcodes: {shapes}")
+    return mean_sc_matrices
 
 
 def filters_zero_values(x, y):
     """
     finds the list of common indices in these arrays that contain nonzero values
     """
-    # identifies positions with zeros
-    non_zero_indices_x = list(np.nonzero(x)[0])
-    non_zero_indices_y = list(np.nonzero(y)[0])
-    non_zero_consensous = common_member(non_zero_indices_x, non_zero_indices_y)
-    # print(non_zero_consensous)
-    x = x[non_zero_consensous]
-    y = y[non_zero_consensous]
-    return x, y
+    non_zero = (x != 0) & (y != 0)
+    return x[non_zero], y[non_zero]
+
+
+def compare_vectors(vectors):
+    """
+    Compares all pairs of ensemble vectors.
+
+    Each pair is compared on the positions where both vectors are non-zero.
+
+    Parameters
+    ----------
+    vectors : list of numpy arrays
+        upper triangles of the ensemble matrices.
+
+    Returns
+    -------
+    dict
+        (n_datasets, n_datasets) tables of 'pearson' and 'spearman'
+        correlations and of 'ranksums' p-values.
+    """
+    n_datasets = len(vectors)
+    tables = {name: np.eye(n_datasets) for name in ("pearson", "spearman", "ranksums")}
+
+    for i, j in zip(*np.triu_indices(n_datasets, k=1)):
+        x, y = filters_zero_values(vectors[i], vectors[j])
+        if len(x) > 1:
+            values = (
+                calculates_pearson_correlation(x, y),
+                scipy.stats.spearmanr(x, y)[0],
+                scipy.stats.ranksums(x, y)[1],
+            )
+        else:
+            values = (np.nan,) * 3
+        for name, value in zip(tables, values):
+            tables[name][i, j] = tables[name][j, i] = value
+    return tables
+
+
+def save_tables(tables, labels, output_filename):
+    """
+    Saves and prints the comparison tables as csv files.
+
+    Parameters
+    ----------
+    tables : dict
+        tables returned by compare_vectors.
+    labels : list of str
+        names of the datasets.
+    output_filename : str
+        name of the output plot, used as root of the csv files.
+    """
+    root = output_filename.split(".")[0]
+    for name, table in tables.items():
+        filename = f"{root}_{name}.csv"
+        np.savetxt(filename, table, delimiter=",", header=",".join(labels))
+        print(f"$ {name}:\n{table}")
+        print(f"> Output table saved as : {filename}")
 
 
 def main_script(p):
@@ -238,16 +362,20 @@ def main_script(p):
     mode = p["mode"]
     files = p["input_files"]
     max_distance = p["max_distance"]
-    matrices = [load_matrix(file) for file in files]
     mean_sc_matrices = calculates_ensemble_matrices(
-        matrices, mode=mode, max_distance=max_distance
+        files, mode=mode, max_distance=max_distance
     )
-    [x, y] = [parses_matrix_to_vector(matrix) for matrix in mean_sc_matrices]
-    x, y = filters_zero_values(x, y)
-    r = calculates_pearson_correlation(x, y)
-    plots_distributions(x, y, y_axis_label=p["mode"], output_filename=p["output"])
-    print("Pearson Correlation Coefficient: ", r)
-    plot_result(x, y, r, p)
+    vectors = [parses_matrix_to_vector(matrix) for matrix in mean_sc_matrices]
+
+    labels = [os.path.splitext(os.path.basename(file))[0] for file in files]
+    save_tables(compare_vectors(vectors), labels, p["output"])
+
+    if len(vectors) == 2:
+        x, y = filters_zero_values(*vectors)
+        r = calculates_pearson_correlation(x, y)
+        plots_distributions(x, y, y_axis_label=p["mode"], output_filename=p["output"])
+        print("Pearson Correlation Coefficient: ", r)
+        plot_result(x, y, r, p)
 
 
 def main():
@@ -258,11 +386,8 @@ def main():
     # [loops over lists of datafolders]
     n_files = len(p["input_files"])
     print(f"> Number of input files: {n_files}")
-    if n_files < 1:
-        print("Please provide 2 input matrices")
-        sys.exit()
-    elif n_files > 2:
-        print("Only two matrices can be processed at once.\n")
+    if n_files < 2:
+        print("Please provide at least 2 input matrices")
         sys.exit()
     print("Input files: ")
     for file in p["input_files"]:
@@ -2,17 +2,24 @@
 # -*- coding: utf-8 -*-
 """
 from a set of coordinates it calculates the PWD matrix, and from it it gets back the coordinates.
+
+With --single_cell, the coordinates of every cell of the PWDscMatrix are reconstructed
+and saved as a (n_cells, n_barcodes, 3) array, with NaN for missing barcodes.
 """
 import argparse
 import os
 import select
 import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 import numpy as np
 
 from traceratops.core.him_matrix_operations import (
     calculate_ensemble_pwd_matrix,
     distances_2_coordinates,
+    iterate_row_blocks,
+    load_sc_matrix,
+    sc_matrix_2_coordinates,
 )
 from traceratops.core.io_manager import create_folder, load_barcode_dict
 
@@ -27,6 +34,28 @@ def parse_arguments():
         "--barcode_type_dict",
         help="Json dictionary linking barcodes and atom types (MUST BE 3 characters long!). ",
     )
+    parser.add_argument(
+        "--single_cell",
+        help="reconstructs the coordinates of every cell instead of the ensemble",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--min_barcodes",
+        help="Minimum number of barcodes detected in a cell to reconstruct it. Default = 4",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        help="Number of cells reconstructed together. Default = 1000",
+    )
+    parser.add_argument(
+        "--n_workers",
+        help="Number of worker processes reconstructing chunks of cells. Default = 1",
+    )
+    parser.add_argument(
+        "--pdb",
+        help="also writes a PDB file per reconstructed cell (single cell mode)",
+        action="store_true",
+    )
     return parser
 
 
@@ -40,6 +69,20 @@ def create_dict_args(args):
         p["barcode_type_dict"] = args.barcode_type_dict
     else:
         p["barcode_type_dict"] = "barcode_type_dict.json"
+    p["single_cell"] = args.single_cell
+    p["pdb"] = args.pdb
+    if args.min_barcodes:
+        p["min_barcodes"] = int(args.min_barcodes)
+    else:
+        p["min_barcodes"] = 4
+    if args.chunk_size:
+        p["chunk_size"] = int(args.chunk_size)
+    else:
+        p["chunk_size"] = 1000
+    if args.n_workers:
+        p["n_workers"] = int(args.n_workers)
+    else:
+        p["n_workers"] = 1
     p["matrix_files"] = []
     if args.pipe:
         p["pipe"] = True
@@ -60,11 +103,11 @@ def create_dict_args(args):
     return p
 
 
-def xyz_2_pdb(file_name, xyz, barcode_type=dict()):
+def xyz_2_pdb(file_name, xyz, barcode_type=dict(), barcodes=None, trace_name="avr"):
     n_atoms = xyz.shape[0]
-    barcodes = [x for x in range(n_atoms)]
+    if barcodes is None:
+        barcodes = [x for x in range(n_atoms)]
     default_atom_name = "xxx"
-    trace_name = "avr"
     if len(barcode_type) < 1:
         # all atoms have the same identity
         print("did not find barcode_type dictionary")
@@ -163,17 +206,138 @@ def matrix_2_pdb(
     )
 
 
+def reconstruct_cells(sc_matrix, min_barcodes=4, chunk_size=1000, n_workers=1):
+    """
+    Reconstructs the 3D coordinates of every cell of a PWDscMatrix.
+
+    Missing distances are imputed starting from the ensemble (median) matrix.
+    Cells are reconstructed by chunks, with batched eigendecompositions, and
+    chunks are distributed over <n_workers> processes.
+
+    Parameters
+    ----------
+    sc_matrix : numpy array
+        single-cell PWD matrices with shape (N, N, n_cells), possibly
+        memory-mapped.
+    min_barcodes : int, optional
+        cells with fewer detected barcodes are not reconstructed (NaN
+        coordinates). The default is 4.
+    chunk_size : int, optional
+        number of cells per chunk. The default is 1000.
+    n_workers : int, optional
+        number of worker processes. The default is 1.
+
+    Returns
+    -------
+    coordinates : numpy array
+        (n_cells, N, 3) coordinates, NaN for missing barcodes.
+    detected : numpy array
+        (n_cells, N) mask of the barcodes detected in each cell.
+    """
+    n_barcodes, _, n_cells = sc_matrix.shape
+    detected = np.zeros((n_cells, n_barcodes), dtype=bool)
+    for start, block in iterate_row_blocks(sc_matrix):
+        detected[:, start : start + len(block)] = np.any(~np.isnan(block), axis=1).T
+    cells = np.flatnonzero(np.sum(detected, axis=1) >= min_barcodes)
+    print(f"$ reconstructing {len(cells)}/{n_cells} cells")
+
+    ensemble_matrix, _ = calculate_ensemble_pwd_matrix(
+        sc_matrix, 1, range(n_cells), mode="median"
+    )
+    # chunks are read from the (memory-mapped) matrix only when reconstructed,
+    # and their coordinates are stored as soon as they are available
+    chunks = (
+        cells[start : start + chunk_size] for start in range(0, len(cells), chunk_size)
+    )
+    coordinates = np.full((n_cells, n_barcodes, 3), np.nan)
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            pending = {}
+            for chunk in chunks:
+                # at most two chunks per worker are held in memory
+                if len(pending) >= 2 * n_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        coordinates[pending.pop(future)] = future.result()
+                future = executor.submit(
+                    sc_matrix_2_coordinates, sc_matrix[:, :, chunk], ensemble_matrix
+                )
+                pending[future] = chunk
+            for future in wait(pending).done:
+                coordinates[pending[future]] = future.result()
+    else:
+        for chunk in chunks:
+            coordinates[chunk] = sc_matrix_2_coordinates(
+                sc_matrix[:, :, chunk], ensemble_matrix
+            )
+    detected[np.isnan(coordinates[:, :, 0])] = False
+
+    return coordinates, detected
+
+
+def sc_matrix_2_pdb(
+    sc_matrix,
+    folder_path,
+    output_file,
+    barcode_type=dict(),
+    min_barcodes=4,
+    chunk_size=1000,
+    n_workers=1,
+    pdb=False,
+):
+    coordinates, detected = reconstruct_cells(
+        sc_matrix, min_barcodes=min_barcodes, chunk_size=chunk_size, n_workers=n_workers
+    )
+
+    coordinates_file = folder_path + os.sep + output_file + "_sc_coordinates.npy"
+    np.save(coordinates_file, coordinates)
+    print(f"$ saved coordinates to {coordinates_file}")
+
+    if pdb:
+        pdb_folder = folder_path + os.sep + output_file + "_sc_PDBs"
+        create_folder(pdb_folder)
+        for cell in np.flatnonzero(np.any(detected, axis=1)):
+            barcodes = np.flatnonzero(detected[cell])
+            xyz_2_pdb(
+                pdb_folder + os.sep + f"cell_{cell:05d}.pdb",
+                coordinates[cell, barcodes],
+                barcode_type=barcode_type,
+                barcodes=barcodes,
+                trace_name="cel",
+            )
+
+    return coordinates
+
+
 def runtime(
     matrix_files=[],
     folder_path="./ensemble_structure",
     barcode_type=dict(),
+    single_cell=False,
+    min_barcodes=4,
+    chunk_size=1000,
+    n_workers=1,
+    pdb=False,
 ):
     if len(matrix_files) > 0:
         for matrix_file in matrix_files:
             if os.path.exists(matrix_file):
-                sc_matrix = np.load(matrix_file)
+                sc_matrix = load_sc_matrix(matrix_file)
 
-                matrix_2_pdb(sc_matrix, folder_path, barcode_type=barcode_type)
+                if single_cell:
+                    sc_matrix_2_pdb(
+                        sc_matrix,
+                        folder_path,
+                        os.path.splitext(os.path.basename(matrix_file))[0],
+                        barcode_type=barcode_type,
+                        min_barcodes=min_barcodes,
+                        chunk_size=chunk_size,
+                        n_workers=n_workers,
+                        pdb=pdb,
+                    )
+                else:
+                    matrix_2_pdb(sc_matrix, folder_path, barcode_type=barcode_type)
 
             else:
                 print("! ERROR: could not find {}".format(matrix_file))
@@ -197,6 +361,11 @@ def main():
         matrix_files=p["matrix_files"],
         folder_path=folder_path,
         barcode_type=barcode_type,
+        single_cell=p["single_cell"],
+        min_barcodes=p["min_barcodes"],
+        chunk_size=p["chunk_size"],
+        n_workers=p["n_workers"],
+        pdb=p["pdb"],
     )
     print(f"Processed <{n_traces_processed}> trace file(s)")
     print("Finished execution")
@@ -30,118 +30,87 @@ from tqdm import tqdm
 from traceratops.core.chromatin_trace_table import ChromatinTraceTable
 
 
-def compute_threeway_colocalization(trace_table, anchor_barcode, distance_cutoff):
+def compute_threeway_colocalization(
+    trace, anchor_barcode, distance_cutoff, selected_traces=None
+):
     """
     Computes the frequency of three-way co-localization between an anchor barcode
     and all possible pairs of other barcodes.
 
     Parameters:
     ----------
-    trace_table : ChromatinTraceTable
+    trace : ChromatinTraceTable
         Table containing chromatin trace data
     anchor_barcode : int
         The anchor barcode number
     distance_cutoff : float
         Distance threshold for considering barcodes as co-localized (in µm)
+    selected_traces : numpy array, optional
+        Boolean mask of the traces of trace.trace_index to use (all by default)
 
     Returns:
     -------
     dict
         Dictionary with (barcode1, barcode2) tuples as keys and co-localization frequencies as values
     """
-    # Dictionary to store co-localization counts: (barcode1, barcode2) -> [co-localized count, total count]
-    threeway_interactions = {}
-
-    # Get all unique barcodes
-    all_barcodes = np.unique(trace_table["Barcode #"])
-    other_barcodes = [b for b in all_barcodes if b != anchor_barcode]
+    trace_table = trace.data
+    trace_index = trace.trace_index
+    if selected_traces is None:
+        selected_traces = np.ones(len(trace_index), dtype=bool)
+
+    # Get all unique barcodes of the selected traces
+    all_barcodes = np.unique(
+        np.asarray(trace_table["Barcode #"])[trace_index.broadcast(selected_traces)]
+    )
+    other_barcodes = all_barcodes[all_barcodes != anchor_barcode]
 
-    # Generate all possible pairs of barcodes (excluding the anchor)
-    barcode_pairs = list(itertools.combinations(other_barcodes, 2))
+    # co-localized and total counts of each pair of barcodes (excluding the anchor)
+    colocalized_counts = np.zeros((len(other_barcodes), len(other_barcodes)), int)
+    total_counts = np.zeros_like(colocalized_counts)
 
-    # Initialize the counts dictionary
-    for pair in barcode_pairs:
-        threeway_interactions[pair] = [0, 0]
+    traces = trace_index.iterate(
+        trace_table["Barcode #"], trace_table["x"], trace_table["y"], trace_table["z"]
+    )
 
-    # Group traces by Trace_ID
-    trace_groups = trace_table.group_by("Trace_ID").groups
+    # Process each selected trace separately
+    for idx, (_, (barcodes, x, y, z)) in enumerate(
+        tqdm(traces, total=len(trace_index), desc="Processing traces")
+    ):
+        if not selected_traces[idx]:
+            continue
+        positions = np.stack([x, y, z], axis=1)
 
-    # Process each trace separately
-    for trace in tqdm(trace_groups, desc="Processing traces"):
         # Get positions of the anchor barcode in this trace
-        anchor_positions = trace[trace["Barcode #"] == anchor_barcode]
+        anchor_positions = positions[barcodes == anchor_barcode]
 
         # Skip if anchor is not present in this trace
         if len(anchor_positions) == 0:
             continue
 
-        # Get the barcodes present in this trace
-        barcodes_in_trace = np.unique(trace["Barcode #"])
+        # spots closer than the cutoff to any anchor spot
+        distances = np.linalg.norm(
+            positions[:, None] - anchor_positions[None, :], axis=-1
+        )
+        colocalized = np.any(distances < distance_cutoff, axis=1)
+
+        # Increment the counts of the pairs of barcodes present in this trace
+        # and of the pairs where both barcodes co-localize with the anchor
+        others = barcodes != anchor_barcode
+        present = np.searchsorted(other_barcodes, np.unique(barcodes[others]))
+        close = np.searchsorted(
+            other_barcodes, np.unique(barcodes[others & colocalized])
+        )
+        total_counts[np.ix_(present, present)] += 1
+        colocalized_counts[np.ix_(close, close)] += 1
 
-        # Generate all pairs of barcodes in this trace (excluding the anchor)
-        pairs_in_trace = [
-            p
-            for p in barcode_pairs
-            if p[0] in barcodes_in_trace and p[1] in barcodes_in_trace
+    # Generate all possible pairs of barcodes (excluding the anchor)
+    threeway_interactions = {
+        (other_barcodes[i], other_barcodes[j]): [
+            colocalized_counts[i, j],
+            total_counts[i, j],
         ]
-
-        # For each pair, check if they co-localize with the anchor
-        for barcode1, barcode2 in pairs_in_trace:
-            barcode1_positions = trace[trace["Barcode #"] == barcode1]
-            barcode2_positions = trace[trace["Barcode #"] == barcode2]
-
-            # Skip if either barcode is missing in this trace
-            if len(barcode1_positions) == 0 or len(barcode2_positions) == 0:
-                continue
-
-            # Increment the total count for this pair
-            threeway_interactions[(barcode1, barcode2)][1] += 1
-
-            # Check distances between anchor and barcode1
-            distances_anchor_barcode1 = np.linalg.norm(
-                np.array(
-                    [
-                        anchor_positions["x"],
-                        anchor_positions["y"],
-                        anchor_positions["z"],
-                    ]
-                ).T[:, None]
-                - np.array(
-                    [
-                        barcode1_positions["x"],
-                        barcode1_positions["y"],
-                        barcode1_positions["z"],
-                    ]
-                ).T,
-                axis=-1,
-            )
-
-            # Check distances between anchor and barcode2
-            distances_anchor_barcode2 = np.linalg.norm(
-                np.array(
-                    [
-                        anchor_positions["x"],
-                        anchor_positions["y"],
-                        anchor_positions["z"],
-                    ]
-                ).T[:, None]
-                - np.array(
-                    [
-                        barcode2_positions["x"],
-                        barcode2_positions["y"],
-                        barcode2_positions["z"],
-                    ]
-                ).T,
-                axis=-1,
-            )
-
-            # Check if both barcodes co-localize with the anchor
-            anchor_barcode1_coloc = np.any(distances_anchor_barcode1 < distance_cutoff)
-            anchor_barcode2_coloc = np.any(distances_anchor_barcode2 < distance_cutoff)
-
-            # If both barcodes co-localize with the anchor, increment the co-localized count
-            if anchor_barcode1_coloc and anchor_barcode2_coloc:
-                threeway_interactions[(barcode1, barcode2)][0] += 1
+        for i, j in itertools.combinations(range(len(other_barcodes)), 2)
+    }
 
     # Compute frequencies
     threeway_frequencies = {
@@ -153,14 +122,14 @@ def compute_threeway_colocalization(trace_table, anchor_barcode, distance_cutoff
 
 
 def bootstrap_threeway_colocalization(
-    trace_table, anchor_barcode, distance_cutoff, n_bootstrap=100
+    trace, anchor_barcode, distance_cutoff, n_bootstrap=100
 ):
     """
     Performs bootstrapping to estimate mean and SEM of three-way co-localization frequencies.
 
     Parameters:
     ----------
-    trace_table : ChromatinTraceTable
+    trace : ChromatinTraceTable
         Table containing chromatin trace data
     anchor_barcode : int
         The anchor barcode number
@@ -178,19 +147,19 @@ def bootstrap_threeway_colocalization(
     pair_samples = {}
 
     # Get all unique trace IDs for bootstrapping
-    trace_ids = np.unique(trace_table["Trace_ID"])
+    trace_ids = trace.trace_index.keys
 
     # Run bootstrap iterations
     for _ in tqdm(range(n_bootstrap), desc="Bootstrapping"):
         # Sample traces with replacement
         sampled_traces = np.random.choice(trace_ids, size=len(trace_ids), replace=True)
 
-        # Create a new table with only the sampled traces
-        sampled_table = trace_table[np.isin(trace_table["Trace_ID"], sampled_traces)]
-
-        # Compute three-way co-localization for this bootstrap sample
+        # Compute three-way co-localization for the sampled traces
         threeway_frequencies = compute_threeway_colocalization(
-            sampled_table, anchor_barcode, distance_cutoff
+            trace,
+            anchor_barcode,
+            distance_cutoff,
+            selected_traces=np.isin(trace_ids, sampled_traces),
         )
 
         # Store the results
@@ -440,7 +409,7 @@ def main():
             # Initialize and load trace table
             trace = ChromatinTraceTable()
             trace.initialize()
-            trace.load(trace_file)
+            trace.load(trace_file, encode_ids=True)
 
             print(f"Using distance cutoff: {args.cutoff} µm")
             print(f"Performing {args.bootstrapping_cycles} bootstrap iterations")
@@ -450,7 +419,7 @@ def main():
 
                 # Run the bootstrap analysis
                 pair_means, pair_sems = bootstrap_threeway_colocalization(
-                    trace.data,
+                    trace,
                     anchor,
                     args.cutoff,
                     n_bootstrap=args.bootstrapping_cycles,
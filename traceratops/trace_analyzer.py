@@ -5,10 +5,9 @@ Analyze chromatin trace files.
 """
 
 import argparse
-import collections
+import os
 import select
 import sys
-from collections import defaultdict
 
 import matplotlib
 import matplotlib.pyplot as plt
@@ -40,6 +39,24 @@ def parse_arguments():
         choices=["png", "svg"],
         help="Output image format (png or svg)",
     )
+    parser.add_argument(
+        "--bootstrap_iterations",
+        type=int,
+        default=1000,
+        help="Number of bootstrap resamplings of the detection efficiency. Default = 1000",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the random generator used for bootstrapping",
+    )
+    parser.add_argument(
+        "--max_lag",
+        type=int,
+        default=1,
+        help="Largest barcode separation for neighbor distance statistics. Default = 1",
+    )
     return parser
 
 
@@ -49,6 +66,9 @@ def create_dict_args(args):
     p["rootFolder"] = args.rootFolder
     p["plotXYZ"] = args.plotXYZ
     p["format"] = args.format
+    p["bootstrap_iterations"] = args.bootstrap_iterations
+    p["seed"] = args.seed
+    p["max_lag"] = args.max_lag
 
     p["trace_files"] = []
     if args.pipe:
@@ -82,8 +102,8 @@ def get_barcode_statistics(trace, output_filename="test_barcodes.png"):
 
     Parameters
     ----------
-    trace : astropy.table.Table
-        Trace table in ASTROPY Table format.
+    trace : ChromatinTraceTable
+        Trace table.
     output_filename : str
         Output figure filename including path and extension.
 
@@ -92,28 +112,11 @@ def get_barcode_statistics(trace, output_filename="test_barcodes.png"):
     None
         The function saves the output figure but does not return any values.
     """
-    trace_by_ID = trace.group_by("Trace_ID")
-
-    trace_lengths = list()
-    trace_unique_barcodes = list()
-    trace_repeated_barcodes = list()
-    number_unique_barcodes = list()
-    number_repeated_barcodes = list()
-
-    for sub_trace_table in trace_by_ID.groups:
-        trace_lengths.append(len(sub_trace_table))
-
-        unique_barcodes = list(set(sub_trace_table["Barcode #"]))
-        trace_unique_barcodes.append(unique_barcodes)
-        number_unique_barcodes.append(len(unique_barcodes))
-
-        repeated_barcodes = [
-            item
-            for item, count in collections.Counter(sub_trace_table["Barcode #"]).items()
-            if count > 1
-        ]
-        trace_repeated_barcodes.append(repeated_barcodes)
-        number_repeated_barcodes.append(len(repeated_barcodes))
+    trace_index = trace.trace_index
+    barcodes = trace.data["Barcode #"]
+    trace_lengths = trace_index.count()
+    number_unique_barcodes = trace_index.n_unique(barcodes)
+    number_repeated_barcodes = trace_index.n_repeated(barcodes)
 
     distributions = [trace_lengths, number_unique_barcodes, number_repeated_barcodes]
     axis_x_labels = [
@@ -143,12 +146,149 @@ def get_barcode_statistics(trace, output_filename="test_barcodes.png"):
     plt.savefig(output_filename)
 
 
-def plot_neighbor_distances(trace, output_filename="neighbor_distances.png"):
+def sort_spots(trace):
+    """
+    Sorts the spots of a trace table by trace and by barcode.
+
+    Parameters
+    ----------
+    trace : ChromatinTraceTable
+        Trace table, instance of the ChromatinTraceTable Class.
+
+    Returns
+    -------
+    codes : numpy array
+        sorted trace codes.
+    barcodes : numpy array
+        barcodes sorted within each trace.
+    xyz : numpy array
+        (n_spots, 3) coordinates of the sorted spots.
+    """
+    trace_table = trace.data
+    codes = trace.trace_index.codes.astype(np.int64)
+    barcodes = np.asarray(trace_table["Barcode #"], dtype=np.int64)
+    order = np.lexsort((barcodes, codes))
+    xyz = np.column_stack(
+        [np.asarray(trace_table[axis], dtype=float)[order] for axis in ("x", "y", "z")]
+    )
+    return codes[order], barcodes[order], xyz
+
+
+def neighbor_displacements(codes, barcodes, xyz, lag=1):
+    """
+    Computes the displacements between barcodes separated by `lag` in all traces.
+
+    A displacement is taken from the last spot of barcode `b` to the first spot
+    of barcode `b + lag` within the same trace, so that for lag = 1 only
+    strictly consecutive rows of the sorted table are paired.
+
+    Parameters
+    ----------
+    codes : numpy array
+        sorted trace codes, as returned by `sort_spots`.
+    barcodes : numpy array
+        sorted barcodes, as returned by `sort_spots`.
+    xyz : numpy array
+        (n_spots, 3) sorted coordinates, as returned by `sort_spots`.
+    lag : int, optional
+        barcode separation. The default is 1.
+
+    Returns
+    -------
+    numpy array
+        (n_pairs, 3) array of dx, dy, dz displacements.
+    """
+    if len(codes) == 0:
+        return np.empty((0, 3))
+
+    # combined keys, with a gap between traces so that keys + lag never cross traces
+    barcodes = barcodes - barcodes.min()
+    keys = codes * (int(barcodes.max()) + 1 + lag) + barcodes
+    last = np.append(keys[1:] != keys[:-1], True)
+    sources = np.flatnonzero(last)
+    targets = np.searchsorted(keys, keys[sources] + lag, side="left")
+    found = targets < len(keys)
+    found[found] = keys[targets[found]] == keys[sources[found]] + lag
+
+    return xyz[targets[found]] - xyz[sources[found]]
+
+
+def neighbor_statistics(trace, max_lag=1):
+    """
+    Computes the mean and standard deviation of displacements for lags 1..max_lag.
+
+    Parameters
+    ----------
+    trace : ChromatinTraceTable
+        Trace table, instance of the ChromatinTraceTable Class.
+    max_lag : int, optional
+        largest barcode separation. The default is 1.
+
+    Returns
+    -------
+    displacements : list of numpy arrays
+        (n_pairs, 3) displacements for each lag.
+    means : numpy array
+        (max_lag, 3) mean dx, dy, dz for each lag (0 when no pair is found).
+    stds : numpy array
+        (max_lag, 3) standard deviation of dx, dy, dz for each lag.
+    """
+    codes, barcodes, xyz = sort_spots(trace)
+
+    displacements = [
+        neighbor_displacements(codes, barcodes, xyz, lag)
+        for lag in range(1, max_lag + 1)
+    ]
+    means = np.array([d.mean(axis=0) if len(d) else np.zeros(3) for d in displacements])
+    stds = np.array([d.std(axis=0) if len(d) else np.zeros(3) for d in displacements])
+
+    return displacements, means.reshape(-1, 3), stds.reshape(-1, 3)
+
+
+def plot_lag_statistics(means, stds, output_filename):
+    """
+    Plots the mean and standard deviation of displacements as a function of lag.
+
+    Parameters
+    ----------
+    means : numpy array
+        (max_lag, 3) mean dx, dy, dz for each lag.
+    stds : numpy array
+        (max_lag, 3) standard deviation of dx, dy, dz for each lag.
+    output_filename : str
+        The filename for the output figure file.
+
+    Returns
+    -------
+    None
+    """
+    lags = np.arange(1, len(means) + 1)
+    labels = [r"$\Delta x$", r"$\Delta y$", r"$\Delta z$"]
+    colors = ["blue", "green", "red"]
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for i, (label, color) in enumerate(zip(labels, colors)):
+        ax.errorbar(
+            lags, means[:, i], yerr=stds[:, i], label=label, color=color, marker="o"
+        )
+    ax.set_xlabel("barcode lag")
+    ax.set_ylabel("displacement, um")
+    ax.legend()
+
+    fig.tight_layout()
+    fig.savefig(output_filename)
+    plt.close(fig)
+    print(f"$ Saved lag statistics plot: {output_filename}")
+
+
+def plot_neighbor_distances(trace, output_filename="neighbor_distances.png", max_lag=1):
     """
     Calculate and visualize distances between consecutive neighboring barcodes.
 
     This function computes the mean and standard deviation of X, Y, and Z distances
     between strictly consecutive neighboring barcodes and generates histograms for each dimension.
+    If max_lag > 1, the statistics of barcodes separated by 1..max_lag are also
+    printed and plotted to `<output_filename>_lags`.
 
     Parameters
     ----------
@@ -156,6 +296,8 @@ def plot_neighbor_distances(trace, output_filename="neighbor_distances.png"):
         Trace table, instance of the ChromatinTraceTable Class.
     output_filename : str
         The filename for the output figure file.
+    max_lag : int, optional
+        largest barcode separation analyzed. The default is 1.
 
     Returns
     -------
@@ -163,45 +305,20 @@ def plot_neighbor_distances(trace, output_filename="neighbor_distances.png"):
         (mean_dx, mean_dy, mean_dz, std_dx, std_dy, std_dz):
         Mean and standard deviation values for X, Y, and Z distances.
     """
-    trace_table = trace.data
-    trace_by_ID = trace_table.group_by("Trace_ID")
-
-    dx_all, dy_all, dz_all = [], [], []
-
-    for sub_trace_table in trace_by_ID.groups:
-        # Sort by Barcode #
-        sorted_trace = sub_trace_table[np.argsort(sub_trace_table["Barcode #"])]
-
-        # Get barcodes and coordinates
-        barcodes = sorted_trace["Barcode #"].data
-        x_coords = sorted_trace["x"].data
-        y_coords = sorted_trace["y"].data
-        z_coords = sorted_trace["z"].data
-
-        # Iterate and calculate distances only for strictly consecutive barcodes
-        for i in range(len(barcodes) - 1):
-            if barcodes[i + 1] == barcodes[i] + 1:  # Ensure strict consecutiveness
-                dx_all.append(x_coords[i + 1] - x_coords[i])
-                dy_all.append(y_coords[i + 1] - y_coords[i])
-                dz_all.append(z_coords[i + 1] - z_coords[i])
-
-    # Compute mean and standard deviation
-    mean_dx, std_dx = (np.mean(dx_all), np.std(dx_all)) if dx_all else (0, 0)
-    mean_dy, std_dy = (np.mean(dy_all), np.std(dy_all)) if dy_all else (0, 0)
-    mean_dz, std_dz = (np.mean(dz_all), np.std(dz_all)) if dz_all else (0, 0)
+    displacements, means, stds = neighbor_statistics(trace, max(max_lag, 1))
+    mean_dx, mean_dy, mean_dz = means[0]
+    std_dx, std_dy, std_dz = stds[0]
 
     # Create figure with three histograms
     fig, axes = plt.subplots(1, 3, figsize=(15, 5))
     fig.suptitle("Distances between consecutive neighboring barcodes", fontsize=25)
 
-    data = [dx_all, dy_all, dz_all]
+    data = displacements[0].T
     labels = [r"$\Delta x$, um", r"$\Delta y$, um", r"$\Delta z$, um"]
     colors = ["blue", "green", "red"]
-    means = [mean_dx, mean_dy, mean_dz]
-    stds = [std_dx, std_dy, std_dz]
 
     for i, (ax, dist, label, mean_val, std_val, color) in enumerate(
-        zip(axes, data, labels, means, stds, colors)
+        zip(axes, data, labels, means[0], stds[0], colors)
     ):
         ax.hist(dist, bins=30, alpha=0.7, color=color, edgecolor="black")
         ax.set_xlabel(label)
@@ -214,11 +331,66 @@ def plot_neighbor_distances(trace, output_filename="neighbor_distances.png"):
     plt.savefig(output_filename)
     print(f"$ Saved neighbor distances plot: {output_filename}")
 
+    if max_lag > 1:
+        for lag, (mean, std, d) in enumerate(zip(means, stds, displacements), 1):
+            print(
+                f"$ lag {lag}: {len(d)} pairs, mean X={mean[0]:.3f}, Y={mean[1]:.3f}, "
+                f"Z={mean[2]:.3f}, std X={std[0]:.3f}, Y={std[1]:.3f}, Z={std[2]:.3f}"
+            )
+        root, ext = os.path.splitext(output_filename)
+        plot_lag_statistics(means, stds, f"{root}_lags{ext}")
+
     return mean_dx, mean_dy, mean_dz, std_dx, std_dy, std_dz
 
 
+def bootstrap_detection(presence, n_iterations=1000, rng=None, batch_size=None):
+    """
+    Bootstraps the detection frequency of all barcodes at once.
+
+    Each resampling of the traces is expressed as the number of times each
+    trace is drawn, so the detection frequencies of all barcodes are obtained
+    with one matrix product per batch of resamplings.
+
+    Parameters
+    ----------
+    presence : numpy array
+        (n_traces, n_barcodes) boolean matrix of barcode presence.
+    n_iterations : int, optional
+        number of resamplings. The default is 1000.
+    rng : numpy.random.Generator or int, optional
+        random generator or seed. The default is None.
+    batch_size : int, optional
+        resamplings per batch. The default keeps batches around 10 million draws.
+
+    Returns
+    -------
+    numpy array
+        (n_iterations, n_barcodes) bootstrapped detection frequencies.
+    """
+    rng = np.random.default_rng(rng)
+    n_traces = presence.shape[0]
+    if batch_size is None:
+        batch_size = max(1, 10_000_000 // max(n_traces, 1))
+    presence = presence.astype(float)
+
+    boot_means = []
+    for start in range(0, n_iterations, batch_size):
+        n_batch = min(batch_size, n_iterations - start)
+        draws = rng.integers(0, n_traces, size=(n_batch, n_traces))
+        draws += n_traces * np.arange(n_batch)[:, None]
+        weights = np.bincount(draws.ravel(), minlength=n_batch * n_traces)
+        boot_means.append(weights.reshape(n_batch, n_traces) @ presence / n_traces)
+    return (
+        np.concatenate(boot_means) if boot_means else np.zeros((0, presence.shape[1]))
+    )
+
+
 def barcode_detection_efficiency(
-    trace, output_prefix="barcode_detection_efficiency", format="png"
+    trace,
+    output_prefix="barcode_detection_efficiency",
+    format="png",
+    bootstrap_iterations=1000,
+    seed=None,
 ):
     """
     Analyze and visualize barcode detection efficiency across all traces.
@@ -233,6 +405,10 @@ def barcode_detection_efficiency(
         Trace table, instance of the ChromatinTraceTable Class.
     output_prefix : str
         Prefix for the output filename (without extension).
+    bootstrap_iterations : int, optional
+        Number of bootstrap resamplings. Default is 1000.
+    seed : int, optional
+        Seed of the random generator, for reproducible bootstrapping.
 
     Returns
     -------
@@ -240,30 +416,23 @@ def barcode_detection_efficiency(
         The function saves the output figure but does not return any values.
     """
     trace_table = trace.data
-    trace_groups = trace_table.group_by("Trace_ID").groups
-    n_traces = len(trace_groups)
-    bootstrap_iterations = 1000
+    trace_index = trace.trace_index
+    n_traces = len(trace_index)
 
     print(f"$ Calculating overall barcode detection across {n_traces} traces...")
 
-    barcode_presence = defaultdict(list)
-    all_barcodes = set(trace_table["Barcode #"])
-
-    # Track barcode presence per trace
-    for sub_trace in trace_groups:
-        present = set(sub_trace["Barcode #"])
-        for barcode in all_barcodes:
-            barcode_presence[barcode].append(1 if barcode in present else 0)
+    # (n_traces, n_barcodes) presence matrix from integer codes
+    all_barcodes, barcode_codes = np.unique(
+        np.asarray(trace_table["Barcode #"]), return_inverse=True
+    )
+    presence = np.zeros((n_traces, len(all_barcodes)), dtype=bool)
+    presence[trace_index.codes, barcode_codes.ravel()] = True
 
     # Bootstrap detection frequencies (generate bootstrapped mean values)
-    detection_bootstrap_distributions = {}
-    for barcode, detections in barcode_presence.items():
-        detections = np.array(detections)
-        boot_means = [
-            np.mean(np.random.choice(detections, size=n_traces, replace=True))
-            for _ in range(bootstrap_iterations)
-        ]
-        detection_bootstrap_distributions[barcode] = boot_means
+    boot_means = bootstrap_detection(presence, bootstrap_iterations, rng=seed)
+    detection_bootstrap_distributions = {
+        barcode: boot_means[:, idx] for idx, barcode in enumerate(all_barcodes)
+    }
 
     # Plotting
     sorted_barcodes = sorted(detection_bootstrap_distributions.keys())
@@ -299,7 +468,15 @@ def barcode_detection_efficiency(
     print(f"$ Exporting barcode detection plot to: {output_prefix}.{format}")
 
 
-def analyze_trace(trace, trace_file, plotXYZ=False, format="png"):
+def analyze_trace(
+    trace,
+    trace_file,
+    plotXYZ=False,
+    format="png",
+    bootstrap_iterations=1000,
+    seed=None,
+    max_lag=1,
+):
     """
     Perform comprehensive analysis on a chromatin trace file.
 
@@ -319,6 +496,12 @@ def analyze_trace(trace, trace_file, plotXYZ=False, format="png"):
         Flag to control whether XYZ traces should be plotted. Default is False.
     format : str, optional
         Output file format for figures ('png' or 'svg'). Default is 'png'.
+    bootstrap_iterations : int, optional
+        Number of bootstrap resamplings of the detection efficiency. Default is 1000.
+    seed : int, optional
+        Seed of the random generator used for bootstrapping. Default is None.
+    max_lag : int, optional
+        Largest barcode separation for neighbor distance statistics. Default is 1.
 
     Returns
     -------
@@ -333,24 +516,28 @@ def analyze_trace(trace, trace_file, plotXYZ=False, format="png"):
 
     # Calculate trace statistics
     output_filename = f"{base_filename}_trace_statistics.{format}"
-    get_barcode_statistics(trace_table, output_filename)
+    get_barcode_statistics(trace, output_filename)
 
     # Plot barcode detection per ROI with bootstrapped errors
     barcode_detection_efficiency(
-        trace, output_prefix=base_filename + "_barcode_detection", format=format
+        trace,
+        output_prefix=base_filename + "_barcode_detection",
+        format=format,
+        bootstrap_iterations=bootstrap_iterations,
+        seed=seed,
     )
 
     # Compute and plot neighbor distances
     neighbor_distances_output = f"{base_filename}_first_neighbor_distances.{format}"
     mean_dx, mean_dy, mean_dz, std_dx, std_dy, std_dz = plot_neighbor_distances(
-        trace, neighbor_distances_output
+        trace, neighbor_distances_output, max_lag=max_lag
     )
     print(
         f"$ Mean distances between neighboring barcodes: X={mean_dx:.3f}, Y={mean_dy:.3f}, Z={mean_dz:.3f}"
     )
 
     # Plots how often barcodes are repeated in a single trace
-    collective_barcode_stats = trace.barcode_statistics(trace_table)
+    collective_barcode_stats = trace.barcode_statistics()
     trace.plots_barcode_statistics(
         collective_barcode_stats,
         file_name=f"{base_filename}_relative_barcode_frequencies",
@@ -393,7 +580,7 @@ def process_traces(p):
             trace.initialize()
 
             # reads new trace
-            trace.load(trace_file)
+            trace.load(trace_file, encode_ids=True)
 
             if p["plotXYZ"]:
                 print(f"> Plotting traces for {trace_file}")
@@ -403,7 +590,15 @@ def process_traces(p):
                 )
 
             print(f"> Analyzing traces for {trace_file}")
-            analyze_trace(trace, trace_file, plotXYZ=p["plotXYZ"], format=p["format"])
+            analyze_trace(
+                trace,
+                trace_file,
+                plotXYZ=p["plotXYZ"],
+                format=p["format"],
+                bootstrap_iterations=p["bootstrap_iterations"],
+                seed=p["seed"],
+                max_lag=p["max_lag"],
+            )
 
     else:
         print(
@@ -18,12 +18,39 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("--input", help="Input trace file")
     parser.add_argument(
-        "--mask_file", help="Input mask image file. Expected format: NPY"
+        "--mask_file",
+        nargs="+",
+        help="Input mask image file(s). Expected format: NPY. Several masks are processed in one pass.",
     )
     parser.add_argument(
-        "--pixel_size", help="Lateral pixel size un microns. Default = 0.1"
+        "--pixel_size", type=float, help="Lateral pixel size un microns. Default = 0.1"
+    )
+    parser.add_argument(
+        "--pixel_size_z",
+        type=float,
+        help="Axial pixel size in microns, used for 3D masks. Default = 0.25",
+    )
+    parser.add_argument(
+        "--label",
+        nargs="+",
+        help="Label(s) to add to trace file, one per mask file. Default=labeled",
+    )
+    parser.add_argument(
+        "--labeled_mask",
+        help="Masks are integer-labeled (0 = background): writes the mask label of each spot in the 'Mask_id' column",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--trace_mode",
+        choices=["spot", "fraction", "com"],
+        help="'spot': labels each spot independently. 'fraction': labels whole traces with at least --min_fraction of their spots in the mask. 'com': labels whole traces whose center of mass is in the mask. Default=spot",
+    )
+    parser.add_argument(
+        "--min_fraction",
+        type=float,
+        help="Minimum fraction of spots inside a mask to label a trace in 'fraction' mode. Default = 0.5",
     )
-    parser.add_argument("--label", help="Label to add to trace file. Default=labeled")
 
     parser.add_argument(
         "--pipe", help="inputs Trace file list from stdin (pipe)", action="store_true"
@@ -38,7 +65,7 @@ def create_dict_args(args):
     if args.input:
         p["trace_files"].append(args.input)
     if args.mask_file:
-        p["mask_file"] = args.mask_file
+        p["mask_files"] = args.mask_file
     else:
         print(">> ERROR: you must provide a filename with a mask file")
         sys.exit(-1)
@@ -46,10 +73,33 @@ def create_dict_args(args):
         p["pixel_size"] = args.pixel_size
     else:
         p["pixel_size"] = 0.1
+    if args.pixel_size_z:
+        p["pixel_size_z"] = args.pixel_size_z
+    else:
+        p["pixel_size_z"] = 0.25
     if args.label:
-        p["label"] = args.label
+        p["labels"] = args.label
+    elif len(p["mask_files"]) == 1:
+        p["labels"] = ["labeled"]
+    else:
+        p["labels"] = [
+            os.path.splitext(os.path.basename(mask_file))[0]
+            for mask_file in p["mask_files"]
+        ]
+    if len(p["labels"]) != len(p["mask_files"]):
+        print(
+            f">> ERROR: {len(p['mask_files'])} mask files were provided with {len(p['labels'])} labels"
+        )
+        sys.exit(-1)
+    p["labeled_mask"] = args.labeled_mask
+    if args.trace_mode:
+        p["trace_mode"] = args.trace_mode
     else:
-        p["label"] = "labeled"
+        p["trace_mode"] = "spot"
+    if args.min_fraction is not None:
+        p["min_fraction"] = args.min_fraction
+    else:
+        p["min_fraction"] = 0.5
     if args.pipe:
         p["pipe"] = True
         if select.select(
@@ -71,51 +121,301 @@ def create_dict_args(args):
     return p
 
 
-def assign_masks(trace, mask_file, label="labeled", pixel_size=0.1):
-    # [checks if mask file exists for the file to process]
-    if os.path.exists(mask_file):
+def load_mask(mask_file):
+    """
+    Memory-maps a NUMPY mask so that only the pixels that are read are loaded.
+
+    Parameters
+    ----------
+    mask_file : str
+        path to the NPY mask file.
+
+    Returns
+    -------
+    numpy.memmap
+        read-only mask with singleton dimensions removed.
+    """
+    return np.load(mask_file, mmap_mode="r", allow_pickle=False).squeeze()
+
+
+def coordinates_to_pixels(trace_table, shape, pixel_size=0.1, pixel_size_z=0.25):
+    """
+    Converts the coordinates of all spots into mask pixel indices at once.
+
+    2D masks are indexed as [x, y] and 3D masks as [z, x, y].
+
+    Parameters
+    ----------
+    trace_table : astropy Table or dict
+        table with 'x', 'y' and 'z' columns in microns.
+    shape : tuple
+        shape of the mask image.
+    pixel_size : float, optional
+        lateral pixel size in microns. The default is 0.1.
+    pixel_size_z : float, optional
+        axial pixel size in microns, only used for 3D masks. The default is 0.25.
+
+    Returns
+    -------
+    indices : tuple of numpy.ndarray
+        pixel indices along each mask axis, clipped to the image so that they can always be read.
+    in_bounds : numpy.ndarray
+        boolean flag, False for spots that fall outside of the image.
+    """
+    axes = [("x", pixel_size), ("y", pixel_size)]
+    if len(shape) == 3:
+        axes.insert(0, ("z", pixel_size_z))
+    elif len(shape) != 2:
+        raise ValueError(f"Expected a 2D or 3D mask, got shape {shape}")
+
+    indices = []
+    in_bounds = np.ones(len(trace_table[axes[0][0]]), dtype=bool)
+    for (coor, size), axis_length in zip(axes, shape):
+        index = np.floor(np.asarray(trace_table[coor], dtype=float) / size)
+        index = index.astype(np.int64)
+        in_bounds &= (index >= 0) & (index < axis_length)
+        indices.append(np.clip(index, 0, axis_length - 1))
+    return tuple(indices), in_bounds
+
+
+def gather_mask(mask, trace_table, pixel_size=0.1, pixel_size_z=0.25):
+    """
+    Reads the mask value under every spot with a single vectorized gather.
+
+    Returns
+    -------
+    values : numpy.ndarray
+        mask value for each spot, 0 for spots outside of the image.
+    in_bounds : numpy.ndarray
+        boolean flag, False for spots that fall outside of the image.
+    """
+    indices, in_bounds = coordinates_to_pixels(
+        trace_table, mask.shape, pixel_size=pixel_size, pixel_size_z=pixel_size_z
+    )
+    values = np.where(in_bounds, mask[indices], 0)
+    return values, in_bounds
+
+
+def vote_by_trace(values, trace_index, labeled_mask=False, min_fraction=0.5):
+    """
+    Segmented vote of the mask values of the spots of each trace.
+
+    A trace is inside the mask if at least <min_fraction> of its spots are.
+    For labeled masks, the trace gets the most frequent non-zero label of its spots.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        mask value under each spot.
+    trace_index : TraceIndex
+        index of the traces of the spots.
+    labeled_mask : bool, optional
+        masks are integer-labeled. The default is False.
+    min_fraction : float, optional
+        minimum fraction of spots inside the mask. The default is 0.5.
+
+    Returns
+    -------
+    numpy.ndarray
+        mask value of each trace (0 for traces outside of the mask).
+    """
+    n_traces = len(trace_index)
+    inside = values != 0 if labeled_mask else values == 1
+    fraction = trace_index.mean(inside)
+
+    if labeled_mask:
+        key_traces, key_labels, key_counts, _ = trace_index.value_counts(
+            values, where=inside
+        )
+        # keeps the most frequent label of each trace
+        order = np.lexsort((-key_counts, key_traces))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = key_traces[order][1:] != key_traces[order][:-1]
+        trace_values = np.zeros(n_traces, dtype=np.int64)
+        trace_values[key_traces[order[first]]] = key_labels[order[first]]
+    else:
+        trace_values = np.ones(n_traces, dtype=np.int64)
+
+    return np.where(fraction >= min_fraction, trace_values, 0)
+
+
+def reset_labels(labels):
+    """Returns labels as a string array, with 'x' placeholders reset to '_'."""
+    labels = np.asarray(labels).astype(str)
+    labels[np.char.find(labels, "x") >= 0] = "_"
+    return labels
+
+
+def assign_masks(
+    trace,
+    mask_files,
+    labels=("labeled",),
+    pixel_size=0.1,
+    pixel_size_z=0.25,
+    labeled_mask=False,
+    trace_mode="spot",
+    min_fraction=0.5,
+):
+    """
+    Assigns the labels of one or several masks to the spots of a trace table.
+
+    All the masks are applied in one pass over the trace table. Binary masks
+    label the spots where the mask is 1. Integer-labeled masks (labeled_mask=True)
+    label the spots where the mask is not 0 and write the mask label in the
+    'Mask_id' column; if several masks overlap, the first one in the list wins.
+    Spots that fall in no labeled mask get Mask_id = 0.
+
+    With trace_mode='fraction' or 'com', whole traces are labeled: a trace is
+    inside a mask if at least <min_fraction> of its spots are (majority vote),
+    or if its center of mass is. Both are computed with segmented reductions
+    over integer trace codes.
+
+    Parameters
+    ----------
+    trace : ChromatinTraceTable
+        trace to label.
+    mask_files : str or list of str
+        2D or 3D NPY mask files.
+    labels : str or list of str, optional
+        one label per mask file. The default is ("labeled",).
+    pixel_size : float, optional
+        lateral pixel size in microns. The default is 0.1.
+    pixel_size_z : float, optional
+        axial pixel size in microns, used for 3D masks. The default is 0.25.
+    labeled_mask : bool, optional
+        masks are integer-labeled. The default is False.
+    trace_mode : str, optional
+        'spot', 'fraction' or 'com'. The default is 'spot'.
+    min_fraction : float, optional
+        minimum fraction of spots inside a mask in 'fraction' mode. The default is 0.5.
+
+    Returns
+    -------
+    trace : ChromatinTraceTable
+        labeled trace.
+    """
+    if isinstance(mask_files, str):
+        mask_files = [mask_files]
+    if isinstance(labels, str):
+        labels = [labels]
+
+    # [checks if mask files exist before processing]
+    for mask_file in mask_files:
+        if not os.path.exists(mask_file):
+            print(f"ERROR: No mask image file found with name: {mask_file}")
+            sys.exit(-1)
+
+    trace_ids = np.asarray(trace.data["Trace_ID"])
+    mask_ids = np.zeros(len(trace.data), dtype=np.int64)
+
+    # labels are held as bitsets, adding a label to spots is a bitwise OR
+    trace.decode_labels()
+    trace.data.replace_column("label", reset_labels(trace.data["label"]))
+    trace.encode_labels()
+
+    if trace_mode != "spot":
+        trace_codes = trace.trace_index.codes
+        n_traces = len(trace.trace_index)
+        print(f"$ Assigning masks to {n_traces} traces using mode: {trace_mode}")
+    if trace_mode == "com":
+        centers_of_mass = {
+            coor: trace.trace_index.mean(trace.data[coor]) for coor in ("x", "y", "z")
+        }
+
+    for mask_file, label in zip(mask_files, labels):
         # load mask
-        data_2d = np.load(mask_file, allow_pickle=False).squeeze()
+        mask = load_mask(mask_file)
         print(f"$ mask image file read: {mask_file}")
-        # matches traces and masks
-        index = 0
-        labeled_trace = []
-        for trace_row in trace.data:
-            x_int = int(trace_row["x"] / pixel_size)
-            y_int = int(trace_row["y"] / pixel_size)
-            if "x" in trace_row["label"]:
-                trace_row["label"] = "_"
-            # labels are appended as comma separated lists. Thus a trace can have multiple labels
-            if data_2d[x_int, y_int] == 1:
-                trace_row["label"] = trace_row["label"] + "," + label
-                index += 1
-                labeled_trace.append(trace_row["Trace_ID"])
-        unique_traces_labeled = set(labeled_trace)
+
+        # matches traces and masks with a single gather over all spots
+        try:
+            if trace_mode == "com":
+                trace_values, trace_in_bounds = gather_mask(
+                    mask,
+                    centers_of_mass,
+                    pixel_size=pixel_size,
+                    pixel_size_z=pixel_size_z,
+                )
+                values = trace_values[trace_codes]
+                in_bounds = trace_in_bounds[trace_codes]
+            else:
+                values, in_bounds = gather_mask(
+                    mask, trace.data, pixel_size=pixel_size, pixel_size_z=pixel_size_z
+                )
+        except ValueError as error:
+            print(f"ERROR: {error}")
+            sys.exit(-1)
+
+        if trace_mode == "fraction":
+            values = vote_by_trace(
+                values,
+                trace.trace_index,
+                labeled_mask=labeled_mask,
+                min_fraction=min_fraction,
+            )[trace_codes]
+
+        if labeled_mask:
+            inside = values != 0
+            mask_ids = np.where(mask_ids == 0, values, mask_ids)
+        else:
+            inside = values == 1
+
+        # labels are appended as comma separated lists. Thus a trace can have multiple labels
+        trace.add_label(label, inside)
+
+        number_outside = np.count_nonzero(~in_bounds)
+        if number_outside:
+            print(
+                f"! {number_outside} trace rows fall outside the mask image {mask.shape} and were not labeled"
+            )
+        unique_traces_labeled = np.unique(trace_ids[inside])
         print(
-            f"\n> {index} trace rows out of {len(trace.data)} were associated to mask {label}. Unique traces: {len(unique_traces_labeled)}"
+            f"\n> {np.count_nonzero(inside)} trace rows out of {len(trace.data)} were associated to mask {label}. Unique traces: {len(unique_traces_labeled)}"
+        )
+
+    if labeled_mask:
+        trace.data["Mask_id"] = mask_ids
+        print(
+            f"> {len(np.unique(mask_ids[mask_ids > 0]))} mask labels written to 'Mask_id'"
         )
-    else:
-        print(f"ERROR: No mask image file found with name: {mask_file}")
-        sys.exit(-1)
     return trace
 
 
-def process_traces(trace_files=[], mask_file="", label="labeled", pixel_size=0.1):
+def process_traces(
+    trace_files=[],
+    mask_files=[],
+    labels=["labeled"],
+    pixel_size=0.1,
+    pixel_size_z=0.25,
+    labeled_mask=False,
+    trace_mode="spot",
+    min_fraction=0.5,
+):
     print(
         "\n{} trace files to process= {}".format(
             len(trace_files), "\n".join(map(str, trace_files))
         )
     )
     if trace_files:
+        output_label = "_".join(labels)
         # iterates over traces in folder
         for trace_file in trace_files:
             trace = ChromatinTraceTable()
             trace.initialize()
             # reads new trace
             trace.load(trace_file)
-            trace = assign_masks(trace, mask_file, label=label, pixel_size=pixel_size)
-            outputfile = trace_file.rstrip(".ecsv") + "_" + label + ".ecsv"
-            trace.save(outputfile, trace.data, comments=label)
+            trace = assign_masks(
+                trace,
+                mask_files,
+                labels=labels,
+                pixel_size=pixel_size,
+                pixel_size_z=pixel_size_z,
+                labeled_mask=labeled_mask,
+                trace_mode=trace_mode,
+                min_fraction=min_fraction,
+            )
+            outputfile = os.path.splitext(trace_file)[0] + "_" + output_label + ".ecsv"
+            trace.save(outputfile, comments=",".join(labels))
             print(f"$ Saved output trace file at: {outputfile}")
 
 
@@ -127,9 +427,13 @@ def main():
     print("=" * 10 + "Started execution" + "=" * 10)
     process_traces(
         trace_files=p["trace_files"],
-        mask_file=p["mask_file"],
-        label=p["label"],
+        mask_files=p["mask_files"],
+        labels=p["labels"],
         pixel_size=p["pixel_size"],
+        pixel_size_z=p["pixel_size_z"],
+        labeled_mask=p["labeled_mask"],
+        trace_mode=p["trace_mode"],
+        min_fraction=p["min_fraction"],
     )
     print("=" * 9 + "Finished execution" + "=" * 9)
 
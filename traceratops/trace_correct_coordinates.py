@@ -4,7 +4,8 @@
 Correct z-offsets for chromatin traces.
 
 This script corrects chromatin trace localization errors by adjusting the z-coordinate of barcodes
-to minimize their deviation from the center of mass (CoM) of their respective traces.
+(and optionally x and y) to minimize their deviation from the center of mass (CoM) of their
+respective traces.
 """
 
 import argparse
@@ -13,6 +14,8 @@ import os
 import numpy as np
 from astropy.table import Table
 
+from traceratops.core.chromatin_trace_table import TraceIndex
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description=__doc__)
@@ -35,6 +38,13 @@ def parse_arguments():
         default=0.01,
         help="Convergence threshold for Z shifts (default: 0.01).",
     )
+    parser.add_argument(
+        "--coordinates",
+        nargs="+",
+        choices=["x", "y", "z"],
+        default=["z"],
+        help="Coordinates to correct (default: z). Example: --coordinates x y z",
+    )
     return parser
 
 
@@ -52,27 +62,30 @@ def compute_center_of_mass(trace_table):
     dict
         A dictionary mapping each Trace_ID to its (x, y, z) center of mass.
     """
-    com_dict = {}
-    trace_table_by_id = trace_table.group_by("Trace_ID")
+    trace_index = TraceIndex(trace_table["Trace_ID"])
+    com = [trace_index.mean(trace_table[coor]) for coor in ("x", "y", "z")]
 
-    for sub_trace in trace_table_by_id.groups:
-        trace_id = sub_trace["Trace_ID"][0]
-        com_x = np.mean(sub_trace["x"])
-        com_y = np.mean(sub_trace["y"])
-        com_z = np.mean(sub_trace["z"])
-        com_dict[trace_id] = (com_x, com_y, com_z)
+    return {
+        trace_id: (com[0][i], com[1][i], com[2][i])
+        for i, trace_id in enumerate(trace_index.keys)
+    }
 
-    return com_dict
 
-
-def optimize_z_offsets(trace_table, max_iter=10, tolerance=0.01):
+def optimize_offsets(trace_table, coordinates=("z",), max_iter=10, tolerance=0.01):
     """
-    Iteratively correct Z-offsets by optimizing barcode positions.
+    Iteratively correct per-barcode offsets along the requested coordinates.
+
+    Each iteration is made of two grouped means per coordinate: the center of
+    mass of every trace (TraceIndex over Trace_ID), then the mean deviation of
+    every barcode from the CoM of its traces (TraceIndex over Barcode #). The
+    shift of each barcode is then applied to all its spots.
 
     Parameters:
     ----------
     trace_table : astropy.table.Table
         Input chromatin trace table.
+    coordinates : sequence of str
+        Coordinates to correct, among 'x', 'y' and 'z'.
     max_iter : int
         Maximum number of iterations.
     tolerance : float
@@ -81,46 +94,53 @@ def optimize_z_offsets(trace_table, max_iter=10, tolerance=0.01):
     Returns:
     -------
     astropy.table.Table
-        Corrected trace table with updated Z-coordinates.
+        Corrected trace table with updated coordinates.
     """
     new_trace_table = Table(trace_table)  # Copy input table for modification
-    unique_barcodes = np.unique(trace_table["Barcode #"])
-
-    for iteration in range(max_iter):
-        print(f"Iteration {iteration + 1}/{max_iter}...")
-
-        com_dict = compute_center_of_mass(new_trace_table)  # Compute updated CoMs
-        z_shifts = np.zeros(len(unique_barcodes))  # Track shifts for convergence check
-
-        for i, barcode in enumerate(unique_barcodes):
-            barcode_indices = np.where(new_trace_table["Barcode #"] == barcode)[0]
 
-            if len(barcode_indices) == 0:
-                continue
+    trace_index = TraceIndex(new_trace_table["Trace_ID"])
+    barcode_index = TraceIndex(new_trace_table["Barcode #"])
 
-            # Extract Z-coordinates and corresponding trace CoMs
-            barcode_z_values = new_trace_table["z"][barcode_indices]
-            trace_ids = new_trace_table["Trace_ID"][barcode_indices]
+    # works on float64 copies and writes them back once converged
+    positions = {
+        coor: np.asarray(new_trace_table[coor], dtype=np.float64).copy()
+        for coor in coordinates
+    }
 
-            com_z_values = np.array([com_dict[trace_id][2] for trace_id in trace_ids])
-
-            # Compute optimal shift as the mean difference
-            z_shift = np.mean(com_z_values - barcode_z_values)
-            z_shifts[i] = abs(z_shift)  # Track shift magnitude for convergence check
+    for iteration in range(max_iter):
+        print(f"Iteration {iteration + 1}/{max_iter}...")
 
-            # Apply the shift to the barcode across all traces
-            new_trace_table["z"][barcode_indices] += z_shift
+        max_shift = 0.0
+        for coor, values in positions.items():
+            com = trace_index.mean(values)
+            shifts = barcode_index.mean(trace_index.broadcast(com) - values)
+            values += barcode_index.broadcast(shifts)
+            if len(barcode_index):
+                max_shift = max(max_shift, np.max(np.abs(shifts)))
 
-        max_shift = np.max(z_shifts)
-        print(f"Max Z shift in iteration: {max_shift:.4f}")
+        print(f"Max {'/'.join(coordinates)} shift in iteration: {max_shift:.4f}")
 
         if max_shift < tolerance:
             print("Convergence reached!")
             break
 
+    for coor, values in positions.items():
+        new_trace_table[coor][:] = values
+
     return new_trace_table
 
 
+def optimize_z_offsets(trace_table, max_iter=10, tolerance=0.01):
+    """
+    Iteratively correct Z-offsets by optimizing barcode positions.
+
+    See ``optimize_offsets``, of which this is the z-only case.
+    """
+    return optimize_offsets(
+        trace_table, coordinates=("z",), max_iter=max_iter, tolerance=tolerance
+    )
+
+
 def main():
     parser = parse_arguments()
     args = parser.parse_args()
@@ -136,12 +156,12 @@ def main():
     print(f"Loading trace table: {args.input}")
     trace_table = Table.read(args.input, format="ascii.ecsv")
 
-    # Apply Z-offset correction
+    # Apply offset correction
     print(
-        f"Optimizing Z-offsets with max {args.max_iter} iterations and tolerance {args.tolerance}..."
+        f"Optimizing {'/'.join(args.coordinates)}-offsets with max {args.max_iter} iterations and tolerance {args.tolerance}..."
     )
-    corrected_trace_table = optimize_z_offsets(
-        trace_table, args.max_iter, args.tolerance
+    corrected_trace_table = optimize_offsets(
+        trace_table, args.coordinates, args.max_iter, args.tolerance
     )
 
     # Save the corrected trace table
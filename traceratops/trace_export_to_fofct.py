@@ -11,16 +11,20 @@ We use a JSON file to store the metadata of the experiment, such as:
 - contact information
 
 required_keys = ["genome_assembly", "experimenter_name", "experimenter_contact"]
+
+The CSV body is written by blocks of rows and can be gzip-compressed (``--gzip``).
 """
 
-import csv
 import json
 import os
 from argparse import ArgumentParser
 
+import numpy as np
 import pandas as pd
 from astropy.io import ascii
 
+from traceratops.core.chromatin_trace_table import open_text, write_csv_blocks
+
 
 def parse_arguments():
     parser = ArgumentParser(description=__doc__)
@@ -35,6 +39,17 @@ def parse_arguments():
     parser.add_argument(
         "--output_file", default=None, help="Path to the output CSV file"
     )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Compress the output CSV file with gzip (adds the ``.gz`` extension)",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100_000,
+        help="Number of rows formatted at once when writing the CSV file (default: 100000)",
+    )
     return parser
 
 
@@ -87,35 +102,49 @@ def get_output_file(ecsv_file, output_file):
     return os.getcwd() + os.sep + basename + "_FOFCT" + ".csv"
 
 
-def find_chrom_info(bed_data, barcode_id):
-    # Find the row with the given barcode ID
-    barcode_row = bed_data[bed_data["Barcode_ID"] == barcode_id]
+def find_chrom_info(bed_data, barcode_ids):
+    """
+    Finds the rows of the BED file matching each barcode ID with a sorted-key lookup.
 
-    # Check if the barcode ID was found
-    if len(barcode_row) == 0:
-        raise ValueError(f"Barcode ID '{barcode_id}' not found in the BED file")
+    Parameters
+    ----------
+    bed_data : pandas.DataFrame
+        BED file content.
+    barcode_ids : array-like
+        barcode ID of each spot.
 
-    # Extract the chromosome and start position
-    chrom = barcode_row["chrName"].values[0]
-    start = barcode_row["startSeq"].values[0]
-    end = barcode_row["endSeq"].values[0]
+    Returns
+    -------
+    numpy.ndarray
+        index of the matching BED row of each spot.
+    """
+    barcode_ids = np.asarray(barcode_ids)
+    bed_ids = bed_data["Barcode_ID"].to_numpy()
+    if len(bed_ids) == 0:
+        raise ValueError("No barcode ID found in the BED file")
 
-    return chrom, start, end
+    order = np.argsort(bed_ids, kind="stable")
+    position = np.searchsorted(bed_ids, barcode_ids, sorter=order)
+    rows = order[np.clip(position, 0, len(bed_ids) - 1)]
+    found = bed_ids[rows] == barcode_ids
 
+    # Check if the barcode IDs were found
+    if not found.all():
+        missing = np.unique(barcode_ids[~found])
+        raise ValueError(f"Barcode ID(s) {missing.tolist()} not found in the BED file")
 
-def assign_chrom_info(ecsv_data, bed_data):
-    # Loop over the rows in the ECSV data
-    for i, row in enumerate(ecsv_data):
-        # Extract the barcode ID
-        barcode_id = row["Barcode #"]
+    return rows
 
-        # Find the chromosome information
-        chrom, start, end = find_chrom_info(bed_data, barcode_id)
 
-        # Assign the chromosome information to the new columns
-        ecsv_data["Chrom"][i] = chrom
-        ecsv_data["Chrom_Start"][i] = start
-        ecsv_data["Chrom_End"][i] = end
+def assign_chrom_info(ecsv_data, bed_data):
+    # Join the chromosome information of all the spots at once
+    bed_data = bed_data.drop_duplicates(subset="Barcode_ID")
+    rows = find_chrom_info(bed_data, ecsv_data["Barcode #"])
+
+    # Assign the chromosome information to the new columns
+    ecsv_data.replace_column("Chrom", bed_data["chrName"].to_numpy().astype(str)[rows])
+    ecsv_data.replace_column("Chrom_Start", bed_data["startSeq"].to_numpy()[rows])
+    ecsv_data.replace_column("Chrom_End", bed_data["endSeq"].to_numpy()[rows])
 
     return ecsv_data
 
@@ -135,15 +164,13 @@ def rename_pyhim_columns(ecsv_data):
     return ecsv_data
 
 
-def write_fof_ct_csv(csv_file, header, ecsv_data):
-    # Open the CSV file for writing
-    with open(csv_file, "w", newline="") as f:
+def write_fof_ct_csv(csv_file, header, ecsv_data, chunksize=100_000):
+    # Open the CSV file for writing, gzip-compressed if it ends with .gz
+    with open_text(csv_file, "w") as f:
         f.write(header)
 
-        writer = csv.writer(f)
-        # Write the data
-        for row in ecsv_data:
-            writer.writerow(row)
+        # Write the data by blocks of rows
+        write_csv_blocks(f, ecsv_data, chunksize=chunksize, lineterminator="\r\n")
     print(f"CSV file written to '{csv_file}'")
 
 
@@ -161,6 +188,9 @@ def get_authors_from_copyright():
     copyright_path = os.path.join(
         os.path.dirname(os.path.realpath(__file__)), "..", "..", "COPYRIGHT.txt"
     )
+    if not os.path.exists(copyright_path):
+        print(f"[WARNING] No authors file found at '{copyright_path}'")
+        return ""
     with open(copyright_path, "r") as f:
         authors = f.read().splitlines()
         authors_formatting = ""
@@ -206,6 +236,7 @@ def convert_ecsv_to_csv(
     genome_assembly,
     experimenter_name,
     experimenter_contact,
+    chunksize=100_000,
 ):
     # Load files
     ecsv_data = load_trace_ecsv_file(ecsv_file)
@@ -221,10 +252,10 @@ def convert_ecsv_to_csv(
         genome_assembly, experimenter_name, experimenter_contact
     )
     # Write the CSV file
-    write_fof_ct_csv(csv_file, header, ecsv_data)
+    write_fof_ct_csv(csv_file, header, ecsv_data, chunksize=chunksize)
 
 
-if __name__ == "__main__":
+def main():
     parser = parse_arguments()
     args = parser.parse_args()
 
@@ -234,6 +265,8 @@ if __name__ == "__main__":
     check_metadata(metadata)
 
     output = get_output_file(args.ecsv_file, args.output_file)
+    if args.gzip and not output.endswith(".gz"):
+        output += ".gz"
 
     convert_ecsv_to_csv(
         args.ecsv_file,
@@ -242,4 +275,9 @@ if __name__ == "__main__":
         metadata["genome_assembly"],
         metadata["experimenter_name"],
         metadata["experimenter_contact"],
+        chunksize=args.chunksize,
     )
+
+
+if __name__ == "__main__":
+    main()
@@ -263,7 +263,7 @@ def runtime(
         trace.initialize()
         comments = list()
         # reads new trace
-        trace.load(trace_file)
+        trace.load(trace_file, encode_ids=True)
 
         trace = filter_duplicat(
             remove_duplicate_spots,
@@ -18,6 +18,14 @@ import pandas as pd
 from astropy.io import ascii
 from astropy.table import Table
 
+from traceratops.core.chromatin_trace_table import (
+    GENOMIC_COORDINATES,
+    factorize_genomic_coordinates,
+    open_text,
+    read_fofct_csv,
+    strip_gz,
+)
+
 
 def parse_arguments():
     parser = ArgumentParser(description=__doc__)
@@ -26,12 +34,18 @@ def parse_arguments():
     parser.add_argument(
         "--output_file", default=None, help="Path to the output ECSV file"
     )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=1_000_000,
+        help="Number of rows of the FOFCT file parsed at once (default: 1000000)",
+    )
     return parser
 
 
 def read_column_names_from_csv(csv_file):
     # Read the file line by line until finding the `##columns` line
-    with open(csv_file, "r") as file:
+    with open_text(csv_file) as file:
         for line in file:
             if line.startswith("##columns"):
                 # Extract column names, strip leading spaces and return them
@@ -40,9 +54,9 @@ def read_column_names_from_csv(csv_file):
     raise ValueError("No `##columns` line found in the FOFCT file.")
 
 
-def load_csv_file(csv_file, column_names):
-    # Load the CSV file using pandas, assigning the correct column names
-    data = pd.read_csv(csv_file, comment="#", header=None, names=column_names)
+def load_csv_file(csv_file, column_names, chunksize=1_000_000):
+    # Load the CSV file in chunks using pandas, assigning the correct column names
+    data = read_fofct_csv(csv_file, column_names, chunksize=chunksize)
     print(f"FOFCT file loaded from '{csv_file}'")
     print(
         f"Columns in FOFCT file: {list(data.columns)}"
@@ -68,37 +82,42 @@ def validate_columns(data):
     print("All required columns are present in the FOFCT file.")
 
 
-def find_barcode_id(bed_data, chrom, chrom_start, chrom_end):
-    # Match the chromosome and start/end positions to find the Barcode ID
-    barcode_row = bed_data[
-        (bed_data["chrName"] == chrom)
-        & (bed_data["startSeq"] == chrom_start)
-        & (bed_data["endSeq"] == chrom_end)
-    ]
-    if len(barcode_row) == 0:
-        raise ValueError(
-            f"Chromosome information not found in the BED file for {chrom}:{chrom_start}-{chrom_end}"
-        )
-    return barcode_row["Barcode_ID"].values[0]
+def find_barcode_ids(bed_data, coordinates):
+    """
+    Joins unique (Chrom, Chrom_Start, Chrom_End) triplets with the BED file.
+
+    Returns
+    -------
+    pandas.Series
+        Barcode ID of each triplet, <NA> if not found in the BED file.
+    """
+    bed_keys = bed_data.rename(
+        columns={"chrName": "Chrom", "startSeq": "Chrom_Start", "endSeq": "Chrom_End"}
+    ).drop_duplicates(subset=GENOMIC_COORDINATES)
+    bed_keys["Chrom"] = bed_keys["Chrom"].astype(str)
+    coordinates = coordinates.astype({"Chrom": str})
+    matched = coordinates.merge(bed_keys, on=GENOMIC_COORDINATES, how="left")
+    return matched["Barcode_ID"].astype("Int64")
 
 
 def add_missing_columns(data, bed_data):
     # Validate that all necessary columns are present in the data
     validate_columns(data)
 
-    # Add Barcode #, Mask_id, and label columns
-    barcode_ids = []
-    for index, row in data.iterrows():
-        try:
-            barcode_id = find_barcode_id(
-                bed_data, row["Chrom"], row["Chrom_Start"], row["Chrom_End"]
-            )
-            barcode_ids.append(barcode_id)
-        except ValueError as e:
-            print(f"Error processing row {index}: {e}")
-            barcode_ids.append(None)  # Append None if not found
+    # Add Barcode # by joining the unique genomic coordinates with the BED file
+    codes, coordinates = factorize_genomic_coordinates(data)
+    barcode_ids = find_barcode_ids(bed_data, coordinates)
+
+    missing = barcode_ids.isna().to_numpy()
+    if missing.any():
+        number_rows = int(missing[codes].sum())
+        print(
+            f"Error: {number_rows} rows have chromosome information not found in the BED file:"
+        )
+        for row in coordinates[missing].head(10).itertuples(index=False):
+            print(f"  {row.Chrom}:{row.Chrom_Start}-{row.Chrom_End}")
 
-    data["Barcode #"] = barcode_ids
+    data["Barcode #"] = barcode_ids.array.take(codes)
     data["Mask_id"] = -1  # Placeholder for Mask_id (customize as needed)
     data["label"] = "None"  # Placeholder for label (customize as needed)
 
@@ -130,7 +149,7 @@ def main():
     column_names = read_column_names_from_csv(args.fofct_file)
 
     # Load the files
-    csv_data = load_csv_file(args.fofct_file, column_names)
+    csv_data = load_csv_file(args.fofct_file, column_names, chunksize=args.chunksize)
     bed_data = load_barcode_bed_file(args.bed_file)
 
     # Add missing columns
@@ -143,7 +162,7 @@ def main():
     output_file = (
         args.output_file
         if args.output_file
-        else args.fofct_file.replace(".csv", ".ecsv")
+        else strip_gz(args.fofct_file).replace(".csv", ".ecsv")
     )
 
     # Convert to ECSV format and save
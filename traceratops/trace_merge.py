@@ -11,16 +11,28 @@ Usage example:
 
     ``trace_merge --traces <folder_path_with_trace_files>``
 
+    or, to write rows to the output file as they are read (bounded memory):
+
+    ``ls trace*.ecsv | trace_merge --stream``
+
 outputs
 
 ChromatinTraceTable() object and output .ecsv formatted file with assembled trace tables.
 """
 
 import argparse
+import io
 import os
 import sys
 
-from traceratops.core.chromatin_trace_table import ChromatinTraceTable
+from astropy.table import vstack
+
+from traceratops.core.chromatin_trace_table import (
+    ChromatinTraceTable,
+    read_ecsv_header,
+    remap_rois,
+    save_table_to_ecsv,
+)
 
 
 def parse_arguments():
@@ -43,6 +55,11 @@ def parse_arguments():
         help="Output folder (default: ``Current Working Directory``)",
         default=None,
     )
+    parser.add_argument(
+        "--stream",
+        help="Write each input file to the output as soon as it is read instead of merging in memory (ECSV inputs only)",
+        action="store_true",
+    )
     return parser
 
 
@@ -68,16 +85,25 @@ def get_files_from_args(args):
 
 
 def appends_traces(traces, trace_files):
+    """
+    Reads all trace files once and concatenates them to <traces> in a single vstack.
+
+    ROI conflicts are resolved file by file (see ``remap_rois``) so each row is
+    only copied once, whatever the number of files.
+    """
     new_trace = ChromatinTraceTable()
+    used_rois = set(traces.data["ROI #"].tolist())
+    tables = []
     # iterates over traces in folder
     for trace_file in trace_files:
         # reads new trace
-        new_trace.load(trace_file)
+        table = new_trace.load(trace_file)
+        table["ROI #"] = remap_rois(table["ROI #"], used_rois)
         # adds it to existing trace collection
-
-        traces.append(new_trace.data)
+        tables.append(table)
         traces.number_traces += 1
-        print(f" $ appended trace file with {len(new_trace.data)} traces")
+        print(f" $ appended trace file with {len(table)} traces")
+    traces.data = vstack([traces.data] + tables)
     print(f" $ Merged trace file will contain {len(traces.data)} traces")
     return traces
 
@@ -92,6 +118,75 @@ def load_traces(trace_files=[]):
     return traces
 
 
+def plan_merge(trace_files, comments=""):
+    """
+    Reads the headers of all trace files to check that they can be streamed
+    into a single ECSV file and builds the metadata of the merged table.
+
+    Returns
+    -------
+    dict
+        meta of the merged table.
+    """
+    traces = ChromatinTraceTable()
+    traces.initialize()
+    merged_comments = list(traces.data.meta["comments"])
+    datatype = None
+    for trace_file in trace_files:
+        if os.path.splitext(trace_file)[1].lower() != ".ecsv":
+            raise ValueError(f"--stream only supports ECSV trace files: {trace_file}")
+        header = read_ecsv_header(trace_file)
+        if datatype is None:
+            datatype = header["datatype"]
+        elif header["datatype"] != datatype:
+            raise ValueError(
+                f"Columns of {trace_file} differ from {trace_files[0]}, merge without --stream"
+            )
+        merged_comments.extend(header.get("meta", {}).get("comments", []))
+
+    merged_comments = [com for com in dict.fromkeys(merged_comments) if com]
+    merged_comments.append(comments)
+    return {"comments": merged_comments}
+
+
+def stream_traces(trace_files, output_file, comments=""):
+    """
+    Merges trace files by writing their rows to <output_file> as they are read.
+
+    Headers are read first to plan the output, then every file is read once,
+    its ROIs remapped and its rows appended to the output, so that only one
+    input table is held in memory at a time.
+
+    Returns
+    -------
+    int
+        number of rows written.
+    """
+    meta = plan_merge(trace_files, comments=comments)
+    new_trace = ChromatinTraceTable()
+    used_rois = set()
+    number_rows = 0
+    with open(output_file, "w", encoding="utf-8") as f_out:
+        for idx, trace_file in enumerate(trace_files):
+            table = new_trace.load(trace_file)
+            table["ROI #"] = remap_rois(table["ROI #"], used_rois)
+            table.meta = meta if idx == 0 else {}
+            buffer = io.StringIO()
+            save_table_to_ecsv(table, buffer)
+            lines = buffer.getvalue().splitlines(keepends=True)
+            if idx > 0:
+                # drops ECSV header and column names line
+                first_row = next(
+                    i for i, line in enumerate(lines) if not line.startswith("#")
+                )
+                lines = lines[first_row + 1 :]
+            f_out.writelines(lines)
+            number_rows += len(table)
+            print(f" $ streamed trace file with {len(table)} traces")
+    print(f" $ Merged trace file contains {number_rows} traces")
+    return number_rows
+
+
 def create_out_folder(folder_path):
     if not os.path.exists(folder_path):
         os.mkdir(folder_path)
@@ -110,11 +205,18 @@ def main():
         raise ValueError("\nNothing to process...\n")
     args_folder = args.folder or os.getcwd()
     create_out_folder(args_folder)
-    traces = load_traces(trace_files)
-    traces.save(
-        args.name,
-        comments="appended_trace_files=" + str(traces.number_traces),
-    )
+    if args.stream:
+        stream_traces(
+            trace_files,
+            args.name,
+            comments="appended_trace_files=" + str(len(trace_files)),
+        )
+    else:
+        traces = load_traces(trace_files)
+        traces.save(
+            args.name,
+            comments="appended_trace_files=" + str(traces.number_traces),
+        )
 
     print("Finished execution")
 
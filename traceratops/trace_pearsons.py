@@ -15,8 +15,6 @@ import itertools
 import os
 import select
 import sys
-from collections import defaultdict
-from itertools import combinations
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -152,13 +150,13 @@ def find_unique_substrings(filenames):
     return unique_identifiers
 
 
-def accumulate_distances(trace_data):
+def accumulate_distances(trace):
     """
     Calculate pairwise distances between barcodes across all traces.
 
     Parameters:
     ----------
-    trace_data : ChromatinTraceTable
+    trace : ChromatinTraceTable
         Table containing trace data with barcode positions
 
     Returns:
@@ -166,23 +164,38 @@ def accumulate_distances(trace_data):
     dict
         Dictionary mapping barcode pairs to their median distances
     """
-    distances = defaultdict(list)
-    trace_groups = trace_data.group_by("Trace_ID").groups
-
-    for trace in trace_groups:
-        barcode_positions = {
-            row["Barcode #"]: np.array([row["x"], row["y"], row["z"]])
-            for row in trace
-            if not np.isnan(row["x"])
-        }
-        for bc1, bc2 in combinations(barcode_positions, 2):
-            p1 = barcode_positions[bc1]
-            p2 = barcode_positions[bc2]
-            dist = np.linalg.norm(p1 - p2)
-            key = tuple(sorted((bc1, bc2)))
-            distances[key].append(dist)
+    pairs, distances = [], []
+    trace_data = trace.data
+    traces = trace.trace_index.iterate(
+        trace_data["Barcode #"], trace_data["x"], trace_data["y"], trace_data["z"]
+    )
 
-    return {key: np.median(vals) for key, vals in distances.items()}
+    for _, (barcodes, x, y, z) in traces:
+        # keeps the last localized spot of each barcode
+        valid = ~np.isnan(x)
+        barcodes = barcodes[valid][::-1]
+        positions = np.stack([x, y, z], axis=1)[valid][::-1]
+        barcodes, last = np.unique(barcodes, return_index=True)
+        positions = positions[last]
+
+        bc1, bc2 = np.triu_indices(len(barcodes), k=1)
+        pairs.append(np.stack([barcodes[bc1], barcodes[bc2]], axis=1))
+        distances.append(np.linalg.norm(positions[bc1] - positions[bc2], axis=1))
+
+    if not pairs:
+        return {}
+
+    # median distance of each barcode pair
+    pairs, distances = np.concatenate(pairs), np.concatenate(distances)
+    unique_pairs, inverse = np.unique(pairs, axis=0, return_inverse=True)
+    order = np.argsort(inverse.ravel(), kind="stable")
+    splits = np.cumsum(np.bincount(inverse.ravel(), minlength=len(unique_pairs)))
+    return {
+        (bc1, bc2): np.median(values)
+        for (bc1, bc2), values in zip(
+            unique_pairs.tolist(), np.split(distances[order], splits[:-1])
+        )
+    }
 
 
 def compare_distance_maps(distance_maps):
@@ -319,8 +332,8 @@ def main():
     for fpath in trace_files:
         print(f"Processing {os.path.basename(fpath)}")
         trace = ChromatinTraceTable()
-        trace.load(fpath)
-        distance_maps[fpath] = accumulate_distances(trace.data)
+        trace.load(fpath, encode_ids=True)
+        distance_maps[fpath] = accumulate_distances(trace)
 
     # Compare distance maps and generate correlation matrix
     files, corr_matrix = compare_distance_maps(distance_maps)
@@ -7,18 +7,24 @@ Takes a trace file and either:
     - ranks traces and plots a selection
     - plots a user-selected trace in .ecsv (barcode, xyz) and PDF formats. The output files contain the trace name.
     - saves output coordinates for selected traces in pdb format so they can be loaded by other means including https://www.rcsb.org/3d-view, pymol, or nglviewer.
-
-future:
-    - output PDBs for all the traces in a trace file
+    - outputs PDBs for all the traces in a trace file, either one file per trace or
+      a single multi-model PDB file (--single_file).
 """
 
 import argparse
 import os
 import select
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 from traceratops.core.chromatin_trace_table import ChromatinTraceTable
-from traceratops.core.him_matrix_operations import write_xyz_2_pdb
+from traceratops.core.him_matrix_operations import (
+    complete_barcode_type,
+    format_pdb_traces,
+    sort_traces,
+)
 from traceratops.core.io_manager import create_folder, load_barcode_dict
 
 
@@ -37,6 +43,15 @@ def parse_arguments():
     parser.add_argument(
         "--all", help="plots all traces in trace file", action="store_true"
     )
+    parser.add_argument(
+        "--single_file",
+        help="writes all traces of a trace file as models of a single PDB file",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--n_workers",
+        help="Number of worker processes used to write PDB files. Default = 1",
+    )
     parser.add_argument(
         "--pipe", help="inputs Trace file list from stdin (pipe)", action="store_true"
     )
@@ -84,6 +99,13 @@ def create_dict_args(args):
     else:
         p["select_traces"] = "selected"
 
+    p["single_file"] = args.single_file
+
+    if args.n_workers:
+        p["n_workers"] = int(args.n_workers)
+    else:
+        p["n_workers"] = 1
+
     p["trace_files"] = []
     if args.pipe:
         p["pipe"] = True
@@ -105,6 +127,125 @@ def create_dict_args(args):
     return p
 
 
+def write_pdb_files(folder_path, trace_ids, offsets, barcodes, xyz, barcode_type):
+    """
+    Writes one PDB file per trace from sorted traces (see ``sort_traces``).
+
+    Returns
+    -------
+    int
+        number of PDB files written.
+    """
+    blocks = format_pdb_traces(trace_ids, offsets, barcodes, xyz, barcode_type)
+    for trace_id, block, n_atoms in zip(trace_ids, blocks, np.diff(offsets)):
+        file_name = folder_path + os.sep + trace_id + ".pdb"
+        with open(file_name, mode="w+", encoding="utf-8") as fid:
+            fid.write(block)
+        print(f"Done writing {file_name:s} with {n_atoms:d} atoms.")
+    return len(blocks)
+
+
+def format_pdb_models(trace_ids, offsets, barcodes, xyz, barcode_type, first_model):
+    return "".join(
+        format_pdb_traces(
+            trace_ids,
+            offsets,
+            barcodes,
+            xyz,
+            barcode_type,
+            multi_model=True,
+            first_model=first_model,
+        )
+    )
+
+
+def split_traces(trace_ids, offsets, barcodes, xyz, n_chunks):
+    """
+    Splits sorted traces into <n_chunks> contiguous chunks of whole traces.
+
+    Returns
+    -------
+    list of tuples
+        (first trace index, trace_ids, offsets, barcodes, xyz) of each chunk,
+        with offsets starting at 0.
+    """
+    chunks = []
+    bounds = np.linspace(0, len(trace_ids), n_chunks + 1).astype(int)
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        if last > first:
+            start, end = offsets[first], offsets[last]
+            chunks.append(
+                (
+                    first,
+                    trace_ids[first:last],
+                    offsets[first : last + 1] - start,
+                    barcodes[start:end],
+                    xyz[:, start:end],
+                )
+            )
+    return chunks
+
+
+def export_traces(
+    trace_table,
+    barcode_type,
+    folder_path,
+    output_file=None,
+    n_workers=1,
+):
+    """
+    Writes all traces of a trace table in PDB format.
+
+    The table is sorted once by Trace_ID and Barcode #, and the traces are
+    formatted from the sorted column arrays.
+
+    Parameters
+    ----------
+    trace_table : astropy table
+        trace table.
+    barcode_type : dict
+        barcode (as string) to 3-character atom name.
+    folder_path : str
+        output folder of the per-trace PDB files.
+    output_file : str, optional
+        if given, writes all traces as models of this single PDB file.
+    n_workers : int, optional
+        number of worker processes. The default is 1.
+
+    Returns
+    -------
+    int
+        number of traces written.
+    """
+    trace_ids, offsets, barcodes, xyz = sort_traces(trace_table)
+    if len(trace_ids) == 0:
+        return 0
+    complete_barcode_type(barcode_type, np.unique(barcodes))
+
+    n_workers = max(1, min(n_workers, len(trace_ids)))
+    chunks = split_traces(trace_ids, offsets, barcodes, xyz, n_workers)
+
+    if output_file is None:
+        tasks = [(folder_path, *chunk[1:], barcode_type) for chunk in chunks]
+        return sum(map_tasks(write_pdb_files, tasks, n_workers))
+
+    tasks = [(*chunk[1:], barcode_type, chunk[0] + 1) for chunk in chunks]
+    with open(output_file, mode="w+", encoding="utf-8") as fid:
+        for models in map_tasks(format_pdb_models, tasks, n_workers):
+            fid.write(models)
+        fid.write("END\n")
+    print(f"Done writing {output_file:s} with {len(trace_ids):d} models.")
+    return len(trace_ids)
+
+
+def map_tasks(function, tasks, n_workers=1):
+    # runs function(*task) for each task, in a pool of processes if n_workers > 1
+    if n_workers < 2:
+        return [function(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(function, *zip(*tasks)))
+
+
 def runtime(
     N_barcodes=2,
     trace_files=[],
@@ -112,6 +253,8 @@ def runtime(
     barcode_type=dict(),
     folder_path="./PDBs",
     select_traces="one",
+    single_file=False,
+    n_workers=1,
 ):
     # gets trace files
 
@@ -133,34 +276,31 @@ def runtime(
             # filters trace
             trace.filter_traces_by_n(minimum_number_barcodes=N_barcodes)
 
-            # indexes traces by Trace_ID
             trace_table = trace.data
-            trace_table_indexed = trace_table.group_by("Trace_ID")
-            print("$ number of traces to process: {}".format(len(trace_table_indexed)))
-
-            # iterates over traces
-            for idx, single_trace in enumerate(trace_table_indexed.groups):
-                trace_id = single_trace["Trace_ID"][0]
-                flag = False
-
-                if select_traces == "selected" and trace_id == selected_trace:
-                    flag = True
-                elif select_traces == "all":
-                    flag = True
-
-                if flag:
-                    print("Converting trace ID: {}".format(trace_id))
-
-                    # sorts by barcode
-                    new_trace = single_trace.copy()
-                    new_trace = new_trace.group_by("Barcode #")
-                    # ascii.write(new_trace['Barcode #', 'x','y','z'], selected_trace+'.ecsv', overwrite=True)
-
-                    write_xyz_2_pdb(
-                        folder_path + os.sep + trace_id + ".pdb",
-                        new_trace,
-                        barcode_type,
-                    )
+            if select_traces != "all":
+                trace_table = trace_table[trace_table["Trace_ID"] == selected_trace]
+            print(
+                "$ number of traces to process: {}".format(
+                    len(np.unique(trace_table["Trace_ID"]))
+                )
+            )
+
+            output_file = None
+            if single_file:
+                output_file = (
+                    folder_path
+                    + os.sep
+                    + os.path.splitext(os.path.basename(trace_file))[0]
+                    + ".pdb"
+                )
+
+            export_traces(
+                trace_table,
+                barcode_type,
+                folder_path,
+                output_file=output_file,
+                n_workers=n_workers,
+            )
     else:
         print("No trace file found to process!")
 
@@ -189,6 +329,8 @@ def main():
         barcode_type=barcode_type,
         folder_path=folder_path,
         select_traces=p["select_traces"],
+        single_file=p["single_file"],
+        n_workers=p["n_workers"],
     )
 
     print(f"Processed <{n_traces_processed}> trace file(s)")
@@ -73,12 +73,6 @@ def generate_unique_id():
     return str(uuid.uuid4())
 
 
-def compute_radius_of_gyration(coords):
-    """Computes the radius of gyration (Rg) for a given trace."""
-    center_of_mass = np.mean(coords, axis=0)
-    return np.sqrt(np.mean(np.sum((coords - center_of_mass) ** 2, axis=1)))
-
-
 def split_large_traces(trace_table, std_threshold, num_clusters):
     """
     Identifies traces with large Rg and applies K-means clustering to split them.
@@ -96,11 +90,9 @@ def split_large_traces(trace_table, std_threshold, num_clusters):
     -------
     None (modifies trace_table in place)
     """
-    trace_table_by_id = trace_table.data.group_by("Trace_ID")
-    rg_values = [
-        compute_radius_of_gyration(np.vstack((trace["x"], trace["y"], trace["z"])).T)
-        for trace in trace_table_by_id.groups
-    ]
+    data = trace_table.data
+    trace_index = trace_table.trace_index
+    rg_values = trace_index.radius_of_gyration(data["x"], data["y"], data["z"])
 
     mean_rg, std_rg = np.mean(rg_values), np.std(rg_values)
     rg_threshold = mean_rg + std_threshold * std_rg
@@ -109,34 +101,35 @@ def split_large_traces(trace_table, std_threshold, num_clusters):
         f"$ Mean Rg: {mean_rg:.3f}, Std Rg: {std_rg:.3f}, Threshold: {rg_threshold:.3f}"
     )
 
-    new_trace_table = trace_table.data.copy()
+    new_trace_table = data.copy()
     num_splits = 0
 
-    for sub_trace_table in trace_table_by_id.groups:
-        original_trace_id = sub_trace_table["Trace_ID"][0]
+    traces_to_split = np.flatnonzero(
+        (rg_values > rg_threshold) & (trace_index.count() > num_clusters)
+    )
+    for idx in traces_to_split:
+        original_indices = trace_index.rows(idx)
         coords = np.vstack(
-            (sub_trace_table["x"], sub_trace_table["y"], sub_trace_table["z"])
-        ).T
-        rg = compute_radius_of_gyration(coords)
-
-        if rg > rg_threshold and len(coords) > num_clusters:
-            print(
-                f"$ Splitting trace {original_trace_id} (Rg={rg:.3f}) into {num_clusters} clusters."
+            (
+                data["x"][original_indices],
+                data["y"][original_indices],
+                data["z"][original_indices],
             )
-            kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init=10)
-            labels = kmeans.fit_predict(coords)
+        ).T
+        print(
+            f"$ Splitting trace {trace_index.keys[idx]} (Rg={rg_values[idx]:.3f}) into {num_clusters} clusters."
+        )
+        kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init=10)
+        labels = kmeans.fit_predict(coords)
 
-            for cluster_label in np.unique(labels):
-                new_trace_id = generate_unique_id()
-                original_indices = np.where(
-                    trace_table.data["Trace_ID"] == original_trace_id
-                )[0]
-                cluster_indices = original_indices[np.where(labels == cluster_label)[0]]
-                new_trace_table["Trace_ID"][cluster_indices] = new_trace_id
+        for cluster_label in np.unique(labels):
+            new_trace_id = generate_unique_id()
+            cluster_indices = original_indices[np.where(labels == cluster_label)[0]]
+            new_trace_table["Trace_ID"][cluster_indices] = new_trace_id
 
-            num_splits += 1
+        num_splits += 1
 
-    print(f"$ Number of traces split: {num_splits}/{len(trace_table_by_id.groups)}")
+    print(f"$ Number of traces split: {num_splits}/{len(trace_index)}")
     trace_table.data = new_trace_table
 
 
@@ -21,7 +21,7 @@ def parse_arguments():
 
 def compute_trace_statistics(trace_file):
     trace_table = ChromatinTraceTable()
-    trace_table.load(trace_file)
+    trace_table.load(trace_file, encode_ids=True)
 
     if trace_table.data is None or len(trace_table.data) == 0:
         print("Error: The trace file is empty or could not be loaded.")